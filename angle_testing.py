@@ -3,9 +3,11 @@ from tkinter import filedialog, messagebox
 from PIL import Image, ImageTk
 import imagehash
 import cv2
-import numpy as np
 import json
 import os
+from descriptor_store import write_descriptor_store
+import image_features
+from image_features import ImageFeatures
 
 # ORB detector
 orb = cv2.ORB_create()
@@ -50,9 +52,10 @@ class ImageComparisonApp:
         file_path = filedialog.askopenfilename(title="Select the Original Image", filetypes=[("Image Files", "*.jpg *.png *.jpeg")])
         if file_path:
             try:
-                # Load the original image and convert it to OpenCV format
+                # Load the original image once; the OpenCV (BGR) view shares its pixels instead of copying them
                 self.original_image = Image.open(file_path)
-                self.original_image_cv = cv2.cvtColor(np.array(self.original_image), cv2.COLOR_RGB2BGR)
+                self.original_features = ImageFeatures.from_pil(self.original_image)
+                self.original_image_cv = self.original_features.bgr
                 
                 self.upload_comparisons_button.config(state=tk.NORMAL)  # Enable uploading of comparison images
                 messagebox.showinfo("Success", "Original image uploaded successfully.")
@@ -70,10 +73,13 @@ class ImageComparisonApp:
             # Load each comparison image and convert to OpenCV format
             self.comparison_images_cv = []
             self.comparison_images = []
+            self.comparison_features = []
             for path in file_paths:
                 img = Image.open(path)
+                features = ImageFeatures.from_pil(img)
                 self.comparison_images.append(img)
-                self.comparison_images_cv.append(cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR))
+                self.comparison_features.append(features)
+                self.comparison_images_cv.append(features.bgr)
             
             self.process_button.config(state=tk.NORMAL)  # Enable the comparison button
             messagebox.showinfo("Success", "4 comparison images uploaded successfully.")
@@ -81,22 +87,12 @@ class ImageComparisonApp:
             messagebox.showerror("Error", f"Error loading comparison images: {e}")
 
     def phash_similarity(self, img1, img2):
-        hash1 = imagehash.phash(Image.fromarray(cv2.cvtColor(img1, cv2.COLOR_BGR2RGB)))
-        hash2 = imagehash.phash(Image.fromarray(cv2.cvtColor(img2, cv2.COLOR_BGR2RGB)))
-        return 1 - (hash1 - hash2) / len(hash1.hash) ** 2
+        # Either side may be precomputed ImageFeatures
+        return image_features.phash_similarity(img1, img2)
 
     def orb_similarity(self, img1, img2):
-        kp1, des1 = orb.detectAndCompute(img1, None)
-        kp2, des2 = orb.detectAndCompute(img2, None)
-
-        if des1 is None or des2 is None:
-            return 0
-
-        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-        matches = bf.match(des1, des2)
-        good_matches = [m for m in matches if m.distance < 42]
-        similarity_percentage = len(good_matches) / min(len(kp1), len(kp2)) * 100
-        return min(similarity_percentage, 100)
+        # Either side may be precomputed ImageFeatures
+        return image_features.orb_similarity(img1, img2)
 
     def compare_images(self):
         if self.original_image_cv is None or len(self.comparison_images_cv) != 4:
@@ -105,10 +101,13 @@ class ImageComparisonApp:
 
         self.similarity_results = []  # Reset results for new processing
 
+        # The original's features are extracted once for all comparisons
+        original = self.original_features
+
         # Perform pHash and ORB comparisons between the original and each comparison image
-        for i, comp_img_cv in enumerate(self.comparison_images_cv, start=1):
-            phash_sim = self.phash_similarity(self.original_image_cv, comp_img_cv) * 100
-            orb_sim = self.orb_similarity(self.original_image_cv, comp_img_cv)
+        for i, comparison in enumerate(self.comparison_features, start=1):
+            phash_sim = self.phash_similarity(original, comparison) * 100
+            orb_sim = self.orb_similarity(original, comparison)
             result = f"Image {i} vs Original: pHash {round(phash_sim, 2)}%, ORB {round(orb_sim, 2)}%"
             self.similarity_results.append(result)
 
@@ -132,8 +131,11 @@ class ImageComparisonApp:
     def download_orb_json_files(self):
         save_dir = filedialog.askdirectory(title="Select folder to save ORB JSON files")
         if save_dir:
+            store_entries = []
+
             # Save ORB descriptors for the original image
             original_kp, original_des = orb.detectAndCompute(self.original_image_cv, None)
+            store_entries.append(("Original_Image", original_kp, original_des))
             if original_des is not None:
                 original_des_list = original_des.tolist()  # Convert descriptors to list format
                 with open(os.path.join(save_dir, "Original_Image_ORB.json"), "w") as f:
@@ -142,12 +144,16 @@ class ImageComparisonApp:
             # Save ORB descriptors for each comparison image
             for i, comp_img_cv in enumerate(self.comparison_images_cv, start=1):
                 kp, des = orb.detectAndCompute(comp_img_cv, None)
+                store_entries.append((f"Comparison_Image_{i}", kp, des))
                 if des is not None:
                     des_list = des.tolist()
                     with open(os.path.join(save_dir, f"Comparison_Image_{i}_ORB.json"), "w") as f:
                         json.dump(des_list, f)
 
-            messagebox.showinfo("Download Complete", "ORB descriptors have been saved as JSON files.")
+            # Save every image's keypoints and descriptors in one compact binary store
+            write_descriptor_store(os.path.join(save_dir, "ORB_Descriptors.orbs"), store_entries)
+
+            messagebox.showinfo("Download Complete", "ORB descriptors have been saved as JSON files and ORB_Descriptors.orbs.")
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,212 @@
+"""
+Low-resolution augmentation engine for the crop/rotation suite.
+
+Most consumers of a transformed image only need its pHash, its size or its
+black-pixel ratio, and pHash looks at a 32x32 thumbnail. AugmentationEngine
+therefore downsamples the original once to a small grayscale level (longer
+side work_side) and renders crops and rotations there. Rotations by
+multiples of 90 degrees are done with transposes, not interpolation. The black
+border a rotation leaves is computed from the geometry, not counted. Full
+resolution is rendered only on request (render(..., full=True)), for ORB.
+"""
+import math
+from collections import namedtuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from batch_hash import batch_phash_hashes
+from image_features import DecodedImage
+from instrumentation import metrics
+
+# Longer side of the working level; heavy crops still keep well over the 32x32 pHash size
+DEFAULT_WORK_SIDE = 256
+
+# One transformation. kind is "crop" with value (left, top, right, bottom) in
+# full-resolution pixels, or "rotate" with value an angle in degrees
+# (counter-clockwise about the centre, same canvas size, black fill).
+Transform = namedtuple("Transform", ["name", "kind", "value"])
+
+# Function to describe a crop in full-resolution pixel coordinates
+def crop(name, box):
+    return Transform(name, "crop", tuple(int(v) for v in box))
+
+# Function to describe a rotation in degrees
+def rotation(name, angle):
+    return Transform(name, "rotate", angle)
+
+# Function to describe a centred crop of the given size
+def center_crop(name, width, height, size):
+    crop_width, crop_height = size
+    left = (width - crop_width) // 2
+    top = (height - crop_height) // 2
+    return crop(name, (left, top, left + crop_width, top + crop_height))
+
+# Helper to clip a convex polygon against an axis-aligned box (Sutherland-Hodgman)
+def _clip_polygon(points, half_width, half_height):
+    edges = [
+        (lambda p: p[0] >= -half_width, lambda a, b: _intersect_x(a, b, -half_width)),
+        (lambda p: p[0] <= half_width, lambda a, b: _intersect_x(a, b, half_width)),
+        (lambda p: p[1] >= -half_height, lambda a, b: _intersect_y(a, b, -half_height)),
+        (lambda p: p[1] <= half_height, lambda a, b: _intersect_y(a, b, half_height)),
+    ]
+    for inside, intersect in edges:
+        clipped = []
+        for i, current in enumerate(points):
+            previous = points[i - 1]
+            if inside(current):
+                if not inside(previous):
+                    clipped.append(intersect(previous, current))
+                clipped.append(current)
+            elif inside(previous):
+                clipped.append(intersect(previous, current))
+        points = clipped
+        if not points:
+            break
+    return points
+
+def _intersect_x(a, b, x):
+    t = (x - a[0]) / (b[0] - a[0])
+    return (x, a[1] + t * (b[1] - a[1]))
+
+def _intersect_y(a, b, y):
+    t = (y - a[1]) / (b[1] - a[1])
+    return (a[0] + t * (b[0] - a[0]), y)
+
+# Helper to compute a polygon's area (shoelace formula)
+def _polygon_area(points):
+    return abs(sum(points[i - 1][0] * p[1] - p[0] * points[i - 1][1] for i, p in enumerate(points))) / 2
+
+# Function to compute the share of a width x height canvas left empty by rotating the image in place
+def rotation_border_fraction(width, height, angle):
+    radians = math.radians(angle)
+    cos_a, sin_a = math.cos(radians), math.sin(radians)
+    corners = [(x * cos_a - y * sin_a, x * sin_a + y * cos_a)
+               for x, y in ((-width / 2, -height / 2), (width / 2, -height / 2),
+                            (width / 2, height / 2), (-width / 2, height / 2))]
+    visible = _clip_polygon(corners, width / 2, height / 2)
+    return max(0.0, 1 - _polygon_area(visible) / (width * height)) if visible else 1.0
+
+# Helper to centre an array on a canvas of out_shape, cropping or padding with black
+def _place_centered(array, out_height, out_width):
+    canvas = np.zeros((out_height, out_width) + array.shape[2:], dtype=array.dtype)
+    height, width = array.shape[:2]
+    src_top, dst_top = max(0, (height - out_height) // 2), max(0, (out_height - height) // 2)
+    src_left, dst_left = max(0, (width - out_width) // 2), max(0, (out_width - width) // 2)
+    rows, cols = min(height, out_height), min(width, out_width)
+    canvas[dst_top:dst_top + rows, dst_left:dst_left + cols] = array[src_top:src_top + rows, src_left:src_left + cols]
+    return canvas
+
+# Function to rotate an array in place on its own canvas
+def rotate_array(array, angle, interpolation=cv2.INTER_LINEAR):
+    """
+    Same result as cv2.warpAffine about the centre with a black border, except
+    that multiples of 90 degrees are lossless transposes.
+    """
+    height, width = array.shape[:2]
+    if angle % 90 == 0:
+        turned = np.rot90(array, int(angle // 90) % 4)
+        if turned.shape[:2] == (height, width):
+            return np.ascontiguousarray(turned)
+        return _place_centered(turned, height, width)
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1)
+    return cv2.warpAffine(array, matrix, (width, height), flags=interpolation)
+
+
+class AugmentationEngine:
+    """
+    Renders Transforms of one image. pHash, size and black-pixel ratio are
+    answered from a grayscale level whose longer side is work_side; render(...,
+    full=True) produces the full-resolution image for ORB.
+    """
+
+    def __init__(self, image, work_side=DEFAULT_WORK_SIDE):
+        if isinstance(image, DecodedImage):
+            self.source = image
+        elif isinstance(image, Image.Image):
+            self.source = DecodedImage.from_pil(image)
+        else:
+            self.source = DecodedImage(image)
+        self.height, self.width = self.source.shape[:2]
+        self.work_side = work_side
+        self._level = None
+        self._scale = None
+        self._hashes = {}
+
+    @property
+    def scale(self):
+        if self._scale is None:
+            self._scale = min(1.0, self.work_side / max(self.width, self.height))
+        return self._scale
+
+    @property
+    def level(self):
+        """Grayscale working level (area-averaged, then converted like PIL's convert("L"))."""
+        if self._level is None:
+            source = self.source
+            if self.scale < 1.0:
+                size = (max(1, round(self.width * self.scale)), max(1, round(self.height * self.scale)))
+                small = cv2.resize(source.array, size, interpolation=cv2.INTER_AREA)
+                self._level = small if source.order == "GRAY" else cv2.cvtColor(
+                    small, cv2.COLOR_BGR2GRAY if source.order == "BGR" else cv2.COLOR_RGB2GRAY)
+            else:
+                self._level = source.gray
+        return self._level
+
+    def size(self, transform):
+        """(width, height) of the full-resolution result."""
+        if transform.kind == "crop":
+            left, top, right, bottom = transform.value
+            return right - left, bottom - top
+        return self.width, self.height
+
+    def border_fraction(self, transform):
+        """Share of the result that is black fill, from the geometry alone."""
+        if transform.kind == "crop":
+            return 0.0
+        return rotation_border_fraction(self.width, self.height, transform.value)
+
+    def black_pixel_percentage(self, transform):
+        """
+        Percentage of black pixels: the geometric border plus the share of
+        already-black content, measured on the working level.
+        """
+        border = self.border_fraction(transform)
+        if transform.kind == "crop":
+            content = self._level_crop(transform.value)
+            content_black = np.count_nonzero(content == 0) / content.size if content.size else 0.0
+        elif not self.level.all():
+            # Black content that is still inside the frame after rotating
+            rotated = self.render(transform)
+            inside = rotate_array(np.ones_like(self.level), transform.value, cv2.INTER_NEAREST) > 0
+            content_black = np.count_nonzero((rotated == 0) & inside) / max(1, np.count_nonzero(inside))
+        else:
+            content_black = 0.0
+        return round((border + (1 - border) * content_black) * 100, 2)
+
+    def _level_crop(self, box):
+        left, top, right, bottom = (int(round(v * self.scale)) for v in box)
+        return self.level[top:max(bottom, top + 1), left:max(right, left + 1)]
+
+    def render(self, transform, full=False):
+        """Returns the transformed image: the grayscale level, or the full-resolution source colours."""
+        with metrics.timer("transform"):
+            if transform.kind == "crop":
+                if full:
+                    left, top, right, bottom = transform.value
+                    return self.source.array[top:bottom, left:right]
+                return self._level_crop(transform.value)
+            return rotate_array(self.source.array if full else self.level, transform.value)
+
+    def phashes(self, transforms):
+        """pHashes of several transforms, hashed in one batch and cached by transform."""
+        missing = [t for t in transforms if t not in self._hashes]
+        if missing:
+            images = [Image.fromarray(self.render(t)) for t in missing]
+            with metrics.timer("hash"):
+                self._hashes.update(zip(missing, batch_phash_hashes(images)))
+        return [self._hashes[t] for t in transforms]
+
+    def phash(self, transform):
+        return self.phashes([transform])[0]
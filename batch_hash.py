@@ -0,0 +1,67 @@
+import numpy as np
+from PIL import Image
+import imagehash
+
+from bitops import pack_bits, to_packed_hash, unpack_bits
+
+# Working size used by imagehash.phash (hash_size * highfreq_factor)
+HASH_SIZE = 8
+HIGHFREQ_FACTOR = 4
+PHASH_IMG_SIZE = HASH_SIZE * HIGHFREQ_FACTOR
+
+# Number of images pushed through one batched DCT
+DEFAULT_CHUNK_SIZE = 256
+
+# Function to downsample one PIL image to the pHash working size
+def phash_pixels(image, img_size=PHASH_IMG_SIZE):
+    return np.asarray(image.convert("L").resize((img_size, img_size), Image.LANCZOS))
+
+# Function to build an (N, 32, 32) grayscale stack from decoded images
+def prepare_phash_stack(images, img_size=PHASH_IMG_SIZE):
+    stack = np.empty((len(images), img_size, img_size), dtype=np.uint8)
+    for i, image in enumerate(images):
+        stack[i] = phash_pixels(image, img_size)
+    return stack
+
+# Function to hash an (N, 32, 32) pixel stack with one DCT, median and pack
+def batch_phash_from_pixels(stack, hash_size=HASH_SIZE):
+    """
+    Vectorized equivalent of imagehash.phash over a stack of already downsampled
+    grayscale images. Returns a uint64 array of packed hashes.
+    """
+    import scipy.fftpack
+    stack = np.asarray(stack)
+    if stack.ndim == 2:
+        stack = stack[np.newaxis]
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(stack, axis=1), axis=2)
+    dctlowfreq = dct[:, :hash_size, :hash_size]
+    med = np.median(dctlowfreq.reshape(len(stack), -1), axis=1)
+    diff = dctlowfreq > med[:, np.newaxis, np.newaxis]
+    return pack_bits(diff)
+
+# Function to compute packed pHashes for a list of PIL images, chunk by chunk
+def batch_phash(images, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Computes pHashes for N PIL images. Each chunk is resized to the 32x32 working
+    size and hashed with a single batched DCT. The packed values are bit-identical
+    to imagehash.phash.
+    """
+    images = list(images)
+    hashes = np.empty(len(images), dtype=np.uint64)
+    for start in range(0, len(images), chunk_size):
+        chunk = images[start:start + chunk_size]
+        hashes[start:start + len(chunk)] = batch_phash_from_pixels(prepare_phash_stack(chunk))
+    return hashes
+
+# Function to convert a packed hash back into an imagehash.ImageHash
+def int_to_hash(value, hash_size=HASH_SIZE):
+    bits = unpack_bits(value, hash_size * hash_size)
+    return imagehash.ImageHash(bits.reshape(hash_size, hash_size))
+
+# Function to pack an imagehash.ImageHash into an integer
+def hash_to_int(image_hash):
+    return to_packed_hash(image_hash)
+
+# Function to compute pHashes for a list of PIL images as imagehash.ImageHash objects
+def batch_phash_hashes(images, chunk_size=DEFAULT_CHUNK_SIZE):
+    return [int_to_hash(value) for value in batch_phash(images, chunk_size)]
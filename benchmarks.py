@@ -0,0 +1,252 @@
+"""
+Reproducible benchmark suite.
+
+    python benchmarks.py [--corpus bench_corpus] [--save baseline.json] [--baseline baseline.json]
+
+Runs on a seeded synthetic flyer corpus (synthetic_flyers.py) at several
+resolutions and times decode, every hash type, ORB extraction, BF and FLANN
+matching, the crop/rotation set from data_breakdown.apply_transformations,
+and one end-to-end process_images run. It also records the mean pHash and
+ORB scores of that run, so accuracy changes show up next to the timings.
+
+--save writes the results as JSON. --baseline compares against a saved run
+and exits non-zero when a timing is more than --tolerance slower, or a score
+moves by more than --score-tolerance points. Baselines are only comparable
+on the same machine; the JSON records the platform and library versions.
+"""
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from synthetic_flyers import FLYER_SIZES, write_corpus, write_evaluation_corpus
+
+HASH_TYPES = ("phash", "ahash", "dhash", "whash", "rhash")
+DEFAULT_SEED = 0
+DEFAULT_COUNT = 6
+DEFAULT_REPEAT = 5
+
+# Allowed slowdown before a timing counts as a regression (0.25 = 25% slower)
+DEFAULT_TOLERANCE = 0.25
+
+# Allowed change, in percentage points, of a mean similarity score
+DEFAULT_SCORE_TOLERANCE = 0.5
+
+# Function to time fn over every input, repeat times; returns per-call milliseconds
+def time_calls(fn, inputs, repeat=DEFAULT_REPEAT):
+    """
+    Calls fn(item) for each item, repeat rounds after one warm-up round.
+    Returns {"median_ms", "min_ms", "calls"} per call, so the numbers do not
+    depend on how many inputs there are.
+    """
+    for item in inputs:
+        fn(item)
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in inputs:
+            fn(item)
+        rounds.append((time.perf_counter() - start) / len(inputs) * 1000)
+    return {"median_ms": statistics.median(rounds), "min_ms": min(rounds), "calls": len(inputs) * repeat}
+
+# Function to benchmark decode, hashing, ORB extraction and matching for one resolution
+def benchmark_resolution(paths, repeat=DEFAULT_REPEAT):
+    from fast_decode import DEFAULT_MIN_SIDE, open_for_hashing
+    from hash_core import generate_hash
+    from image_features import ImageFeatures, orb_similarity
+    from orb_matcher import OrbMatcher
+
+    results = {}
+    results["decode.cv2"] = time_calls(cv2.imread, paths, repeat)
+    results["decode.pil"] = time_calls(lambda p: Image.open(p).convert("RGB"), paths, repeat)
+    results["decode.pil_reduced"] = time_calls(lambda p: open_for_hashing(p, DEFAULT_MIN_SIDE).load(), paths, repeat)
+
+    images = [Image.open(path).convert("RGB") for path in paths]
+    for hash_type in HASH_TYPES:
+        results[f"hash.{hash_type}"] = time_calls(lambda image: generate_hash(image, hash_type), images, repeat)
+
+    arrays = [cv2.imread(path) for path in paths]
+    results["orb.extract"] = time_calls(lambda array: ImageFeatures(array).descriptors, arrays, repeat)
+
+    # Every image matched against the next one, features extracted up front
+    features = [ImageFeatures(array) for array in arrays]
+    for feature in features:
+        feature.descriptors
+    pairs = list(zip(features, features[1:] + features[:1]))
+    results["match.bf"] = time_calls(lambda pair: orb_similarity(*pair), pairs, repeat)
+
+    matcher = OrbMatcher()
+    for feature in features:
+        matcher.add(feature.descriptors)
+    matcher.train()
+    results["match.flann"] = time_calls(lambda feature: matcher.match(feature.descriptors), features, repeat)
+    return results
+
+# Function to benchmark the crop/rotation set used by data_breakdown
+def benchmark_transformations(paths, repeat=DEFAULT_REPEAT):
+    from augmentation import AugmentationEngine
+    from data_breakdown import apply_transformations, image_seed, transformation_specs
+
+    arrays = [(os.path.basename(path), cv2.imread(path)) for path in paths]
+
+    def full_resolution(item):
+        name, array = item
+        return apply_transformations(array, random.Random(image_seed(name)))
+
+    def low_resolution_phashes(item):
+        name, array = item
+        height, width = array.shape[:2]
+        engine = AugmentationEngine(array)
+        return engine.phashes(transformation_specs(width, height, random.Random(image_seed(name))))
+
+    return {
+        "transform.full_resolution": time_calls(full_resolution, arrays, repeat),
+        "transform.engine_phashes": time_calls(low_resolution_phashes, arrays, repeat),
+    }
+
+# Function to time process_images runs and collect the mean score per result column
+def benchmark_end_to_end(image_folder, random_folder, repeat=3, workers=1):
+    import csv
+
+    from data_breakdown import process_images
+
+    rounds = []
+    with tempfile.TemporaryDirectory() as output_folder:
+        output = os.path.join(output_folder, "results.xlsx")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            # restart=True: the journal next to output would otherwise replay round 1 in every later round
+            process_images(image_folder, random_folder, output, workers=workers, formats=("csv",), restart=True)
+            rounds.append(time.perf_counter() - start)
+        with open(os.path.splitext(output)[0] + ".csv", newline="") as f:
+            rows = list(csv.reader(f))
+
+    header, rows = rows[0], rows[1:]
+    scores = {}
+    for column, name in enumerate(header[1:], start=1):
+        values = [float(row[column]) for row in rows if len(row) > column and row[column] != ""]
+        if values:
+            scores[name] = round(statistics.fmean(values), 3)
+    # Reported per image, like the other timings
+    per_image = [seconds / max(len(rows), 1) * 1000 for seconds in rounds]
+    return {
+        "end_to_end.process_images": {"median_ms": statistics.median(per_image), "min_ms": min(per_image),
+                                      "calls": len(rows) * repeat},
+    }, scores
+
+# Function to run the whole suite and return a JSON-serializable report
+def run_suite(corpus_folder, count=DEFAULT_COUNT, sizes=FLYER_SIZES, seed=DEFAULT_SEED,
+              repeat=DEFAULT_REPEAT, end_to_end=True):
+    cv2.setNumThreads(1)  # Single-threaded, so timings do not depend on core count or load
+    timings = {}
+    for width, height in sizes:
+        paths = write_corpus(os.path.join(corpus_folder, "originals"), count, [(width, height)], seed)
+        for name, result in benchmark_resolution(paths, repeat).items():
+            timings[f"{name}@{width}x{height}"] = result
+
+    paths = write_corpus(os.path.join(corpus_folder, "originals"), count, sizes[:1], seed)
+    timings.update(benchmark_transformations(paths, repeat))
+
+    scores = {}
+    if end_to_end:
+        # Only the smallest size goes through process_images, so its folder is kept separate
+        image_folder, random_folder = write_evaluation_corpus(
+            os.path.join(corpus_folder, "end_to_end"), count, sizes[:1], seed)
+        end_to_end_timings, scores = benchmark_end_to_end(image_folder, random_folder, max(1, repeat // 2))
+        timings.update(end_to_end_timings)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "seed": seed,
+            "count": count,
+            "sizes": [f"{width}x{height}" for width, height in sizes],
+            "repeat": repeat,
+        },
+        "timings": timings,
+        "scores": scores,
+    }
+
+# Function to compare a report against a baseline; returns a list of regression messages
+def compare_to_baseline(report, baseline, tolerance=DEFAULT_TOLERANCE, score_tolerance=DEFAULT_SCORE_TOLERANCE):
+    """Timings are compared on the fastest round, which is the least affected by other load on the machine."""
+    regressions = []
+    for name, result in report["timings"].items():
+        reference = baseline.get("timings", {}).get(name)
+        if reference and result["min_ms"] > reference["min_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: {result['min_ms']:.2f} ms, baseline {reference['min_ms']:.2f} ms "
+                               f"({result['min_ms'] / reference['min_ms'] - 1:+.0%})")
+    for name, value in report["scores"].items():
+        reference = baseline.get("scores", {}).get(name)
+        if reference is not None and abs(value - reference) > score_tolerance:
+            regressions.append(f"{name}: {value:.2f}, baseline {reference:.2f}")
+    return regressions
+
+# Function to print the report as a table, with the change against the baseline if given
+def print_report(report, baseline=None):
+    reference = (baseline or {}).get("timings", {})
+    print(f"{'benchmark':<36} {'median ms':>10} {'min ms':>9} {'vs base':>8}")
+    for name, result in report["timings"].items():
+        change = ""
+        if name in reference and reference[name]["min_ms"]:
+            change = f"{result['min_ms'] / reference[name]['min_ms'] - 1:+.0%}"
+        print(f"{name:<36} {result['median_ms']:>10.2f} {result['min_ms']:>9.2f} {change:>8}")
+    if report["scores"]:
+        print()
+        for name, value in report["scores"].items():
+            print(f"{name:<36} {value:>10.2f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def parse_size(text):
+        width, height = text.lower().split("x")
+        return int(width), int(height)
+
+    parser = argparse.ArgumentParser(description="Benchmark decode, hashing, ORB and the evaluation pipeline.")
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "motion_hash_bench"),
+                        help="folder for the generated corpus (reused between runs)")
+    parser.add_argument("--count", type=int, default=DEFAULT_COUNT, help="flyers per resolution")
+    parser.add_argument("--sizes", type=parse_size, nargs="+", default=list(FLYER_SIZES))
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--skip-end-to-end", action="store_true")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this JSON file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--score-tolerance", type=float, default=DEFAULT_SCORE_TOLERANCE)
+    args = parser.parse_args()
+
+    report = run_suite(args.corpus, args.count, args.sizes, args.seed, args.repeat, not args.skip_end_to_end)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nSaved {args.save}")
+
+    if baseline is not None:
+        if baseline.get("meta", {}).get("platform") != report["meta"]["platform"]:
+            print("\nWarning: baseline was recorded on a different platform", file=sys.stderr)
+        regressions = compare_to_baseline(report, baseline, args.tolerance, args.score_tolerance)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
@@ -0,0 +1,191 @@
+"""
+Bit operations shared by the hashing and matching code.
+
+Hashes are handled as packed integers (a Python int for one hash, a uint64
+array for many), and ORB descriptors as (N, 32) uint8 arrays. Hamming
+distances are an XOR plus a popcount, which is int.bit_count() for a single
+pair and np.bitwise_count (or a byte lookup table on older NumPy) for
+arrays. Nothing goes through bin() or format() strings.
+
+    python bitops.py [--pairs 2000]
+
+times these against the string-based code they replace.
+"""
+import numpy as np
+
+# Bit counts for every byte value, used when numpy has no bitwise_count
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Bits in the hashes the rest of the code stores (imagehash with hash_size 8)
+DEFAULT_HASH_BITS = 64
+
+# Descriptor rows compared per chunk in descriptor_distance_matrix, to bound memory
+DISTANCE_CHUNK_ROWS = 1024
+
+# Function to count set bits in every element of an unsigned integer array
+def popcount(values):
+    values = np.ascontiguousarray(values)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values).astype(np.int64)
+    as_bytes = values.view(np.uint8).reshape(values.shape + (values.itemsize,))
+    return _POPCOUNT_TABLE[as_bytes].sum(axis=-1, dtype=np.int64)
+
+# Function to count set bits in every element of a uint64 array
+def popcount64(values):
+    return popcount(np.asarray(values, dtype=np.uint64))
+
+# Function to turn a hash (hex string, int or ImageHash) into a packed integer
+def to_packed_hash(value):
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return int(str(value), 16)
+
+# Function to get how many bits a hash holds, leading zeros included
+def hash_bits(value):
+    """
+    An ImageHash knows its size; a hex string has 4 bits per digit. A packed
+    integer carries no width, so it is assumed to be DEFAULT_HASH_BITS.
+    """
+    if hasattr(value, "hash"):
+        return int(np.asarray(value.hash).size)
+    if isinstance(value, str):
+        return len(value) * 4
+    return DEFAULT_HASH_BITS
+
+# Function to compute the Hamming distance between two hashes of any supported form
+def hamming(hash1, hash2):
+    return (to_packed_hash(hash1) ^ to_packed_hash(hash2)).bit_count()
+
+# Function to turn a Hamming distance into a 0-100 similarity percentage
+def hamming_similarity(distance, total_bits=DEFAULT_HASH_BITS):
+    return (1 - distance / total_bits) * 100
+
+# Function to pack an (N, ...) boolean array into one integer per row (MSB first)
+def pack_bits(bits):
+    flat = np.asarray(bits, dtype=bool).reshape(len(bits), -1)
+    nbits = flat.shape[1]
+    if nbits > 64:
+        raise ValueError("Packed hashes are limited to 64 bits")
+    # Left-pad to a whole number of bytes, then read the bytes as big-endian integers
+    padded = np.zeros((len(flat), 64), dtype=bool)
+    padded[:, 64 - nbits:] = flat
+    return np.packbits(padded, axis=1).view(">u8").ravel().astype(np.uint64)
+
+# Function to unpack integers into an (N, nbits) boolean array (MSB first), the inverse of pack_bits
+def unpack_bits(values, nbits=DEFAULT_HASH_BITS):
+    values = np.atleast_1d(np.asarray(values, dtype=np.uint64)).astype(">u8")
+    bits = np.unpackbits(values.view(np.uint8).reshape(len(values), 8), axis=1)
+    return bits[:, 64 - nbits:].astype(bool)
+
+# Function to unpack ORB descriptors into an (N, 256) array of 0/1 bits
+def descriptors_to_bits(descriptors):
+    return np.unpackbits(np.asarray(descriptors, dtype=np.uint8), axis=-1)
+
+# Function to render descriptors as one "0"/"1" string per descriptor
+def descriptors_to_bitstrings(descriptors):
+    """Same strings as ''.join(format(byte, '08b') for byte in descriptor), built in one pass."""
+    bits = descriptors_to_bits(descriptors)
+    if bits.size == 0:
+        return []
+    text = (bits + ord("0")).tobytes().decode("ascii")
+    width = bits.shape[1]
+    return [text[start:start + width] for start in range(0, len(text), width)]
+
+# Function to compute every pairwise Hamming distance between two sets of packed hashes
+def hamming_matrix(hashes1, hashes2):
+    hashes1 = np.asarray(hashes1, dtype=np.uint64)
+    hashes2 = np.asarray(hashes2, dtype=np.uint64)
+    return popcount(np.bitwise_xor(hashes1[:, np.newaxis], hashes2[np.newaxis, :]))
+
+# Helper to view (N, bytes) uint8 descriptors as (N, words) uint64 when the width allows it
+def _as_words(descriptors):
+    descriptors = np.ascontiguousarray(descriptors, dtype=np.uint8)
+    if descriptors.shape[1] % 8 == 0:
+        return descriptors.view(np.uint64)
+    return descriptors
+
+# Function to compute every pairwise Hamming distance between two sets of binary descriptors
+def descriptor_distance_matrix(descriptors1, descriptors2, chunk_rows=DISTANCE_CHUNK_ROWS):
+    """
+    Returns an (N, M) int64 array; the same distances cv2.NORM_HAMMING gives.
+    32-byte ORB rows are compared as four uint64 words, and the first set is
+    processed chunk_rows rows at a time so the XOR buffer stays small.
+    """
+    words1, words2 = _as_words(descriptors1), _as_words(descriptors2)
+    distances = np.empty((len(words1), len(words2)), dtype=np.int64)
+    for start in range(0, len(words1), chunk_rows):
+        chunk = words1[start:start + chunk_rows]
+        distances[start:start + len(chunk)] = popcount(
+            np.bitwise_xor(chunk[:, np.newaxis, :], words2[np.newaxis, :, :])).sum(axis=-1)
+    return distances
+
+
+if __name__ == "__main__":
+    import argparse
+    import hashlib
+    import time
+
+    import cv2
+
+    # The string-based versions these functions replace, kept here only for comparison
+    def string_hamming_hex(hash1, hash2, bits=256):
+        bin_hash1 = bin(int(hash1, 16))[2:].zfill(bits)
+        bin_hash2 = bin(int(hash2, 16))[2:].zfill(bits)
+        return sum(c1 != c2 for c1, c2 in zip(bin_hash1, bin_hash2))
+
+    def string_bitstrings(descriptors):
+        return [''.join(format(byte, '08b') for byte in descriptor) for descriptor in descriptors]
+
+    def best_of(fn, repeat=5):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn()
+            timings.append(time.perf_counter() - start)
+        return min(timings) * 1000, result
+
+    parser = argparse.ArgumentParser(description="Time the bit operations against the string-based code.")
+    parser.add_argument("--pairs", type=int, default=2000, help="hash pairs per Hamming benchmark")
+    parser.add_argument("--descriptors", type=int, default=500, help="descriptors per set")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    digests = [hashlib.sha256(rng.bytes(16)).hexdigest() for _ in range(args.pairs * 2)]
+    packed = rng.integers(0, 2 ** 63, args.pairs * 2, dtype=np.uint64)
+    descriptors1 = rng.integers(0, 256, (args.descriptors, 32), dtype=np.uint8)
+    descriptors2 = rng.integers(0, 256, (args.descriptors, 32), dtype=np.uint8)
+
+    rows = []
+
+    slow, expected = best_of(lambda: [string_hamming_hex(a, b) for a, b in zip(digests[::2], digests[1::2])])
+    fast, result = best_of(lambda: [hamming(a, b) for a, b in zip(digests[::2], digests[1::2])])
+    assert result == expected
+    rows.append(("hamming 256-bit hex", slow, fast))
+
+    hex64 = [f"{int(value):016x}" for value in packed]
+    slow, expected = best_of(lambda: [string_hamming_hex(a, b, 64) for a, b in zip(hex64[::2], hex64[1::2])])
+    fast, result = best_of(lambda: popcount64(np.bitwise_xor(packed[::2], packed[1::2])))
+    assert list(result) == expected
+    rows.append(("hamming 64-bit, batch", slow, fast))
+
+    slow, expected = best_of(lambda: string_bitstrings(descriptors1))
+    fast, result = best_of(lambda: descriptors_to_bitstrings(descriptors1))
+    assert result == expected
+    rows.append(("descriptor bitstrings", slow, fast))
+
+    slow, expected = best_of(lambda: hashlib.sha256(''.join(string_bitstrings(descriptors1)).encode()).hexdigest())
+    fast, result = best_of(lambda: hashlib.sha256(''.join(descriptors_to_bitstrings(descriptors1)).encode()).hexdigest())
+    assert result == expected
+    rows.append(("descriptor sha256", slow, fast))
+
+    # Byte-wise XOR and lookup table, the way distances were counted before uint64 words
+    slow, expected = best_of(lambda: _POPCOUNT_TABLE[np.bitwise_xor(
+        descriptors1[:, np.newaxis], descriptors2[np.newaxis])].sum(axis=-1, dtype=np.int64))
+    fast, result = best_of(lambda: descriptor_distance_matrix(descriptors1, descriptors2))
+    assert np.array_equal(result, expected)
+    assert result[0, 0] == cv2.norm(descriptors1[0], descriptors2[0], cv2.NORM_HAMMING)
+    rows.append(("descriptor distance matrix", slow, fast))
+
+    print(f"{'operation':<28} {'before ms':>10} {'after ms':>9} {'speed-up':>9}")
+    for name, slow, fast in rows:
+        print(f"{name:<28} {slow:>10.3f} {fast:>9.3f} {slow / fast:>8.1f}x")
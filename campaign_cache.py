@@ -0,0 +1,185 @@
+import threading
+import time
+
+import numpy as np
+
+from hash_index import HashIndex
+
+# Document field bumped on every write so readers can tell when their copy is stale
+VERSION_FIELD = "version"
+
+
+class CampaignEntry:
+    """
+    Cached copy of one campaign document. The hash index and descriptor array
+    are derived from the document once per version instead of once per query.
+    """
+
+    def __init__(self, data, version):
+        self.data = data
+        self.version = version
+        self._hash_index = None
+        self._orb_descriptors = None
+
+    @property
+    def hashes(self):
+        return self.data.get("hashes", [])
+
+    @property
+    def hash_index(self):
+        if self._hash_index is None:
+            self._hash_index = HashIndex.from_hashes(self.hashes)
+        return self._hash_index
+
+    @property
+    def orb_descriptors(self):
+        if self._orb_descriptors is None:
+            self._orb_descriptors = np.array(self.data.get("orb_descriptors", []), dtype=np.uint8)
+        return self._orb_descriptors
+
+
+class CampaignCache:
+    """
+    Read-through cache of campaign_one/<type> documents.
+
+    In "listener" mode each document gets an on_snapshot listener the first time
+    it is read; Firestore pushes changes to it, so repeat queries never issue a
+    read. In "version" mode a cached copy younger than max_age is served as is;
+    after that only the small version field is fetched and the full document is
+    re-read when it has changed. on_read is called for every billed read.
+    """
+
+    def __init__(self, db, collection="campaign_one", mode="listener", max_age=30.0,
+                 on_read=None, snapshot_timeout=10.0):
+        if mode not in ("listener", "version"):
+            raise ValueError(f"Unknown cache mode: {mode}")
+        self.db = db
+        self.collection = collection
+        self.mode = mode
+        self.max_age = max_age
+        self.on_read = on_read
+        self.snapshot_timeout = snapshot_timeout
+        self._entries = {}
+        self._checked = {}
+        self._watches = {}
+        self._ready = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _document(self, doc_type):
+        return self.db.collection(self.collection).document(doc_type)
+
+    def _count_read(self):
+        if self.on_read is not None:
+            self.on_read()
+
+    def _store(self, doc_type, snapshot):
+        with self._lock:
+            if snapshot.exists:
+                data = snapshot.to_dict()
+                self._entries[doc_type] = CampaignEntry(data, data.get(VERSION_FIELD, snapshot.update_time))
+            else:
+                self._entries[doc_type] = None
+            self._checked[doc_type] = time.monotonic()
+
+    def _listen(self, doc_type):
+        ready = threading.Event()
+        self._ready[doc_type] = ready
+
+        def on_snapshot(doc_snapshots, changes, read_time):
+            for snapshot in doc_snapshots:
+                self._count_read()
+                self._store(doc_type, snapshot)
+            ready.set()
+
+        self._watches[doc_type] = self._document(doc_type).on_snapshot(on_snapshot)
+        if not ready.wait(self.snapshot_timeout):
+            # Drop the watch so the next get subscribes again instead of counting a hit on nothing
+            self._watches.pop(doc_type).unsubscribe()
+            self._ready.pop(doc_type, None)
+            raise TimeoutError(f"No snapshot received for {self.collection}/{doc_type}")
+
+    def _refresh_by_version(self, doc_type):
+        document = self._document(doc_type)
+        cached = self._entries.get(doc_type)
+        if cached is not None:
+            probe = document.get(field_paths=[VERSION_FIELD])
+            self._count_read()
+            try:
+                version = probe.get(VERSION_FIELD)
+            except KeyError:
+                # Written without a version field; _store keyed the entry on update_time instead
+                version = probe.update_time
+            if probe.exists and version == cached.version:
+                self._checked[doc_type] = time.monotonic()
+                return
+        self._store(doc_type, document.get())
+        self._count_read()
+
+    def get(self, doc_type):
+        """Returns the CampaignEntry for doc_type, or None if the document does not exist."""
+        if self.mode == "listener":
+            if doc_type in self._watches:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._listen(doc_type)
+            return self._entries.get(doc_type)
+
+        checked = self._checked.get(doc_type)
+        if checked is not None and time.monotonic() - checked < self.max_age:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._refresh_by_version(doc_type)
+        return self._entries.get(doc_type)
+
+    def record_write(self, doc_type, new_hashes=(), orb_descriptors=None):
+        """
+        Applies a write this process just made to the cached copy, so the next
+        query does not need to re-read the document. Listener mode will also
+        receive the change from Firestore.
+        """
+        with self._lock:
+            entry = self._entries.get(doc_type)
+            if entry is None:
+                return
+            data = dict(entry.data)
+            hashes = list(data.get("hashes", []))
+            for value in new_hashes:
+                if value not in hashes:
+                    hashes.append(value)
+            data["hashes"] = hashes
+            if orb_descriptors is not None:
+                data["orb_descriptors"] = orb_descriptors
+            version = entry.version
+            if self.mode == "version" and isinstance(version, int):
+                version += 1  # Mirrors the Increment(1) sent with the write
+            data[VERSION_FIELD] = version
+            updated = CampaignEntry(data, version)
+            if entry._hash_index is not None:
+                # Extend the existing index instead of rebuilding it
+                updated._hash_index = entry._hash_index
+                for value in new_hashes:
+                    updated._hash_index.insert(value, value)
+            if orb_descriptors is None:
+                updated._orb_descriptors = entry._orb_descriptors
+            self._entries[doc_type] = updated
+            self._checked[doc_type] = time.monotonic()
+
+    def invalidate(self, doc_type=None):
+        """Drops cached copies (and their listeners) so the next get re-reads them."""
+        doc_types = [doc_type] if doc_type else list(self._entries)
+        with self._lock:
+            for name in doc_types:
+                self._entries.pop(name, None)
+                self._checked.pop(name, None)
+                watch = self._watches.pop(name, None)
+                if watch is not None:
+                    watch.unsubscribe()
+
+    def close(self):
+        for watch in self._watches.values():
+            watch.unsubscribe()
+        self._watches.clear()
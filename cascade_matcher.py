@@ -0,0 +1,345 @@
+"""
+Cheap-first matching cascade with early exit.
+
+A query goes through up to three stages and leaves at the first one that
+is confident either way:
+
+1. coarse: aHash and dHash against every stored image in one vectorized
+   pass. Only the coarse_keep closest candidates go on. When even the
+   closest is beyond coarse_reject, the query is rejected here.
+2. phash: pHash of the survivors only. A clear winner (within
+   accept_distance and accept_margin ahead of the runner-up) is accepted
+   without any ORB work. When nothing is within reject_distance, the query
+   is rejected.
+3. orb: ORB features of the query are extracted only now. They are ratio
+   matched against the orb_keep best survivors, and each match set is
+   checked with a RANSAC homography. The candidate with the most inliers
+   is accepted when it has at least min_inliers, and they make up at least
+   min_inlier_fraction of the smaller keypoint set. Unrelated flyers that
+   share fonts and layout still find tens of inliers, so the fraction is
+   what separates them.
+
+Every hash is taken from the same 256 px grayscale working level the
+augmentation engine uses, so decoding and hashing a query costs far less
+than a full ORB pass. CascadeStats counts how many candidates reached each
+stage and how queries exited. report() gives the share of pHash
+comparisons, ORB extractions and ORB matches saved, compared with running
+every stage on every stored image.
+
+    python cascade_matcher.py [--count 60]
+
+evaluates the cascade against that exhaustive search on synthetic flyers.
+"""
+import logging
+from collections import namedtuple
+
+import cv2
+import imagehash
+import numpy as np
+from PIL import Image
+
+from augmentation import AugmentationEngine
+from bitops import popcount64, to_packed_hash
+from hash_index import HashIndex
+from image_features import ImageFeatures
+from instrumentation import metrics
+
+log = logging.getLogger(__name__)
+
+STAGES = ("coarse", "phash", "orb")
+
+# Thresholds of each stage (distances are in bits of a 64-bit hash)
+CascadeConfig = namedtuple("CascadeConfig", [
+    "coarse_keep",      # candidates passed from the aHash/dHash stage to pHash
+    "coarse_reject",    # reject when the closest aHash/dHash distance is above this
+    "accept_distance",  # accept on pHash alone when the best match is this close...
+    "accept_margin",    # ...and the runner-up is at least this much further away
+    "reject_distance",  # reject when no pHash distance is within this
+    "orb_keep",         # survivors that get an ORB match and geometric check
+    "min_inliers",      # RANSAC homography inliers needed to accept on ORB...
+    "min_inlier_fraction",  # ...and as a share of the smaller keypoint set
+    "ratio",            # Lowe ratio for the ORB matches
+], defaults=(16, 24, 8, 10, 28, 3, 15, 0.3, 0.75))
+
+DEFAULT_CONFIG = CascadeConfig()
+
+# Outcome of one query: matched key (None on reject), decision, exit stage and the scores seen
+CascadeResult = namedtuple("CascadeResult", ["key", "accepted", "stage", "phash_distance", "inliers"])
+
+# Hashes of one image, plus its ORB keypoint positions and descriptors (None until needed)
+CascadeEntry = namedtuple("CascadeEntry", ["ahash", "dhash", "phash", "points", "descriptors"])
+
+# Function to compute the aHash, dHash and pHash of an image from the working level
+def cascade_hashes(engine):
+    level = Image.fromarray(engine.level)
+    with metrics.timer("hash"):
+        return (to_packed_hash(imagehash.average_hash(level)), to_packed_hash(imagehash.dhash(level)),
+                to_packed_hash(imagehash.phash(level)))
+
+# Function to decide on pHash distances alone: True (accept), False (reject) or None (needs ORB)
+def phash_decision(distances, config=DEFAULT_CONFIG):
+    """Returns (decision, positions sorted by distance)."""
+    order = np.argsort(distances, kind="stable")
+    best = int(distances[order[0]])
+    runner_up = int(distances[order[1]]) if len(order) > 1 else None
+    if best <= config.accept_distance and (runner_up is None or runner_up - best >= config.accept_margin):
+        return True, order
+    if best > config.reject_distance:
+        return False, order
+    return None, order
+
+# Function to wrap a path, PIL image, BGR array or ImageFeatures as ImageFeatures
+def as_cascade_features(image):
+    if isinstance(image, ImageFeatures):
+        return image
+    if isinstance(image, str):
+        return ImageFeatures.open(image)
+    if isinstance(image, Image.Image):
+        return ImageFeatures.from_pil(image)
+    return ImageFeatures(image)
+
+# Function to get ORB keypoint positions and descriptors of a features object
+def orb_points(features):
+    descriptors = features.descriptors
+    if descriptors is None:
+        return np.zeros((0, 2), dtype=np.float32), np.zeros((0, 32), dtype=np.uint8)
+    points = np.array([keypoint.pt for keypoint in features.keypoints], dtype=np.float32)
+    return points, descriptors
+
+# Function to count RANSAC homography inliers between two ORB feature sets
+def geometric_inliers(query_points, query_descriptors, points, descriptors, ratio=DEFAULT_CONFIG.ratio,
+                      matcher=None):
+    if len(query_descriptors) < 2 or len(descriptors) < 2:
+        return 0
+    matcher = matcher or cv2.BFMatcher(cv2.NORM_HAMMING)
+    with metrics.timer("match"):
+        pairs = matcher.knnMatch(query_descriptors, descriptors, k=2)
+    good = [pair[0] for pair in pairs if len(pair) == 2 and pair[0].distance < ratio * pair[1].distance]
+    if len(good) < 4:
+        return 0
+    source = query_points[[m.queryIdx for m in good]]
+    target = points[[m.trainIdx for m in good]]
+    with metrics.timer("match"):
+        _, mask = cv2.findHomography(source, target, cv2.RANSAC, 5.0)
+    return int(mask.sum()) if mask is not None else 0
+
+
+class CascadeStats:
+    """Candidates that reached each stage, and how queries exited, over the life of a matcher."""
+
+    def __init__(self):
+        self.queries = 0
+        self.stored = 0  # Sum over queries of the stored images each one was checked against
+        self.phash_comparisons = 0
+        self.orb_extractions = 0
+        self.orb_matches = 0
+        self.exits = {(stage, accepted): 0 for stage in STAGES for accepted in (True, False)}
+
+    def record(self, stored, phash_comparisons, orb_matches, result):
+        self.queries += 1
+        self.stored += stored
+        self.phash_comparisons += phash_comparisons
+        self.orb_extractions += result.stage == "orb"
+        self.orb_matches += orb_matches
+        self.exits[(result.stage, result.accepted)] += 1
+
+    def report(self):
+        """Exits per stage and the share of work saved against running every stage on every image."""
+        def saved(done, total):
+            return 1 - done / total if total else 0.0
+
+        return {
+            "queries": self.queries,
+            "exits": {stage: {"accepted": self.exits[(stage, True)], "rejected": self.exits[(stage, False)]}
+                      for stage in STAGES},
+            "phash_comparisons_saved": saved(self.phash_comparisons, self.stored),
+            "orb_extractions_saved": saved(self.orb_extractions, self.queries),
+            "orb_matches_saved": saved(self.orb_matches, self.stored),
+        }
+
+    def format_report(self):
+        report = self.report()
+        exits = ", ".join(f"{stage} {counts['accepted']} accepted / {counts['rejected']} rejected"
+                          for stage, counts in report["exits"].items())
+        return (f"{report['queries']} queries; exits: {exits}; saved "
+                f"{report['phash_comparisons_saved']:.0%} of pHash comparisons, "
+                f"{report['orb_extractions_saved']:.0%} of ORB extractions, "
+                f"{report['orb_matches_saved']:.0%} of ORB matches")
+
+
+class CascadeMatcher:
+    """
+    In-memory cascade index. add() stores an image's three hashes and its
+    ORB keypoints and descriptors; match() runs a query through the stages
+    configured by a CascadeConfig.
+    """
+
+    def __init__(self, config=DEFAULT_CONFIG):
+        self.config = config
+        self.stats = CascadeStats()
+        # One HashIndex per hash type, always updated together so their positions line up
+        self._ahash = HashIndex()
+        self._dhash = HashIndex()
+        self._phash = HashIndex()
+        self._orb = {}
+        self._bf = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+    def __len__(self):
+        return len(self._phash)
+
+    def __contains__(self, key):
+        return key in self._phash
+
+    @property
+    def keys(self):
+        return self._phash.keys
+
+    @staticmethod
+    def describe(image):
+        """Returns the CascadeEntry of an image (path, PIL image, BGR array or ImageFeatures)."""
+        features = as_cascade_features(image)
+        ahash, dhash, phash = cascade_hashes(AugmentationEngine(features))
+        points, descriptors = orb_points(features)
+        return CascadeEntry(ahash, dhash, phash, points, descriptors)
+
+    def add(self, key, image=None, entry=None):
+        """Adds an image (or a precomputed CascadeEntry) under key, replacing any entry for it."""
+        entry = entry or self.describe(image)
+        self._ahash.insert(key, entry.ahash)
+        self._dhash.insert(key, entry.dhash)
+        self._phash.insert(key, entry.phash)
+        self._orb[key] = (entry.points, entry.descriptors)
+
+    def match(self, image):
+        """Runs image through the cascade and returns a CascadeResult."""
+        config = self.config
+        features = as_cascade_features(image)
+        stored = len(self)
+        if stored == 0:
+            result = CascadeResult(None, False, "coarse", None, 0)
+            self.stats.record(0, 0, 0, result)
+            return result
+        ahash, dhash, phash = cascade_hashes(AugmentationEngine(features))
+
+        # Stage 1: cheap hashes over everything, keep the closest few
+        with metrics.timer("match"):
+            coarse = np.minimum(self._ahash.distances(ahash), self._dhash.distances(dhash))
+            keep = min(config.coarse_keep, stored)
+            survivors = np.argpartition(coarse, keep - 1)[:keep]
+            survivors = survivors[coarse[survivors] <= config.coarse_reject]
+        if len(survivors) == 0:
+            return self._finish(stored, 0, 0, CascadeResult(None, False, "coarse", None, 0))
+
+        # Stage 2: pHash of the survivors only
+        with metrics.timer("match"):
+            distances = popcount64(np.bitwise_xor(self._phash.hashes[survivors], np.uint64(phash)))
+            decision, order = phash_decision(distances, config)
+        keys = self._phash.keys
+        best_distance = int(distances[order[0]])
+        if decision is not None:
+            best = keys[survivors[order[0]]] if decision else None
+            return self._finish(stored, len(survivors), 0, CascadeResult(best, decision, "phash", best_distance, 0))
+        candidates = [position for position in order[:config.orb_keep] if distances[position] <= config.reject_distance]
+
+        # Stage 3: ORB and a geometric check on the few that are left
+        query_points, query_descriptors = orb_points(features)
+        best_key, best_inliers, best_key_distance = None, 0, None
+        for position in candidates:
+            key = keys[survivors[position]]
+            points, descriptors = self._orb[key]
+            inliers = geometric_inliers(query_points, query_descriptors, points, descriptors, config.ratio, self._bf)
+            if inliers > best_inliers:
+                best_key, best_inliers, best_key_distance = key, inliers, int(distances[position])
+        if self._confident(best_inliers, len(query_points), best_key):
+            result = CascadeResult(best_key, True, "orb", best_key_distance, best_inliers)
+        else:
+            result = CascadeResult(None, False, "orb", best_distance, best_inliers)
+        return self._finish(stored, len(survivors), len(candidates), result)
+
+    def _confident(self, inliers, query_keypoints, key):
+        if key is None or inliers < self.config.min_inliers:
+            return False
+        keypoints = min(query_keypoints, len(self._orb[key][0]))
+        return keypoints > 0 and inliers / keypoints >= self.config.min_inlier_fraction
+
+    def _finish(self, stored, phash_comparisons, orb_matches, result):
+        self.stats.record(stored, phash_comparisons, orb_matches, result)
+        metrics.count(f"cascade_{result.stage}_{'accepts' if result.accepted else 'rejects'}")
+        return result
+
+    def exhaustive_match(self, image):
+        """ORB geometric check against every stored image: the baseline the cascade prunes."""
+        features = as_cascade_features(image)
+        query_points, query_descriptors = orb_points(features)
+        best_key, best_inliers = None, 0
+        for key in self.keys:
+            points, descriptors = self._orb[key]
+            inliers = geometric_inliers(query_points, query_descriptors, points, descriptors,
+                                        self.config.ratio, self._bf)
+            if inliers > best_inliers:
+                best_key, best_inliers = key, inliers
+        accepted = self._confident(best_inliers, len(query_points), best_key)
+        return CascadeResult(best_key if accepted else None, accepted, "orb", None, best_inliers)
+
+# Function to compare the cascade with exhaustive matching on transformed synthetic flyers
+def evaluate(count=60, config=DEFAULT_CONFIG, seed=0):
+    """
+    Stores count flyers, then queries with a mild crop or rotation of each
+    (should be found) and with count unrelated flyers (should be rejected).
+    Returns accuracy and time per query for both methods, plus the cascade report.
+    """
+    import random
+    import time
+
+    from augmentation import rotate_array
+    from synthetic_flyers import RANDOM_SEED_OFFSET, generate_flyer
+
+    rng = random.Random(seed)
+    matcher = CascadeMatcher(config)
+    queries = []
+    for index in range(count):
+        flyer = generate_flyer(seed + index)
+        matcher.add(index, flyer)
+        height, width = flyer.shape[:2]
+        if index % 2:
+            left, top = rng.randint(0, width // 10), rng.randint(0, height // 10)
+            query = flyer[top:height - rng.randint(0, height // 10), left:width - rng.randint(0, width // 10)]
+        else:
+            query = rotate_array(flyer, rng.uniform(-5, 5))
+        queries.append((index, np.ascontiguousarray(query)))
+    queries += [(None, generate_flyer(seed + RANDOM_SEED_OFFSET + index)) for index in range(count)]
+
+    results = {}
+    for name, match in (("cascade", matcher.match), ("exhaustive", matcher.exhaustive_match)):
+        # Fresh features per method, so both pay for decoding views and ORB extraction
+        inputs = [(expected, ImageFeatures(array)) for expected, array in queries]
+        start = time.perf_counter()
+        outcomes = [(expected, match(features)) for expected, features in inputs]
+        seconds = time.perf_counter() - start
+        results[name] = {
+            "recall": sum(r.key == e for e, r in outcomes if e is not None) / count,
+            "false_accepts": sum(r.accepted for e, r in outcomes if e is None),
+            "ms_per_query": seconds / len(outcomes) * 1000,
+        }
+    results["cascade"]["report"] = matcher.stats.report()
+    results["cascade"]["summary"] = matcher.stats.format_report()
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Evaluate the matching cascade on synthetic flyers.")
+    parser.add_argument("--count", type=int, default=60, help="stored flyers (and unrelated queries)")
+    parser.add_argument("--seed", type=int, default=0)
+    for field, default in zip(CascadeConfig._fields, CascadeConfig._field_defaults.values()):
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(default), default=default)
+    args = parser.parse_args()
+
+    config = CascadeConfig(**{field: getattr(args, field) for field in CascadeConfig._fields})
+    results = evaluate(args.count, config, args.seed)
+    print(f"{'method':<12} {'recall':>7} {'false accepts':>14} {'ms/query':>9}")
+    for name in ("cascade", "exhaustive"):
+        result = results[name]
+        print(f"{name:<12} {result['recall']:>7.2f} {result['false_accepts']:>14} {result['ms_per_query']:>9.2f}")
+    print(results["cascade"]["summary"])
@@ -2,19 +2,27 @@ import os
 import random
 from PIL import Image
 import imagehash
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill
 import numpy as np
+from augmentation import AugmentationEngine, crop, rotation
+from feature_cache import FeatureCache, cached_image_hashes
+from results_writer import open_results_sinks
+from run_journal import RunJournal, default_journal_path, file_fingerprint, files_fingerprint
 
 # Paths
 image_folder = '/Users/rosshartigan/Nelson Development/Motion Ads/Data-Analysis/Flyers'
 control_folder = '/Users/rosshartigan/Nelson Development/Motion Ads/Data-Analysis/Random'
 output_xlsx = '/Users/rosshartigan/Nelson Development/Motion Ads/Data-Analysis/CSV/results.xlsx'
 log_folder = '/Users/rosshartigan/Nelson Development/Motion Ads/Data-Analysis/CSV/Logs'
+cache_path = '/Users/rosshartigan/Nelson Development/Motion Ads/Data-Analysis/CSV/feature_cache.sqlite3'
 
 # Global standardized size
 STANDARDIZED_SIZE = (720, 720)
 
+# Shorter side to keep when decoding originals and controls at reduced scale. None
+# decodes at full resolution, like the transformed and standardized images they are
+# compared with; set it (e.g. to fast_decode.DEFAULT_MIN_SIDE) only for quick, approximate runs
+hash_min_side = None
+
 # Ensure the log folder exists
 os.makedirs(log_folder, exist_ok=True)
 
@@ -38,9 +46,10 @@ def calculate_black_pixel_percentage(image):
     black_percentage = (black_pixel_count / total_pixels) * 100
     return round(black_percentage, 2)
 
-# Function to resize and crop image to standardized size
-def resize_and_crop(image_path, size=(720, 720)):
-    image = Image.open(image_path)
+# Function to resize and crop image to standardized size (accepts a path or an already opened image)
+def resize_and_crop(image, size=(720, 720)):
+    if isinstance(image, str):
+        image = Image.open(image)
     original_width, original_height = image.size
     target_width, target_height = size
 
@@ -59,89 +68,86 @@ def resize_and_crop(image_path, size=(720, 720)):
 
     return image_cropped
 
-# Function to apply random crop
-def random_crop(image):
-    width, height = image.size
+# Function to describe a random crop
+def random_crop(width, height):
     left = random.randint(0, width // 4)
     top = random.randint(0, height // 4)
     right = random.randint(3 * width // 4, width)
     bottom = random.randint(3 * height // 4, height)
-    return image.crop((left, top, right, bottom))
+    return crop("Random Crop", (left, top, right, bottom))
 
-# Function to apply random rotation
-def random_rotation(image):
+# Function to describe a random rotation
+def random_rotation():
     angle = random.randint(1, 359)
-    return image.rotate(angle, fillcolor="black")
+    return rotation("Random Rotation", angle)
 
-# Function to apply transformations
+# Function to describe the transformations; they are rendered by an AugmentationEngine
 def apply_transformations(original_image):
     width, height = original_image.size
-    transformations = {
-        "Mild Crop 1": original_image.crop((int(0.05 * width), int(0.05 * height), int(0.95 * width), int(0.95 * height))),
-        "Mild Crop 2": original_image.crop((int(0.1 * width), int(0.1 * height), int(0.9 * width), int(0.9 * height))),
-        "Heavy Crop 1": original_image.crop((int(0.2 * width), int(0.2 * height), int(0.8 * width), int(0.8 * height))),
-        "Heavy Crop 2": original_image.crop((int(0.25 * width), int(0.25 * height), int(0.75 * width), int(0.75 * height))),
-        "Mild Rotation 1": original_image.rotate(10, fillcolor="black"),
-        "Mild Rotation 2": original_image.rotate(15, fillcolor="black"),
-        "Heavy Rotation 1": original_image.rotate(45, fillcolor="black"),
-        "Heavy Rotation 2": original_image.rotate(90, fillcolor="black"),
-        "Random Crop": random_crop(original_image),
-        "Random Rotation": random_rotation(original_image),
-    }
+    transformations = [
+        crop("Mild Crop 1", (int(0.05 * width), int(0.05 * height), int(0.95 * width), int(0.95 * height))),
+        crop("Mild Crop 2", (int(0.1 * width), int(0.1 * height), int(0.9 * width), int(0.9 * height))),
+        crop("Heavy Crop 1", (int(0.2 * width), int(0.2 * height), int(0.8 * width), int(0.8 * height))),
+        crop("Heavy Crop 2", (int(0.25 * width), int(0.25 * height), int(0.75 * width), int(0.75 * height))),
+        rotation("Mild Rotation 1", 10),
+        rotation("Mild Rotation 2", 15),
+        rotation("Heavy Rotation 1", 45),
+        rotation("Heavy Rotation 2", 90),
+        random_crop(width, height),
+        random_rotation(),
+    ]
     return transformations
 
-# Function to color cells based on percentage
-def color_cell_based_on_percentage(cell, percentage):
-    color = None
-    if 0 <= percentage < 10:
-        color = '00FF00'
-    elif 10 <= percentage < 20:
-        color = '66FF00'
-    elif 20 <= percentage < 30:
-        color = 'CCFF00'
-    elif 30 <= percentage < 40:
-        color = 'FFFF00'
-    elif 40 <= percentage < 50:
-        color = 'FFCC00'
-    elif 50 <= percentage < 60:
-        color = 'FF9900'
-    elif 60 <= percentage < 70:
-        color = 'FF6600'
-    elif 70 <= percentage < 80:
-        color = 'FF3300'
-    elif 80 <= percentage < 90:
-        color = 'FF0000'
-    elif 90 <= percentage <= 100:
-        color = '990000'
-    
-    if color:
-        fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
-        cell.fill = fill
-
 # Function to process images and store data
-def process_images(image_folder, control_folder, sample_size, output_xlsx, log_folder):
-    files = os.listdir(image_folder)[:sample_size]
+def process_images(image_folder, control_folder, sample_size, output_xlsx, log_folder, cache_path=cache_path,
+                   formats=("xlsx", "csv"), journal_path=None, restart=False):
+    # Sorted so the sample, and the row order, stay the same when files are added
+    files = sorted(os.listdir(image_folder))[:sample_size]
     control_files = [os.path.join(control_folder, f) for f in os.listdir(control_folder) 
                      if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    control_images = [Image.open(f) for f in control_files]
-    control_phashes = [calculate_phash(img) for img in control_images]
 
-    results = []
+    # Finished rows are journaled as they are produced; a rerun only processes new or changed files
+    journal = RunJournal(journal_path or default_journal_path(output_xlsx), {
+        "script": "data-refined",
+        "controls": files_fingerprint(control_files),
+        "standardized_size": list(STANDARDIZED_SIZE),
+        "hash_min_side": hash_min_side,
+    })
+    if restart:
+        journal.clear()
+    if len(journal):
+        print(f"Resuming: {len(journal)} images already finished")
+    # Control and original pHashes come from the feature cache, keyed by file content
+    cache = FeatureCache(cache_path)
+    control_phashes = [cached_image_hashes(cache, f, ("phash",), hash_min_side)["phash"] for f in control_files]
+
     error_log = []
 
+    # Rows are streamed to every output format as they are produced; the CSV is flushed per row
+    headers = result_headers()
+    sink = open_results_sinks(output_xlsx, headers, formats, color_from_column=3)
+
     for idx, file in enumerate(files, start=1):
         print(f"Processing image {idx} of {len(files)}: {file}")
         file_path = os.path.join(image_folder, file)
         try:
+            fingerprint = file_fingerprint(file_path)
+            finished_row = journal.row(file, fingerprint)
+            if finished_row is not None:
+                sink.write_row(finished_row)
+                continue
+
             original_image = Image.open(file_path)
-            original_phash = calculate_phash(original_image)
-            standardized_image = resize_and_crop(file_path, STANDARDIZED_SIZE)
+            original_phash = cached_image_hashes(cache, file_path, ("phash",), hash_min_side)["phash"]
+            standardized_image = resize_and_crop(original_image, STANDARDIZED_SIZE)  # Reuses the decoded original
             standardized_phash = calculate_phash(standardized_image)
 
             # Compare Standardized pHash to Original pHash
             similarity_standardized_to_original = calculate_hash_similarity(original_phash, standardized_phash)
 
             transformations = apply_transformations(original_image)
+            # Only hashes and black-pixel ratios are needed, so the engine works on a small grayscale level
+            engine = AugmentationEngine(original_image)
             row = {
                 "Image Name": file,
                 "Original Size": f"{original_image.size[0]}x{original_image.size[1]}",
@@ -152,19 +158,26 @@ def process_images(image_folder, control_folder, sample_size, output_xlsx, log_f
                 row[f"Control {control_idx} % Similarity to Original"] = round(calculate_hash_similarity(original_phash, control_phash), 2)
                 row[f"Control {control_idx} % Similarity to Standardized"] = round(calculate_hash_similarity(standardized_phash, control_phash), 2)
 
-            for name, transformed_image in transformations.items():
-                transformed_phash = calculate_phash(transformed_image)
+            # Hash every transformation in one batch
+            transformed_phashes = engine.phashes(transformations)
+            for transformation, transformed_phash in zip(transformations, transformed_phashes):
+                name = transformation.name
                 row[f"{name} pHash % Similarity to Original"] = round(calculate_hash_similarity(original_phash, transformed_phash), 2)
                 row[f"{name} pHash % Similarity to Standardized"] = round(calculate_hash_similarity(standardized_phash, transformed_phash), 2)
-                row[f"{name} % Black Pixels"] = calculate_black_pixel_percentage(transformed_image)
+                row[f"{name} % Black Pixels"] = engine.black_pixel_percentage(transformation)
 
-            results.append(row)
+            values = [row.get(header, "") for header in headers]
+            sink.write_row(values)
+            journal.record(file, fingerprint, values)
 
         except Exception as e:
             print(f"Error processing {file}: {e}")
             error_log.append(f"Error processing {file}: {e}")
 
-    write_to_excel(results, output_xlsx)
+    cache.close()
+    journal.close()
+    sink.close()
+    print(f"Results saved to {output_xlsx}")
 
     if error_log:
         error_log_path = os.path.join(log_folder, "error_log.txt")
@@ -172,44 +185,26 @@ def process_images(image_folder, control_folder, sample_size, output_xlsx, log_f
             log_file.write("\n".join(error_log))
         print(f"Error log saved to {error_log_path}")
 
+# Function to list the results columns in output order
+def result_headers():
+    transform_names = [
+        "Mild Crop 1", "Mild Crop 2", "Heavy Crop 1", "Heavy Crop 2",
+        "Mild Rotation 1", "Mild Rotation 2", "Heavy Rotation 1", "Heavy Rotation 2",
+        "Random Crop", "Random Rotation"
+    ]
+    return ["Image Name", "Original Size", "Standardized % Similarity to Original"] + \
+           [f"Control {i} % Similarity to Original" for i in range(1, 6)] + \
+           [f"Control {i} % Similarity to Standardized" for i in range(1, 6)] + \
+           [f"{name} pHash % Similarity to Original" for name in transform_names] + \
+           [f"{name} pHash % Similarity to Standardized" for name in transform_names] + \
+           [f"{name} % Black Pixels" for name in transform_names]
+
 # Function to write results to Excel
 def write_to_excel(data, output_path):
-    workbook = Workbook()
-    sheet = workbook.active
-
-    headers = ["Image Name", "Original Size", "Standardized % Similarity to Original"] + \
-              [f"Control {i} % Similarity to Original" for i in range(1, 6)] + \
-              [f"Control {i} % Similarity to Standardized" for i in range(1, 6)] + \
-              [f"{name} pHash % Similarity to Original" for name in [
-                  "Mild Crop 1", "Mild Crop 2", "Heavy Crop 1", "Heavy Crop 2",
-                  "Mild Rotation 1", "Mild Rotation 2", "Heavy Rotation 1", "Heavy Rotation 2",
-                  "Random Crop", "Random Rotation"
-              ]] + \
-              [f"{name} pHash % Similarity to Standardized" for name in [
-                  "Mild Crop 1", "Mild Crop 2", "Heavy Crop 1", "Heavy Crop 2",
-                  "Mild Rotation 1", "Mild Rotation 2", "Heavy Rotation 1", "Heavy Rotation 2",
-                  "Random Crop", "Random Rotation"
-              ]] + \
-              [f"{name} % Black Pixels" for name in [
-                  "Mild Crop 1", "Mild Crop 2", "Heavy Crop 1", "Heavy Crop 2",
-                  "Mild Rotation 1", "Mild Rotation 2", "Heavy Rotation 1", "Heavy Rotation 2",
-                  "Random Crop", "Random Rotation"
-              ]]
-    sheet.append(headers)
-
-    for row in data:
-        sheet.append([row.get(header, "") for header in headers])
-
-    for col_idx in range(3, len(headers) + 1):
-        for cell in sheet.iter_cols(min_col=col_idx, max_col=col_idx, min_row=2, max_row=sheet.max_row):
-            for c in cell:
-                try:
-                    value = float(c.value)
-                    color_cell_based_on_percentage(c, value)
-                except ValueError:
-                    pass
-
-    workbook.save(output_path)
+    headers = result_headers()
+    with open_results_sinks(output_path, headers, ("xlsx",), color_from_column=3) as sink:
+        for row in data:
+            sink.write_row([row.get(header, "") for header in headers])
     print(f"Results saved to {output_path}")
 
 # Main execution
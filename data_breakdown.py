@@ -1,136 +1,202 @@
 import os
 import cv2
+import logging
 import numpy as np
-from PIL import Image
-import imagehash
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill
 import time
 import random
-
-# Function to apply transformations (crops and rotations)
-def apply_transformations(img):
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from augmentation import AugmentationEngine, crop, rotate_array, rotation
+from image_features import ImageFeatures, refined_phash_similarity, orb_similarity
+from instrumentation import metrics
+from results_writer import open_results_sinks
+from run_journal import RunJournal, default_journal_path, file_fingerprint, files_fingerprint
+
+log = logging.getLogger(__name__)
+
+# Function to describe the transformations (crops and rotations) of a width x height image
+def transformation_specs(width, height, rng=random):
+    return [
+        crop("Mild Crop 1", (int(0.05 * width), int(0.05 * height), int(0.95 * width), int(0.95 * height))),
+        crop("Mild Crop 2", (int(0.1 * width), int(0.1 * height), int(0.9 * width), int(0.9 * height))),
+        crop("Heavy Crop 1", (int(0.2 * width), int(0.2 * height), int(0.8 * width), int(0.8 * height))),
+        crop("Heavy Crop 2", (int(0.25 * width), int(0.25 * height), int(0.75 * width), int(0.75 * height))),
+        random_crop_spec(width, height, rng),
+        rotation("Mild Rotation 1", 10),
+        rotation("Mild Rotation 2", 15),
+        rotation("Heavy Rotation 1", 45),
+        rotation("Heavy Rotation 2", 90),
+    ]
+
+# Function to apply transformations (crops and rotations) at full resolution
+def apply_transformations(img, rng=random):
+    engine = AugmentationEngine(img)
     height, width = img.shape[:2]
+    return [(engine.render(t, full=True), t.name) for t in transformation_specs(width, height, rng)]
 
-    mild_crop1 = img[int(0.05 * height):int(0.95 * height), int(0.05 * width):int(0.95 * width)]
-    mild_crop2 = img[int(0.1 * height):int(0.9 * height), int(0.1 * width):int(0.9 * width)]
-    heavy_crop1 = img[int(0.2 * height):int(0.8 * height), int(0.2 * width):int(0.8 * width)]
-    heavy_crop2 = img[int(0.25 * height):int(0.75 * height), int(0.25 * width):int(0.75 * width)]
-    random_crop = random_crop_image(img)
-
-    mild_rotation1 = rotate_image(img, 10)
-    mild_rotation2 = rotate_image(img, 15)
-    heavy_rotation1 = rotate_image(img, 45)
-    heavy_rotation2 = rotate_image(img, 90)
-
-    return [(mild_crop1, "Mild Crop 1"), (mild_crop2, "Mild Crop 2"),
-            (heavy_crop1, "Heavy Crop 1"), (heavy_crop2, "Heavy Crop 2"),
-            (random_crop, "Random Crop"),
-            (mild_rotation1, "Mild Rotation 1"), (mild_rotation2, "Mild Rotation 2"),
-            (heavy_rotation1, "Heavy Rotation 1"), (heavy_rotation2, "Heavy Rotation 2")]
-
-# Helper function to rotate an image by a specified angle
+# Helper function to rotate an image by a specified angle (multiples of 90 are lossless)
 def rotate_image(img, angle):
-    height, width = img.shape[:2]
-    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1)
-    return cv2.warpAffine(img, matrix, (width, height))
+    return rotate_array(img, angle)
+
+# Helper function to pick a random crop box
+def random_crop_spec(width, height, rng=random):
+    top = rng.randint(0, int(0.2 * height))
+    bottom = rng.randint(int(0.8 * height), height)
+    left = rng.randint(0, int(0.2 * width))
+    right = rng.randint(int(0.8 * width), width)
+    return crop("Random Crop", (left, top, right, bottom))
 
 # Helper function for random cropping
-def random_crop_image(img):
+def random_crop_image(img, rng=random):
     height, width = img.shape[:2]
-    top = random.randint(0, int(0.2 * height))
-    bottom = random.randint(int(0.8 * height), height)
-    left = random.randint(0, int(0.2 * width))
-    right = random.randint(int(0.8 * width), width)
+    left, top, right, bottom = random_crop_spec(width, height, rng).value
     return img[top:bottom, left:right]
 
-# Refined pHash similarity function with cropping based on the smaller dimensions
-def refined_phash_similarity(img1, img2):
+# Helper function to derive a stable random seed from an image file name
+def image_seed(image_file):
+    return zlib.crc32(image_file.encode("utf-8"))
+
+# Function to load the control images compared against every original
+def load_random_images(random_image_folder, random_image_files):
+    random_images = []
+    for random_image_file in random_image_files:
+        with metrics.timer("decode"):
+            random_img = cv2.imread(os.path.join(random_image_folder, random_image_file))
+        # Wrapped once so their ORB features and hashes are shared across every original
+        random_images.append((random_image_file, ImageFeatures(random_img) if random_img is not None else None))
+    return random_images
+
+# Function to compute the result row for a single original image
+def process_single_image(image_folder, image_file, random_images):
     """
-    Crops the original image to match the dimensions of the comparison image if needed,
-    then compares the pHash similarity.
+    Runs one original image through every transformation and control comparison.
+    Random crops are seeded from the file name, so the row is the same whether it
+    is computed serially or in a worker process. Returns None if the image fails to load.
     """
-    if img1.shape != img2.shape:
-        # Calculate the center crop of the original image to match comparison image dimensions
-        height1, width1 = img1.shape[:2]
-        height2, width2 = img2.shape[:2]
-        start_x = (width1 - width2) // 2
-        start_y = (height1 - height2) // 2
-        cropped_img1 = img1[start_y:start_y + height2, start_x:start_x + width2]
-    else:
-        cropped_img1 = img1  # No need to crop if dimensions are identical
-
-    # Debugging information to confirm dimensions
-    print(f"Comparing images of size: {cropped_img1.shape} and {img2.shape}")
-    
-    # Convert OpenCV images to PIL format for hashing
-    pil_img1 = Image.fromarray(cv2.cvtColor(cropped_img1, cv2.COLOR_BGR2RGB))
-    pil_img2 = Image.fromarray(cv2.cvtColor(img2, cv2.COLOR_BGR2RGB))
-    
-    # Compute pHash for both resized images
-    hash1 = imagehash.phash(pil_img1)
-    hash2 = imagehash.phash(pil_img2)
-    
-    # Calculate similarity based on pHash (0 = identical, higher values = less similar)
-    phash_similarity = 1 - (hash1 - hash2) / len(hash1.hash) ** 2
-    return phash_similarity * 100  # Return as percentage similarity
-
-# ORB similarity function that uses keypoint matching
-def orb_similarity(img1, img2):
-    orb = cv2.ORB_create()
-    kp1, des1 = orb.detectAndCompute(img1, None)
-    kp2, des2 = orb.detectAndCompute(img2, None)
-
-    if des1 is None or des2 is None:
-        return 0
-
-    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-    matches = bf.match(des1, des2)
-
-    if len(matches) == 0:
-        return 0
-
-    good_matches = [m for m in matches if m.distance < 42]
-    similarity_percentage = len(good_matches) / min(len(kp1), len(kp2)) * 100
-    return min(similarity_percentage, 100)
-
-# Function to color cells based on percentage
-def color_cell_based_on_percentage(cell, percentage):
-    color = None
-    if 0 <= percentage < 10:
-        color = '00FF00'
-    elif 10 <= percentage < 20:
-        color = '66FF00'
-    elif 20 <= percentage < 30:
-        color = 'CCFF00'
-    elif 30 <= percentage < 40:
-        color = 'FFFF00'
-    elif 40 <= percentage < 50:
-        color = 'FFCC00'
-    elif 50 <= percentage < 60:
-        color = 'FF9900'
-    elif 60 <= percentage < 70:
-        color = 'FF6600'
-    elif 70 <= percentage < 80:
-        color = 'FF3300'
-    elif 80 <= percentage < 90:
-        color = 'FF0000'
-    elif 90 <= percentage <= 100:
-        color = '990000'
-    
-    if color:
-        fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
-        cell.fill = fill
+    img_path = os.path.join(image_folder, image_file)
+    with metrics.timer("decode"):
+        img = cv2.imread(img_path)
+
+    if img is None:
+        log.warning("Failed to load image: %s", image_file)
+        return None
+
+    height, width = img.shape[:2]
+    transformations = transformation_specs(width, height, random.Random(image_seed(image_file)))
+    original = ImageFeatures(img)  # Extracted once, reused for all 14 comparisons
+    row = [image_file]
+
+    # pHash and ORB both compare the full-resolution render, as the original apply_transformations loop did
+    engine = AugmentationEngine(original)
+    for t in transformations:
+        log.debug("  Applying transformation: %s", t.name)
+        transformed = ImageFeatures(engine.render(t, full=True))
+        phash_sim = refined_phash_similarity(original, transformed)
+        orb_sim = orb_similarity(original, transformed)
+        row.extend([round(phash_sim, 2), round(orb_sim, 2)])
+
+    for random_image_file, random_img in random_images:
+        if random_img is None:
+            log.warning("  Failed to load random image: %s", random_image_file)
+            continue
+
+        log.debug("  Comparing with random image: %s", random_image_file)
+        phash_random_sim = refined_phash_similarity(original, random_img)
+        orb_random_sim = orb_similarity(original, random_img)
+        row.extend([round(phash_random_sim, 2), round(orb_random_sim, 2)])
+
+    metrics.count("images_processed")
+    return row
+
+# Control images loaded once per worker process
+worker_random_images = None
+
+# Initializer for pool workers: load the control images once per process
+def init_worker(random_image_folder, random_image_files, collect_metrics=False):
+    global worker_random_images
+    cv2.setNumThreads(1)  # One OpenCV thread per process to avoid oversubscribing cores
+    if collect_metrics:
+        metrics.enable()
+    worker_random_images = load_random_images(random_image_folder, random_image_files)
+
+# Worker entry point used by the process pool; returns the row and the worker's metrics since the last image
+def process_image_in_worker(image_folder, image_file):
+    row = process_single_image(image_folder, image_file, worker_random_images)
+    return row, metrics.drain() if metrics.enabled else None
+
+# Function to yield (image_file, row) pairs in input order, serially or across a process pool
+def compute_image_rows(image_folder, image_files, random_image_folder, random_image_files, workers=1):
+    if not image_files:
+        return
+    if workers is None or workers <= 1:
+        random_images = load_random_images(random_image_folder, random_image_files)
+        for image_file in image_files:
+            yield image_file, process_single_image(image_folder, image_file, random_images)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(random_image_folder, random_image_files, metrics.enabled)) as executor:
+        results = executor.map(process_image_in_worker, [image_folder] * len(image_files), image_files)
+        for image_file, (row, worker_metrics) in zip(image_files, results):
+            metrics.merge(worker_metrics)
+            yield image_file, row
+
+# Function to yield (image_file, row) pairs in input order, reusing rows the journal already holds
+def iter_image_rows(image_folder, image_files, random_image_folder, random_image_files, workers=1, journal=None):
+    """
+    Images finished in an earlier run (same name, size and mtime) come from the
+    journal; only the rest are computed, and each new row is journaled as soon
+    as it arrives.
+    """
+    fingerprints, finished = {}, {}
+    if journal is not None:
+        for image_file in image_files:
+            fingerprints[image_file] = file_fingerprint(os.path.join(image_folder, image_file))
+            row = journal.row(image_file, fingerprints[image_file])
+            if row is not None:
+                finished[image_file] = row
+    pending = [image_file for image_file in image_files if image_file not in finished]
+    if finished:
+        log.info("Resuming: %d of %d images already finished", len(finished), len(image_files))
+
+    computed = compute_image_rows(image_folder, pending, random_image_folder, random_image_files, workers)
+    for image_file in image_files:
+        if image_file in finished:
+            metrics.count("images_resumed")
+            yield image_file, finished[image_file]
+            continue
+        _, row = next(computed)
+        if journal is not None and row is not None:
+            journal.record(image_file, fingerprints[image_file], row)
+        yield image_file, row
 
 # Function to process images and generate results
-def process_images(image_folder, random_image_folder, output_xlsx):
-    image_files = [f for f in os.listdir(image_folder) if f.endswith(('.png', '.jpg', '.jpeg'))]
+def process_images(image_folder, random_image_folder, output_xlsx, workers=1, formats=("xlsx", "csv"),
+                   metrics_path=None, journal_path=None, restart=False):
+    """
+    Scores every original against its transformations and the control images.
+    With metrics_path, per-stage timings and counters are collected and written
+    there (Prometheus text for .prom/.txt, JSON otherwise).
+
+    Finished rows are journaled (by default next to output_xlsx), so a rerun
+    after a crash, or after new files are added, only processes what is new.
+    The outputs are always rewritten with every row. restart=True ignores the
+    journal's earlier rows.
+    """
+    if metrics_path:
+        metrics.enable()
+    # Sorted so reruns list rows in the same order
+    image_files = sorted(f for f in os.listdir(image_folder) if f.endswith(('.png', '.jpg', '.jpeg')))
     random_image_files = [f for f in os.listdir(random_image_folder) if f.endswith(('.png', '.jpg', '.jpeg'))]
     random_image_files = random_image_files[:5]
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Image Similarities"
+    # Rows depend on the control images, so changing them starts a separate journal run
+    journal = RunJournal(journal_path or default_journal_path(output_xlsx), {
+        "script": "data_breakdown",
+        "random_images": files_fingerprint([os.path.join(random_image_folder, f) for f in random_image_files]),
+    })
+    if restart:
+        journal.clear()
 
     header = ["Original Image", 
               "Mild Crop 1 pHash %", "Mild Crop 1 ORB %", 
@@ -148,61 +214,33 @@ def process_images(image_folder, random_image_folder, output_xlsx):
               "Random Image 4 pHash %", "Random Image 4 ORB %",
               "Random Image 5 pHash %", "Random Image 5 ORB %"]
 
-    ws.append(header)
+    # Rows are written (and coloured) as they are produced; the CSV copy is flushed per row
+    with journal, open_results_sinks(output_xlsx, header, formats, title="Image Similarities") as sink:
+        start_time = time.time()
 
-    start_time = time.time()
-    
-    for idx, image_file in enumerate(image_files):
-        print(f"Processing image {idx + 1} of {len(image_files)}: {image_file}")
-        img_path = os.path.join(image_folder, image_file)
-        img = cv2.imread(img_path)
-        
-        if img is None:
-            print(f"Failed to load image: {image_file}")
-            continue
-        
-        transformations = apply_transformations(img)
-        row = [image_file]
-        
-        for transformed_img, transform_name in transformations:
-            print(f"  Applying transformation: {transform_name}")
-            phash_sim = refined_phash_similarity(img, transformed_img)
-            orb_sim = orb_similarity(img, transformed_img)
-            row.extend([round(phash_sim, 2), round(orb_sim, 2)])
-
-        for random_image_file in random_image_files:
-            random_img_path = os.path.join(random_image_folder, random_image_file)
-            random_img = cv2.imread(random_img_path)
-            
-            if random_img is None:
-                print(f"  Failed to load random image: {random_image_file}")
+        rows = iter_image_rows(image_folder, image_files, random_image_folder, random_image_files, workers, journal)
+        for idx, (image_file, row) in enumerate(rows):
+            log.info("Processed image %d of %d: %s", idx + 1, len(image_files), image_file)
+            if row is None:
                 continue
-            
-            print(f"  Comparing with random image: {random_image_file}")
-            phash_random_sim = refined_phash_similarity(img, random_img)
-            orb_random_sim = orb_similarity(img, random_img)
-            row.extend([round(phash_random_sim, 2), round(orb_random_sim, 2)])
-        
-        ws.append(row)
-        
-        elapsed_time = time.time() - start_time
-        print(f"Completed processing for {image_file}. Time elapsed: {elapsed_time:.2f} seconds.\n")
-
-    for row in ws.iter_rows(min_row=2, min_col=2, max_row=ws.max_row, max_col=ws.max_column):
-        for cell in row:
-            try:
-                value = float(cell.value)
-                color_cell_based_on_percentage(cell, value)
-            except ValueError:
-                pass
-    
-    wb.save(output_xlsx)
+
+            sink.write_row(row)
+
+            elapsed_time = time.time() - start_time
+            log.info("Completed processing for %s. Time elapsed: %.2f seconds.", image_file, elapsed_time)
+
+    if metrics_path:
+        metrics.write(metrics_path)
+        log.info("Metrics written to %s", metrics_path)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
     # Define the folder paths and output file
     image_folder = '/Users/rosshartigan/Nelson Development/Motion Ads/Data-Analysis/Flyers'  # Folder with original 1000 images
     random_image_folder = '/Users/rosshartigan/Nelson Development/Motion Ads/Data-Analysis/Random'  # Folder with random images
     output_xlsx = '/Users/rosshartigan/Nelson Development/Motion Ads/Data-Analysis/CSV/results.xlsx'  # Path to save the Excel file
+    workers = os.cpu_count()  # Number of worker processes (1 runs serially)
     
     # Process images
-    process_images(image_folder, random_image_folder, output_xlsx)
\ No newline at end of file
+    process_images(image_folder, random_image_folder, output_xlsx, workers)
\ No newline at end of file
@@ -0,0 +1,135 @@
+import json
+import struct
+
+import numpy as np
+
+# File layout (little-endian, sections aligned to 64 bytes):
+#   header       magic, format version, descriptor size, counts and section offsets
+#   offsets      uint64[n_images + 1]   first descriptor row of each image
+#   keypoints    float32[n_descriptors, 2]   keypoint x, y
+#   descriptors  uint8[n_descriptors, descriptor_size]   raw ORB descriptors
+#   names        utf-8 JSON list of image names (version 1: names separated by newlines)
+MAGIC = b"ORBSTOR1"
+FORMAT_VERSION = 2
+READABLE_VERSIONS = (1, 2)
+HEADER = struct.Struct("<8sIIQQQQQQ")
+ALIGNMENT = 64
+ORB_DESCRIPTOR_SIZE = 32
+
+# Helper to round an offset up to the section alignment
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+# Function to turn cv2.KeyPoint lists (or (N, 2) arrays) into float32 x, y rows
+def keypoints_to_array(keypoints):
+    if isinstance(keypoints, np.ndarray):
+        return np.ascontiguousarray(keypoints[:, :2], dtype=np.float32)
+    return np.array([kp.pt for kp in keypoints], dtype=np.float32).reshape(-1, 2)
+
+# Function to write a descriptor store from (name, keypoints, descriptors) entries
+def write_descriptor_store(path, entries, descriptor_size=ORB_DESCRIPTOR_SIZE):
+    """
+    Writes every entry into one binary file. Keypoints may be cv2.KeyPoint lists,
+    arrays whose first two columns are x, y, or None to store zeros; descriptors
+    may be None for images with no features.
+    """
+    names = []
+    keypoint_blocks = []
+    descriptor_blocks = []
+    offsets = [0]
+    for name, keypoints, descriptors in entries:
+        if descriptors is None:
+            descriptors = np.zeros((0, descriptor_size), dtype=np.uint8)
+        descriptors = np.ascontiguousarray(descriptors, dtype=np.uint8)
+        if keypoints is None:
+            points = np.zeros((len(descriptors), 2), dtype=np.float32)
+        else:
+            points = keypoints_to_array(keypoints)
+        if descriptors.shape[1] != descriptor_size or len(points) != len(descriptors):
+            raise ValueError(f"Keypoints and descriptors do not line up for {name}")
+        names.append(str(name))
+        keypoint_blocks.append(points)
+        descriptor_blocks.append(descriptors)
+        offsets.append(offsets[-1] + len(descriptors))
+
+    n_images = len(names)
+    n_descriptors = offsets[-1]
+    offsets_offset = _align(HEADER.size)
+    keypoints_offset = _align(offsets_offset + 8 * (n_images + 1))
+    descriptors_offset = _align(keypoints_offset + 8 * n_descriptors)
+    names_offset = _align(descriptors_offset + descriptor_size * n_descriptors)
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, descriptor_size, n_images, n_descriptors,
+                            offsets_offset, keypoints_offset, descriptors_offset, names_offset))
+        f.seek(offsets_offset)
+        f.write(np.array(offsets, dtype="<u8").tobytes())
+        f.seek(keypoints_offset)
+        for block in keypoint_blocks:
+            f.write(block.astype("<f4").tobytes())
+        f.seek(descriptors_offset)
+        for block in descriptor_blocks:
+            f.write(block.tobytes())
+        f.seek(names_offset)
+        f.write(json.dumps(names).encode("utf-8"))
+
+
+class DescriptorStore:
+    """
+    Read-only view of a descriptor store file. Offsets, keypoints and descriptors
+    are numpy.memmap arrays, so opening the store reads only the header and names
+    and descriptor blocks are paged in on access without copying or parsing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+            (magic, version, self.descriptor_size, n_images, n_descriptors,
+             offsets_offset, keypoints_offset, descriptors_offset, names_offset) = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a descriptor store")
+            if version not in READABLE_VERSIONS:
+                raise ValueError(f"Unsupported descriptor store version {version}")
+            f.seek(names_offset)
+            names = f.read().decode("utf-8")
+        if version == 1:
+            self.names = names.split("\n") if n_images else []
+        else:
+            self.names = json.loads(names)
+        self._positions = {name: i for i, name in enumerate(self.names)}
+        self.offsets = np.memmap(path, dtype="<u8", mode="r", offset=offsets_offset, shape=(n_images + 1,))
+        if n_descriptors:
+            self.all_keypoints = np.memmap(path, dtype="<f4", mode="r", offset=keypoints_offset,
+                                           shape=(n_descriptors, 2))
+            self.all_descriptors = np.memmap(path, dtype=np.uint8, mode="r", offset=descriptors_offset,
+                                             shape=(n_descriptors, self.descriptor_size))
+        else:
+            self.all_keypoints = np.zeros((0, 2), dtype=np.float32)
+            self.all_descriptors = np.zeros((0, self.descriptor_size), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _index(self, key):
+        return self._positions[key] if isinstance(key, str) else int(key)
+
+    def _rows(self, key):
+        i = self._index(key)
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def descriptors(self, key):
+        """Descriptor rows of one image (by name or position), as a memmap view."""
+        start, end = self._rows(key)
+        return self.all_descriptors[start:end]
+
+    def keypoints(self, key):
+        start, end = self._rows(key)
+        return self.all_keypoints[start:end]
+
+    def image_of(self, descriptor_rows):
+        """Maps global descriptor row numbers back to image positions."""
+        return np.searchsorted(self.offsets, descriptor_rows, side="right") - 1
+
+    def __getitem__(self, key):
+        return self.keypoints(key), self.descriptors(key)
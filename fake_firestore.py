@@ -0,0 +1,137 @@
+import copy
+import threading
+import time
+
+
+class ArrayUnion:
+    """Stand-in for firestore.ArrayUnion."""
+
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class Increment:
+    """Stand-in for firestore.Increment."""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data, update_time):
+        self.id = doc_id
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        # Like DocumentSnapshot.get: None for a missing document, KeyError for a missing field
+        if self._data is None:
+            return None
+        return self._data[field]
+
+
+class FakeWatch:
+    def __init__(self, listeners, callback):
+        self._listeners = listeners
+        self._callback = callback
+
+    def unsubscribe(self):
+        if self._callback in self._listeners:
+            self._listeners.remove(self._callback)
+
+
+# Helper to apply one update value, resolving ArrayUnion/Increment from either this module or firestore
+def _apply_field(current, value):
+    kind = type(value).__name__
+    if kind == "ArrayUnion":
+        merged = list(current or [])
+        for item in value.values:
+            if item not in merged:
+                merged.append(item)
+        return merged
+    if kind == "Increment":
+        return (current or 0) + value.value
+    return copy.deepcopy(value)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self._key = (collection, doc_id)
+        self.id = doc_id
+
+    def _snapshot(self, field_paths=None):
+        data = self._client._docs.get(self._key)
+        if data is not None and field_paths is not None:
+            data = {field: data[field] for field in field_paths if field in data}
+        return FakeSnapshot(self.id, data, self._client._update_times.get(self._key))
+
+    def get(self, field_paths=None):
+        self._client.reads += 1
+        return self._snapshot(field_paths)
+
+    def set(self, data):
+        self._write({field: value for field, value in data.items()}, replace=True)
+
+    def update(self, data):
+        if self._key not in self._client._docs:
+            raise KeyError(f"No document to update: {'/'.join(self._key)}")
+        self._write(data, replace=False)
+
+    def _write(self, data, replace):
+        with self._client._lock:
+            current = {} if replace else dict(self._client._docs.get(self._key, {}))
+            for field, value in data.items():
+                current[field] = _apply_field(current.get(field), value)
+            self._client._docs[self._key] = current
+            self._client._update_times[self._key] = time.time()
+            self._client.writes += 1
+            listeners = list(self._client._listeners.get(self._key, []))
+        snapshot = self._snapshot()
+        for callback in listeners:
+            self._client.reads += 1
+            callback([snapshot], [], snapshot.update_time)
+
+    def on_snapshot(self, callback):
+        listeners = self._client._listeners.setdefault(self._key, [])
+        listeners.append(callback)
+        snapshot = self._snapshot()
+        self._client.reads += 1
+        callback([snapshot], [], snapshot.update_time)
+        return FakeWatch(listeners, callback)
+
+
+class FakeCollectionReference:
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+
+    def document(self, doc_id):
+        return FakeDocumentReference(self._client, self._name, doc_id)
+
+
+class FakeFirestoreClient:
+    """
+    In-process Firestore fake covering the calls this project makes:
+    collection().document() get/set/update (with ArrayUnion and Increment)
+    and on_snapshot listeners. It counts billed reads and writes so caching
+    can be checked without the emulator.
+    """
+
+    def __init__(self):
+        self._docs = {}
+        self._update_times = {}
+        self._listeners = {}
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
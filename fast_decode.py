@@ -0,0 +1,125 @@
+"""
+Reduced-resolution decode for hashing.
+
+pHash (and aHash/dHash/wHash) only look at a small grayscale thumbnail, so
+fully decoding a multi-megapixel JPEG is wasted work. libjpeg can decode at
+1/2, 1/4 or 1/8 scale straight from the DCT coefficients, which PIL exposes
+as Image.draft() and OpenCV as IMREAD_REDUCED_GRAYSCALE_*. The scale is
+chosen so the shorter side stays at least min_side pixels; non-JPEG files
+are decoded normally.
+
+A reduced decode can move a few pHash bits (up to 2 on the synthetic flyers
+at min_side 128), so it is opt-in: hashes that are compared with each other
+must come from the same decode.
+
+    python fast_decode.py IMAGE_FOLDER [--min-side 128 256]
+
+prints the Hamming delta against a full decode and the time saved.
+"""
+import os
+import time
+
+from PIL import Image
+
+from instrumentation import metrics
+
+# libjpeg DCT scaling factors, largest first
+REDUCED_SCALES = (8, 4, 2, 1)
+
+# Shorter side to keep after scaling (4x the 32x32 pHash working size)
+DEFAULT_MIN_SIDE = 128
+
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+# Function to pick the largest DCT scale that keeps the shorter side at least min_side
+def choose_scale(size, min_side=DEFAULT_MIN_SIDE):
+    for scale in REDUCED_SCALES:
+        if min(size) // scale >= min_side:
+            return scale
+    return 1
+
+# Function to open an image for hashing only, decoding JPEGs at reduced scale with PIL draft()
+def open_for_hashing(path, min_side=None, mode="L"):
+    """
+    Returns a PIL image in mode. With min_side set, a large enough JPEG is
+    decoded at 1/2, 1/4 or 1/8 scale; without it the decode is full size. Use the full Image.open path when the pixels are
+    needed for anything but hashing (ORB, crops, transformations).
+    """
+    with metrics.timer("decode"):
+        image = Image.open(path)
+        if min_side:
+            image.draft(mode, (min_side, min_side))
+        image = image.convert(mode) if image.mode != mode else image
+        image.load()
+    return image
+
+# Function to decode a JPEG to grayscale at reduced scale with OpenCV
+def read_reduced_gray(path, min_side=DEFAULT_MIN_SIDE):
+    import cv2
+
+    reduced_flags = {
+        2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+        4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+        8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    }
+    with Image.open(path) as header:  # Reads only the header to get the size
+        scale = choose_scale(header.size, min_side) if min_side else 1
+    gray = cv2.imread(path, reduced_flags.get(scale, cv2.IMREAD_GRAYSCALE))
+    if gray is None:
+        raise ValueError(f"Could not decode {path}")
+    return Image.fromarray(gray)
+
+# Function to measure the hash change and speedup of reduced decoding against a full decode
+def decode_accuracy_report(paths, hash_type="phash", min_sides=(DEFAULT_MIN_SIDE,), methods=("pil", "cv2")):
+    """
+    Returns one dict per (method, min_side) with the mean and max Hamming
+    distance to the full-decode hash, the share of files whose hash changed,
+    and total decode+hash seconds for the full and reduced paths.
+    """
+    from hash_core import generate_hash
+
+    full_hashes = []
+    start = time.perf_counter()
+    for path in paths:
+        with Image.open(path) as image:
+            full_hashes.append(generate_hash(image, hash_type))
+    full_seconds = time.perf_counter() - start
+
+    readers = {"pil": open_for_hashing, "cv2": read_reduced_gray}
+    report = []
+    for method in methods:
+        for min_side in min_sides:
+            distances = []
+            start = time.perf_counter()
+            for path, full_hash in zip(paths, full_hashes):
+                distances.append(generate_hash(readers[method](path, min_side), hash_type) - full_hash)
+            seconds = time.perf_counter() - start
+            report.append({
+                "method": method,
+                "min_side": min_side,
+                "files": len(paths),
+                "mean_distance": sum(distances) / len(distances) if distances else 0,
+                "max_distance": max(distances, default=0),
+                "changed": sum(1 for d in distances if d) / len(distances) if distances else 0,
+                "full_seconds": full_seconds,
+                "reduced_seconds": seconds,
+                "speedup": full_seconds / seconds if seconds else 0,
+            })
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare reduced-resolution JPEG decode against full decode for hashing.")
+    parser.add_argument("image_folder")
+    parser.add_argument("--type", default="phash", choices=("phash", "ahash", "dhash", "whash", "rhash"))
+    parser.add_argument("--min-side", type=int, nargs="+", default=[DEFAULT_MIN_SIDE, 256])
+    args = parser.parse_args()
+
+    paths = [os.path.join(args.image_folder, f) for f in sorted(os.listdir(args.image_folder))
+             if f.lower().endswith(JPEG_EXTENSIONS)]
+    print(f"{'method':<6} {'min_side':>8} {'mean d':>7} {'max d':>6} {'changed':>8} {'full s':>8} {'reduced s':>9} {'speedup':>7}")
+    for row in decode_accuracy_report(paths, args.type, args.min_side):
+        print(f"{row['method']:<6} {row['min_side']:>8} {row['mean_distance']:>7.2f} {row['max_distance']:>6} "
+              f"{row['changed']:>8.1%} {row['full_seconds']:>8.2f} {row['reduced_seconds']:>9.2f} {row['speedup']:>6.1f}x")
@@ -0,0 +1,274 @@
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+from PIL import Image
+import imagehash
+
+from fast_decode import open_for_hashing
+from rotation_hash import rotation_hash
+
+# Default location of the on-disk cache
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".motion_hash", "feature_cache.sqlite3")
+
+# Default size bound for cached values (bytes)
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Cache hits whose last_access update is held in memory before it is written
+DEFAULT_TOUCH_BATCH = 256
+
+# Bump an extractor's version whenever its output changes; older entries are then ignored
+EXTRACTOR_VERSIONS = {
+    "phash": 1,
+    "ahash": 1,
+    "dhash": 1,
+    "whash": 1,
+    "rhash": 1,
+    "orb": 1,
+}
+
+HASH_FUNCTIONS = {
+    "phash": imagehash.phash,
+    "ahash": imagehash.average_hash,
+    "dhash": imagehash.dhash,
+    "whash": imagehash.whash,
+    "rhash": rotation_hash,
+}
+
+# Function to hash a file's content so cache entries survive renames and moves
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Helper to serialize an array without pickling
+def _array_to_bytes(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+# Helper to deserialize an array written by _array_to_bytes
+def _array_from_bytes(blob):
+    return np.load(io.BytesIO(blob), allow_pickle=False)
+
+
+class FeatureCache:
+    """
+    SQLite-backed cache of image features keyed by file content hash, extractor
+    name and extractor parameters. Entries written by an older extractor version
+    are treated as misses. The cache is kept under max_bytes by evicting the
+    least recently used entries.
+
+    Hits do not write: their access times are buffered and written in one
+    transaction every touch_batch hits, before any eviction, and on close. The
+    total size is read once on open and then kept up to date by put and evict,
+    so eviction does not scan the table.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, versions=None,
+                 touch_batch=DEFAULT_TOUCH_BATCH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.versions = dict(EXTRACTOR_VERSIONS, **(versions or {}))
+        self.touch_batch = touch_batch
+        self._digests = {}
+        self._touched = {}
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS features (
+                content_hash TEXT NOT NULL,
+                extractor TEXT NOT NULL,
+                params TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (content_hash, extractor, params)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS features_lru ON features (last_access)")
+        self._conn.commit()
+        self._total_bytes = self._sum_sizes()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def digest(self, path):
+        """Content hash of path, memoized on (path, size, mtime) for this session."""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if key not in self._digests:
+            self._digests[key] = file_digest(path)
+        return self._digests[key]
+
+    @staticmethod
+    def _params_key(params):
+        return json.dumps(params or {}, sort_keys=True)
+
+    def get(self, content_hash, extractor, params=None):
+        params_key = self._params_key(params)
+        row = self._conn.execute(
+            "SELECT version, kind, value FROM features WHERE content_hash=? AND extractor=? AND params=?",
+            (content_hash, extractor, params_key),
+        ).fetchone()
+        if row is None or row[0] != self.versions.get(extractor, 1):
+            return None
+        self._touched[(content_hash, extractor, params_key)] = time.time()
+        if len(self._touched) >= self.touch_batch:
+            self.flush()
+        kind, value = row[1], row[2]
+        if kind == "array":
+            return _array_from_bytes(value)
+        if kind == "arrays":
+            stored = np.load(io.BytesIO(value), allow_pickle=False)
+            return tuple(stored[f"arr_{i}"] for i in range(len(stored.files)))
+        if kind == "text":
+            return value.decode("utf-8")
+        return json.loads(value.decode("utf-8"))
+
+    def put(self, content_hash, extractor, value, params=None):
+        if isinstance(value, np.ndarray):
+            kind, blob = "array", _array_to_bytes(value)
+        elif isinstance(value, tuple) and all(isinstance(v, np.ndarray) for v in value):
+            buffer = io.BytesIO()
+            np.savez(buffer, *value)
+            kind, blob = "arrays", buffer.getvalue()
+        elif isinstance(value, str):
+            kind, blob = "text", value.encode("utf-8")
+        else:
+            kind, blob = "json", json.dumps(value).encode("utf-8")
+        key = (content_hash, extractor, self._params_key(params))
+        replaced = self._conn.execute(
+            "SELECT size FROM features WHERE content_hash=? AND extractor=? AND params=?", key
+        ).fetchone()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            key + (self.versions.get(extractor, 1), kind, blob, len(blob), time.time()),
+        )
+        self._conn.commit()
+        self._touched.pop(key, None)
+        self._total_bytes += len(blob) - (replaced[0] if replaced else 0)
+        self.evict()
+
+    def get_or_compute(self, path, extractor, compute, params=None):
+        """Returns the cached value for path, calling compute(path) and storing it on a miss."""
+        content_hash = self.digest(path)
+        value = self.get(content_hash, extractor, params)
+        if value is None:
+            value = compute(path)
+            self.put(content_hash, extractor, value, params)
+        return value
+
+    def flush(self):
+        """Writes the buffered last_access times of recent hits."""
+        if not self._touched:
+            return
+        self._conn.executemany(
+            "UPDATE features SET last_access=? WHERE content_hash=? AND extractor=? AND params=?",
+            [(accessed,) + key for key, accessed in self._touched.items()],
+        )
+        self._conn.commit()
+        self._touched = {}
+
+    def _sum_sizes(self):
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM features").fetchone()[0]
+
+    def total_bytes(self):
+        return self._total_bytes
+
+    def evict(self):
+        """Drops least recently used entries until the cache fits in max_bytes."""
+        excess = self._total_bytes - self.max_bytes
+        if excess <= 0:
+            return
+        self.flush()  # So entries hit since the last flush are not evicted as stale
+        freed = 0
+        stale = []
+        # Walks the last_access index only as far as needed
+        for rowid, size in self._conn.execute("SELECT rowid, size FROM features ORDER BY last_access"):
+            if freed >= excess:
+                break
+            stale.append((rowid,))
+            freed += size
+        self._conn.executemany("DELETE FROM features WHERE rowid=?", stale)
+        self._conn.commit()
+        self._total_bytes -= freed
+
+    def invalidate(self, extractor=None):
+        """
+        Deletes entries for extractor (or every extractor) that were written by a
+        version other than the current one. Pass the extractor with a bumped
+        entry in versions to discard everything it produced before.
+        """
+        extractors = [extractor] if extractor else list(self.versions)
+        for name in extractors:
+            self._conn.execute(
+                "DELETE FROM features WHERE extractor=? AND version!=?",
+                (name, self.versions.get(name, 1)),
+            )
+        self._conn.commit()
+        self._total_bytes = self._sum_sizes()
+
+    def clear(self):
+        self._conn.execute("DELETE FROM features")
+        self._conn.commit()
+        self._touched = {}
+        self._total_bytes = 0
+
+
+# Function to get image hashes for a file, decoding it only if some are missing
+def cached_image_hashes(cache, path, hash_types=("phash", "ahash", "dhash", "whash"), min_side=None):
+    """
+    With min_side set, JPEGs are decoded at reduced scale (see fast_decode) and
+    cached separately from full-decode hashes.
+    """
+    content_hash = cache.digest(path)
+    params = {"min_side": min_side} if min_side else None
+    hashes = {}
+    image = None
+    for hash_type in hash_types:
+        value = cache.get(content_hash, hash_type, params)
+        if value is None:
+            if image is None:
+                image = open_for_hashing(path, min_side) if min_side else Image.open(path)
+            value = str(HASH_FUNCTIONS[hash_type](image))
+            cache.put(content_hash, hash_type, value, params)
+        hashes[hash_type] = imagehash.hex_to_hash(value)
+    return hashes
+
+# Function to get ORB keypoints and descriptors for a file from the cache
+def cached_orb_features(cache, path, nfeatures=500):
+    """
+    Returns (keypoints, descriptors) where keypoints is an (N, 6) float32 array of
+    x, y, size, angle, response, octave. Descriptors may be None if ORB found nothing.
+    """
+    import cv2
+
+    def compute(image_path):
+        image = cv2.imread(image_path)
+        keypoints, descriptors = cv2.ORB_create(nfeatures=nfeatures).detectAndCompute(image, None)
+        points = np.array([(kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave)
+                           for kp in keypoints], dtype=np.float32).reshape(-1, 6)
+        if descriptors is None:
+            descriptors = np.zeros((0, 32), dtype=np.uint8)
+        return points, descriptors
+
+    points, descriptors = cache.get_or_compute(path, "orb", compute, {"nfeatures": nfeatures})
+    return points, (descriptors if len(descriptors) else None)
@@ -1,11 +1,14 @@
 import os
 import random
 import time
+from collections import Counter
 from PIL import Image
 import imagehash
 from openpyxl import Workbook
 from openpyxl.styles import PatternFill
 import numpy as np
+from augmentation import AugmentationEngine, crop, rotation
+from run_journal import RunJournal, default_journal_path, file_fingerprint
 
 # Paths
 image_folder = '/Users/rosshartigan/Nelson Development/Motion Ads/Data-Analysis/Flyers'
@@ -16,6 +19,9 @@ log_folder = '/Users/rosshartigan/Nelson Development/Motion Ads/Data-Analysis/CS
 # Global standardized size
 STANDARDIZED_SIZE = (720, 720)
 
+# Stop at an image's first failed check; faster, but the Reason column then names only that check
+EARLY_EXIT = False
+
 # Ensure the log folder exists
 os.makedirs(log_folder, exist_ok=True)
 
@@ -39,9 +45,10 @@ def calculate_black_pixel_percentage(image):
     black_percentage = (black_pixel_count / total_pixels) * 100
     return round(black_percentage, 2)
 
-# Function to resize and crop image to standardized size
-def resize_and_crop(image_path, size=(720, 720)):
-    image = Image.open(image_path)
+# Function to resize and crop image to standardized size (accepts a path or an already opened image)
+def resize_and_crop(image, size=(720, 720)):
+    if isinstance(image, str):
+        image = Image.open(image)
     original_width, original_height = image.size
     target_width, target_height = size
 
@@ -60,92 +67,143 @@ def resize_and_crop(image_path, size=(720, 720)):
 
     return image_cropped
 
-# Function to apply random crop
-def random_crop(image):
-    width, height = image.size
+# Function to describe a random crop
+def random_crop(width, height):
     left = random.randint(0, width // 4)
     top = random.randint(0, height // 4)
     right = random.randint(3 * width // 4, width)
     bottom = random.randint(3 * height // 4, height)
-    return image.crop((left, top, right, bottom))
+    return crop("Random Crop", (left, top, right, bottom))
 
-# Function to apply random rotation
-def random_rotation(image):
+# Function to describe a random rotation
+def random_rotation():
     angle = random.randint(1, 359)
-    return image.rotate(angle, fillcolor="black")
+    return rotation("Random Rotation", angle)
 
-# Function to apply transformations
+# Function to describe the transformations; they are rendered by an AugmentationEngine
 def apply_transformations(original_image):
     width, height = original_image.size
-    transformations = {
-        "Mild Crop 1": original_image.crop((int(0.05 * width), int(0.05 * height), int(0.95 * width), int(0.95 * height))),
-        "Mild Crop 2": original_image.crop((int(0.1 * width), int(0.1 * height), int(0.9 * width), int(0.9 * height))),
-        "Heavy Crop 1": original_image.crop((int(0.2 * width), int(0.2 * height), int(0.8 * width), int(0.8 * height))),
-        "Heavy Crop 2": original_image.crop((int(0.25 * width), int(0.25 * height), int(0.75 * width), int(0.75 * height))),
-        "Mild Rotation 1": original_image.rotate(10, fillcolor="black"),
-        "Mild Rotation 2": original_image.rotate(15, fillcolor="black"),
-        "Heavy Rotation 1": original_image.rotate(45, fillcolor="black"),
-        "Heavy Rotation 2": original_image.rotate(90, fillcolor="black"),
-        "Random Crop": random_crop(original_image),
-        "Random Rotation": random_rotation(original_image),
-    }
+    transformations = [
+        crop("Mild Crop 1", (int(0.05 * width), int(0.05 * height), int(0.95 * width), int(0.95 * height))),
+        crop("Mild Crop 2", (int(0.1 * width), int(0.1 * height), int(0.9 * width), int(0.9 * height))),
+        crop("Heavy Crop 1", (int(0.2 * width), int(0.2 * height), int(0.8 * width), int(0.8 * height))),
+        crop("Heavy Crop 2", (int(0.25 * width), int(0.25 * height), int(0.75 * width), int(0.75 * height))),
+        rotation("Mild Rotation 1", 10),
+        rotation("Mild Rotation 2", 15),
+        rotation("Heavy Rotation 1", 45),
+        rotation("Heavy Rotation 2", 90),
+        random_crop(width, height),
+        random_rotation(),
+    ]
     return transformations
 
+# Order the reasons are reported in when every check runs
+REASON_ORDER = ("Dimensions", "Black Space", "pHash")
+
 # Function to determine if an image is a duplicate and why
-def is_duplicate(image, standardized_phash):
+def is_duplicate(engine, transformation, standardized_phash, early_exit=False, check_counts=None):
+    """
+    Runs the checks cheapest first: the size comes from the geometry, the pHash
+    was batched for the whole suite, and black space may have to render a
+    rotation. Every check runs by default, so the reasons list each failed check;
+    with early_exit the first failed check decides, so the reason is that check
+    alone. check_counts, if given, counts the checks run and skipped.
+    """
+    # All three checks are answered by the engine without rendering at full resolution
+    checks = (
+        ("Dimensions", lambda: min(engine.size(transformation)) < 720),
+        ("pHash", lambda: calculate_hash_similarity(standardized_phash, engine.phash(transformation)) > 70),
+        ("Black Space", lambda: engine.black_pixel_percentage(transformation) > 2),
+    )
     reasons = []
-    # Check 1: Size
-    if image.size[0] < 720 or image.size[1] < 720:
-        reasons.append("Dimensions")
-    # Check 2: Black Pixel Percentage
-    if calculate_black_pixel_percentage(image) > 2:
-        reasons.append("Black Space")
-    # Check 3: pHash Similarity
-    if calculate_hash_similarity(standardized_phash, calculate_phash(image)) > 70:
-        reasons.append("pHash")
+    for position, (reason, failed) in enumerate(checks):
+        if check_counts is not None:
+            check_counts["run"] += 1
+        if failed():
+            reasons.append(reason)
+            if early_exit:
+                if check_counts is not None:
+                    check_counts["skipped"] += len(checks) - position - 1
+                break
+    reasons.sort(key=REASON_ORDER.index)
     if not reasons:
         reasons.append("No Duplicate")
     return bool(reasons and reasons != ["No Duplicate"]), reasons
 
 # Function to process images and store data
-def process_images(image_folder, control_folder, sample_size, output_xlsx, log_folder):
+def process_images(image_folder, control_folder, sample_size, output_xlsx, log_folder, journal_path=None,
+                   restart=False, early_exit=False):
     start_time = time.time()  # Start timer
-    files = os.listdir(image_folder)[:sample_size]
+    # Sorted so the sample, and the row order, stay the same when files are added
+    files = sorted(os.listdir(image_folder))[:sample_size]
     results = []
     error_log = []
     duplicates_counter = 0
     processes_counter = 0
+    check_counts = Counter()
+
+    # Each finished image is journaled with its counts; a rerun only processes new or changed files
+    journal = RunJournal(journal_path or default_journal_path(output_xlsx), {
+        "script": "full-system",
+        "standardized_size": list(STANDARDIZED_SIZE),
+        "early_exit": early_exit,
+    })
+    if restart:
+        journal.clear()
+    if len(journal):
+        print(f"Resuming: {len(journal)} images already finished")
 
     for idx, file in enumerate(files, start=1):
         print(f"Processing image {idx} of {len(files)}: {file}")
         file_path = os.path.join(image_folder, file)
         try:
+            fingerprint = file_fingerprint(file_path)
+            finished = journal.row(file, fingerprint)
+            if finished is not None:
+                results.append(finished["row"])
+                duplicates_counter += finished["duplicates"]
+                processes_counter += finished["processes"]
+                continue
+
             original_image = Image.open(file_path)
-            standardized_image = resize_and_crop(file_path, STANDARDIZED_SIZE)
+            standardized_image = resize_and_crop(original_image, STANDARDIZED_SIZE)  # Reuses the decoded original
             standardized_phash = calculate_phash(standardized_image)
 
             row = {"Image Name": file}
             transformations = apply_transformations(original_image)
+            engine = AugmentationEngine(original_image)
+            engine.phashes(transformations)  # Hash the whole suite in one batch
 
             # Standardized vs Transformed
-            for name, transformed_image in transformations.items():
-                duplicate_flag, reasons = is_duplicate(transformed_image, standardized_phash)
+            duplicates = 0
+            for transformation in transformations:
+                name = transformation.name
+                duplicate_flag, reasons = is_duplicate(engine, transformation, standardized_phash, early_exit,
+                                                       check_counts)
                 if duplicate_flag:
-                    duplicates_counter += 1
+                    duplicates += 1
                     row[f"{name}"] = "Yes"
                     row[f"{name} Reason"] = ", ".join(reasons)
                 else:
                     row[f"{name}"] = "No"
                     row[f"{name} Reason"] = "No Duplicate"
-                processes_counter += 1
 
             results.append(row)
+            duplicates_counter += duplicates
+            processes_counter += len(transformations)
+            journal.record(file, fingerprint, {"row": row, "duplicates": duplicates,
+                                               "processes": len(transformations)})
 
         except Exception as e:
             print(f"Error processing {file}: {e}")
             error_log.append(f"Error processing {file}: {e}")
 
+    journal.close()
     runtime = time.time() - start_time  # Calculate runtime
+    total_checks = check_counts["run"] + check_counts["skipped"]
+    if early_exit and total_checks:
+        print(f"Duplicate checks: {check_counts['run']} run, {check_counts['skipped']} skipped by early exit "
+              f"({check_counts['skipped'] / total_checks:.0%} saved)")
     write_to_excel(results, output_xlsx, duplicates_counter, processes_counter, runtime)
 
     if error_log:
@@ -186,4 +244,4 @@ def write_to_excel(data, output_path, duplicates_counter, processes_counter, run
 # Main execution
 if __name__ == "__main__":
     SAMPLE_SIZE = 1000
-    process_images(image_folder, control_folder, SAMPLE_SIZE, output_xlsx, log_folder)
\ No newline at end of file
+    process_images(image_folder, control_folder, SAMPLE_SIZE, output_xlsx, log_folder, early_exit=EARLY_EXIT)
\ No newline at end of file
@@ -0,0 +1,159 @@
+"""
+Headless command line for the hashing pipeline.
+
+    python hash_cli.py hash IMAGE [IMAGE ...] [--type phash]
+    python hash_cli.py store IMAGE --document flyers
+    python hash_cli.py compare IMAGE --document flyers [--cascade]
+    python hash_cli.py batch-evaluate IMAGE_FOLDER RANDOM_FOLDER OUTPUT.xlsx
+
+Every heavy import (PIL, imagehash, cv2, firebase_admin, openpyxl) happens
+inside the subcommand that needs it, so `hash` only loads PIL and imagehash.
+Pass --timings to print wall and CPU time to stderr on exit, and
+--metrics PATH to collect per-stage timings and counters and write them on
+exit (Prometheus text for .prom/.txt, JSON otherwise).
+"""
+import time
+
+_START = time.perf_counter()
+
+import argparse
+import logging
+import os
+import sys
+
+from instrumentation import metrics
+
+HASH_TYPES = ("phash", "ahash", "dhash", "whash", "rhash")
+DOCUMENT_TYPES = ("bikes", "boxes", "flyers")
+
+
+def cmd_hash(args):
+    from fast_decode import open_for_hashing
+    from hash_core import generate_hash
+
+    # JPEGs are decoded at reduced scale only with --min-side, since that can change the hash
+    for path in args.images:
+        with open_for_hashing(path, args.min_side) as img:
+            print(f"{generate_hash(img, args.type)}\t{path}")
+    return 0
+
+
+def _hash_and_describe(path, hash_type):
+    from PIL import Image
+    import hash_core
+
+    with Image.open(path) as img:
+        with metrics.timer("decode"):
+            img = img.convert("RGB")
+        return hash_core.generate_hash(img, hash_type), hash_core.extract_orb_descriptors(img)
+
+
+def cmd_store(args):
+    import hash_core
+
+    hash_core.init_firebase(args.credentials)
+    image_hash, descriptors = _hash_and_describe(args.image, args.type)
+    if descriptors is None:
+        print(f"No ORB features found in {args.image}", file=sys.stderr)
+        return 1
+    hash_core.store_image_features(args.image, args.document, image_hash, descriptors)
+    print(f"Stored {image_hash} in {hash_core.COLLECTION}/{args.document}")
+    return 0
+
+
+def cmd_compare(args):
+    import hash_core
+
+    hash_core.init_firebase(args.credentials)
+    image_hash, descriptors = _hash_and_describe(args.image, args.type)
+    cascade = None
+    if args.cascade:
+        from cascade_matcher import DEFAULT_CONFIG
+        cascade = DEFAULT_CONFIG
+    result = hash_core.find_best_match(args.document, image_hash, descriptors, cascade, args.type)
+    if result is None:
+        print(f"Document {args.document} does not exist.", file=sys.stderr)
+        return 1
+    if result.best_match is None:
+        print(f"No hashes stored for {args.document}.", file=sys.stderr)
+        return 1
+    if result.accepted is False:
+        print(f"No match: nearest is {result.best_match} Hash {result.hash_similarity:.2f}%, "
+              f"rejected on the hash (ORB skipped)")
+    elif result.accepted:
+        print(f"Best match: {result.best_match} Hash {result.hash_similarity:.2f}%, ORB skipped (accepted on the hash)")
+    else:
+        print(f"Best match: {result.best_match} Hash {result.hash_similarity:.2f}%, ORB {result.orb_similarity:.2f}%")
+    return 0
+
+
+def cmd_batch_evaluate(args):
+    from data_breakdown import process_images
+
+    process_images(args.image_folder, args.random_image_folder, args.output,
+                   workers=args.workers, formats=tuple(args.formats.split(",")),
+                   journal_path=args.journal, restart=args.restart)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Image hashing and matching without the GUI.")
+    parser.add_argument("--timings", action="store_true", help="print wall and CPU time to stderr")
+    parser.add_argument("--metrics", metavar="PATH", help="write per-stage timings and counters to PATH on exit")
+    parser.add_argument("--log-level", default="INFO", choices=("DEBUG", "INFO", "WARNING", "ERROR"))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    hash_parser = subparsers.add_parser("hash", help="print the hash of each image")
+    hash_parser.add_argument("images", nargs="+")
+    hash_parser.add_argument("--type", choices=HASH_TYPES, default="phash")
+    hash_parser.add_argument("--min-side", type=int,
+                             help="decode JPEGs at reduced scale keeping this shorter side (faster, but the "
+                                  "hash may differ from the one store and compare use)")
+    hash_parser.set_defaults(func=cmd_hash)
+
+    for name, func, help_text in (
+        ("store", cmd_store, "store an image's hash and ORB descriptors in Firebase"),
+        ("compare", cmd_compare, "find the best stored match for an image"),
+    ):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument("image")
+        sub.add_argument("--document", choices=DOCUMENT_TYPES, default="flyers")
+        sub.add_argument("--type", choices=HASH_TYPES, default="phash")
+        sub.add_argument("--credentials", default=os.environ.get("MOTION_HASH_CREDENTIALS"),
+                         help="Firebase service account JSON (defaults to MOTION_HASH_CREDENTIALS)")
+        sub.set_defaults(func=func)
+        if name == "compare":
+            sub.add_argument("--cascade", action="store_true",
+                             help="skip the ORB match when the hash alone is a clear accept or reject (phash only)")
+
+    batch_parser = subparsers.add_parser("batch-evaluate", help="score transformed images against originals")
+    batch_parser.add_argument("image_folder")
+    batch_parser.add_argument("random_image_folder")
+    batch_parser.add_argument("output")
+    batch_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    batch_parser.add_argument("--formats", default="xlsx,csv", help="comma separated: xlsx, csv, parquet")
+    batch_parser.add_argument("--journal", help="journal of finished images (default: next to OUTPUT)")
+    batch_parser.add_argument("--restart", action="store_true", help="ignore finished images in the journal")
+    batch_parser.set_defaults(func=cmd_batch_evaluate)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="%(levelname)s %(name)s: %(message)s")
+    if args.metrics:
+        metrics.enable()
+    if getattr(args, "credentials", "unset") is None:
+        import hash_core
+        args.credentials = hash_core.CREDENTIALS_PATH
+    try:
+        return args.func(args)
+    finally:
+        if args.metrics:
+            metrics.write(args.metrics)
+        if args.timings:
+            print(f"wall {time.perf_counter() - _START:.3f}s, cpu {time.process_time():.3f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
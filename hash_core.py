@@ -0,0 +1,241 @@
+import os
+import hashlib
+import logging
+from collections import namedtuple
+
+import numpy as np
+import imagehash
+
+from bitops import hamming_similarity, hash_bits
+from campaign_cache import CampaignCache
+from instrumentation import metrics
+
+log = logging.getLogger(__name__)
+
+# Heavy dependencies (cv2, firebase_admin, google.cloud) are imported inside the
+# functions that need them, so hashing a file does not pay for them.
+
+# Firebase settings (override the credentials path with MOTION_HASH_CREDENTIALS)
+CREDENTIALS_PATH = os.environ.get(
+    "MOTION_HASH_CREDENTIALS",
+    '/Users/rosshartigan/Nelson Development/Motion Ads/pHash-Python-Project/firebase credentials/motion-hash-tester-firebase-adminsdk-qgyxp-2782717ee6.json',
+)
+STORAGE_BUCKET = 'motion-hash-tester.appspot.com'
+COLLECTION = 'campaign_one'
+
+HASH_TYPES = ("phash", "ahash", "dhash", "whash", "rhash")
+
+# Result of comparing one image against a document type; orb_similarity is None when the
+# cascade decided on the hash alone, stage says where the decision was made, and accepted
+# is the cascade's verdict (None when no cascade ran and the caller judges the similarities)
+MatchResult = namedtuple("MatchResult", ["best_match", "hash_similarity", "orb_similarity", "stage", "accepted"],
+                         defaults=("orb", None))
+
+# Firebase handles, set by init_firebase
+db = None
+bucket = None
+campaign_cache = None
+
+# Global counters for read and write operations
+read_count = 0
+write_count = 0
+
+# ORB detector, created on first use
+orb = None
+
+# Long-lived ORB matchers, one per document type, with their LSH index already built
+orb_matchers = {}
+
+def increment_read():
+    global read_count
+    read_count += 1
+    metrics.count("backend_reads")
+    log.debug("Total reads: %d", read_count)
+
+def increment_write():
+    global write_count
+    write_count += 1
+    metrics.count("backend_writes")
+    log.debug("Total writes: %d", write_count)
+
+# Function to initialize Firebase once and return the Firestore client
+def init_firebase(credentials_path=CREDENTIALS_PATH):
+    global db, bucket, campaign_cache
+    if db is None:
+        import firebase_admin
+        from firebase_admin import credentials, firestore, storage
+
+        cred = credentials.Certificate(credentials_path)
+        firebase_admin.initialize_app(cred, {
+            'storageBucket': STORAGE_BUCKET
+        })
+        db = firestore.client()
+        bucket = storage.bucket()
+
+        # Local copy of campaign documents; repeat comparisons are served from memory
+        campaign_cache = CampaignCache(db, COLLECTION, on_read=increment_read)
+    return db
+
+# Function to generate different types of hashes
+def generate_hash(image, hash_type='phash'):
+    with metrics.timer("hash"):
+        return _generate_hash(image, hash_type)
+
+def _generate_hash(image, hash_type):
+    if hash_type == 'phash':
+        return imagehash.phash(image)
+    elif hash_type == 'ahash':
+        return imagehash.average_hash(image)
+    elif hash_type == 'dhash':
+        return imagehash.dhash(image)
+    elif hash_type == 'whash':
+        return imagehash.whash(image)
+    elif hash_type == 'rhash':
+        # Rotation-tolerant hash; a rotated flyer is found with one lookup
+        from rotation_hash import rotation_hash
+        return rotation_hash(image)
+
+# Function to get the shared ORB detector
+def get_orb():
+    global orb
+    if orb is None:
+        import cv2
+        orb = cv2.ORB_create()
+    return orb
+
+# Function to extract ORB descriptors from a PIL image
+def extract_orb_descriptors(image):
+    import cv2
+    with metrics.timer("orb_detect"):
+        image_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2GRAY)
+        _, descriptors = get_orb().detectAndCompute(image_cv, None)
+    return descriptors
+
+# ORB feature matching
+def orb_feature_matching(image1, image2):
+    import cv2
+    image1_cv = cv2.cvtColor(np.array(image1), cv2.COLOR_RGB2GRAY)
+    image2_cv = cv2.cvtColor(np.array(image2), cv2.COLOR_RGB2GRAY)
+
+    kp1, des1 = get_orb().detectAndCompute(image1_cv, None)
+    kp2, des2 = get_orb().detectAndCompute(image2_cv, None)
+
+    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    matches = bf.match(des1, des2)
+    matches = sorted(matches, key=lambda x: x.distance)
+
+    matching_score = len(matches) / min(len(kp1), len(kp2)) * 100
+    return matching_score
+
+# Function to get the ORB matcher for a document type, rebuilding it only when the stored descriptors change
+def get_orb_matcher(document_type, stored_descriptors):
+    from orb_matcher import OrbMatcher
+    fingerprint = (stored_descriptors.shape, hashlib.sha1(stored_descriptors.tobytes()).hexdigest())
+    cached = orb_matchers.get(document_type)
+    if cached is None or cached[0] != fingerprint:
+        matcher = OrbMatcher()
+        matcher.add(stored_descriptors, document_type)
+        matcher.train()
+        orb_matchers[document_type] = (fingerprint, matcher)
+    return orb_matchers[document_type][1]
+
+# Function to compare ORB descriptors using FLANN-based matching
+def compare_orb_descriptors(new_descriptors, stored_descriptors, matcher=None):
+    # The LSH index over the stored descriptors is built once and reused across queries
+    if matcher is None:
+        from orb_matcher import OrbMatcher
+        matcher = OrbMatcher()
+        matcher.add(stored_descriptors)
+        matcher.train()
+    with metrics.timer("match"):
+        return matcher.score(new_descriptors)
+
+# Function to convert stored ORB descriptors back to numpy array for comparison
+def get_orb_descriptors_from_firestore(stored_descriptors_list):
+    return np.array(stored_descriptors_list, dtype=np.uint8)
+
+# Function to upload an image to Firebase Storage
+def upload_image_to_storage(file_path, folder_name, image_hash):
+    # Extract the filename from the path
+    filename = f"{image_hash}.jpg"
+
+    # Create a path in Firebase Storage with the folder name
+    storage_path = f'{COLLECTION}/{folder_name}/{filename}'
+
+    # Upload the image to Firebase Storage
+    blob = bucket.blob(storage_path)
+    with metrics.timer("backend_io"):
+        blob.upload_from_filename(file_path)
+
+    log.info("Image uploaded to: %s", storage_path)
+
+# Function to download a stored image from Firebase Storage
+def download_image_bytes(folder_name, image_hash):
+    storage_path = f'{COLLECTION}/{folder_name}/{image_hash}.jpg'
+    blob = bucket.blob(storage_path)
+    with metrics.timer("backend_io"):
+        return blob.download_as_bytes(), storage_path
+
+# Store hash and ORB descriptors in Firestore and upload the image to Firebase Storage
+def store_image_features(file_path, document_type, image_hash, descriptors):
+    from firebase_admin import firestore
+    init_firebase()
+
+    # Convert ORB descriptors to a Firestore-compatible format (store each descriptor as a list)
+    orb_descriptors_list = [descriptor.tolist() for descriptor in descriptors]
+
+    # Store the hash and ORB descriptors in Firestore (this is a write operation)
+    doc_ref = db.collection(COLLECTION).document(document_type)
+    with metrics.timer("backend_io"):
+        doc_ref.update({
+            'hashes': firestore.ArrayUnion([str(image_hash)]),
+            'orb_descriptors': orb_descriptors_list,  # Store ORB descriptors as a list of lists
+            'version': firestore.Increment(1)  # Lets cached readers detect the change
+        })
+    increment_write()  # Log the write operation
+    campaign_cache.record_write(document_type, [str(image_hash)], orb_descriptors_list)
+
+    # Upload the image to Firebase Storage
+    upload_image_to_storage(file_path, document_type, str(image_hash))
+
+# Function to find the closest stored hash and the ORB similarity for a document type
+def find_best_match(document_type, image_hash, descriptors, cascade=None, hash_type="phash"):
+    """
+    Returns None if the document does not exist, a MatchResult with best_match None
+    if it holds no hashes, otherwise the best hash match and ORB similarity.
+
+    cascade is an optional cascade_matcher.CascadeConfig. With it, a clear pHash
+    accept or reject skips the FLANN ORB match (orb_similarity is None, stage is
+    "phash" and accepted is True or False; best_match is still the nearest hash).
+    Its thresholds are pHash distances, so it only runs when hash_type is "phash".
+    """
+    init_firebase()
+
+    # Get the selected document through the local cache (reads are only billed when it changes)
+    with metrics.timer("backend_io"):
+        campaign = campaign_cache.get(document_type)
+    if campaign is None:
+        return None
+    if not campaign.hashes:
+        return MatchResult(None, 0, 0)
+
+    # Compare the hash with every stored hash in one vectorized pass
+    with metrics.timer("match"):
+        distances = campaign.hash_index.distances(image_hash)
+    if cascade is not None and hash_type == "phash":
+        from cascade_matcher import phash_decision
+        decision, order = phash_decision(distances, cascade)
+    else:
+        decision, order = None, [int(np.argmin(distances))]
+    best_match, hamming_distance = campaign.hash_index.keys[order[0]], int(distances[order[0]])
+    best_similarity = hamming_similarity(hamming_distance, hash_bits(image_hash))
+    if decision is not None:
+        metrics.count(f"cascade_phash_{'accepts' if decision else 'rejects'}")
+        return MatchResult(best_match, best_similarity, None, "phash", decision)
+
+    # Compare ORB descriptors using FLANN
+    stored_orb_descriptors = campaign.orb_descriptors
+    orb_matcher = get_orb_matcher(document_type, stored_orb_descriptors)
+    orb_similarity = compare_orb_descriptors(descriptors, stored_orb_descriptors, orb_matcher)
+
+    return MatchResult(best_match, best_similarity, max(orb_similarity, 0))
@@ -0,0 +1,93 @@
+import numpy as np
+
+from bitops import popcount64, to_packed_hash
+
+
+class HashIndex:
+    """
+    In-memory index of 64-bit hashes kept in one contiguous uint64 array.
+    Queries XOR the query against every stored hash and popcount the result,
+    so a search is a single vectorized pass instead of a Python loop.
+    """
+
+    def __init__(self, capacity=1024):
+        self._hashes = np.zeros(max(capacity, 1), dtype=np.uint64)
+        self._keys = []
+        self._positions = {}
+        self._size = 0
+
+    @classmethod
+    def from_hashes(cls, hashes, keys=None):
+        hashes = list(hashes)
+        index = cls(capacity=len(hashes))
+        if keys is None:
+            keys = [str(value) for value in hashes]
+        for key, value in zip(keys, hashes):
+            index.insert(key, value)
+        return index
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    @property
+    def hashes(self):
+        return self._hashes[:self._size]
+
+    @property
+    def keys(self):
+        return list(self._keys)
+
+    def insert(self, key, value):
+        """Adds a hash under key, replacing any hash already stored for it."""
+        packed = np.uint64(to_packed_hash(value))
+        if key in self._positions:
+            self._hashes[self._positions[key]] = packed
+            return
+        if self._size == len(self._hashes):
+            grown = np.zeros(len(self._hashes) * 2, dtype=np.uint64)
+            grown[:self._size] = self._hashes[:self._size]
+            self._hashes = grown
+        self._hashes[self._size] = packed
+        self._positions[key] = self._size
+        self._keys.append(key)
+        self._size += 1
+
+    def delete(self, key):
+        """Removes key by moving the last entry into its slot."""
+        position = self._positions.pop(key)
+        last = self._size - 1
+        if position != last:
+            last_key = self._keys[last]
+            self._hashes[position] = self._hashes[last]
+            self._keys[position] = last_key
+            self._positions[last_key] = position
+        self._keys.pop()
+        self._size -= 1
+
+    def get(self, key):
+        return int(self._hashes[self._positions[key]])
+
+    def distances(self, query):
+        """Returns the Hamming distance from query to every stored hash."""
+        query = np.uint64(to_packed_hash(query))
+        return popcount64(np.bitwise_xor(self.hashes, query))
+
+    def best_match(self, query):
+        """Returns (key, distance) of the closest stored hash, or (None, None) when empty."""
+        if self._size == 0:
+            return None, None
+        distances = self.distances(query)
+        position = int(np.argmin(distances))
+        return self._keys[position], int(distances[position])
+
+    def within(self, query, max_distance):
+        """Returns [(key, distance)] for every stored hash within max_distance, closest first."""
+        if self._size == 0:
+            return []
+        distances = self.distances(query)
+        positions = np.nonzero(distances <= max_distance)[0]
+        positions = positions[np.argsort(distances[positions], kind="stable")]
+        return [(self._keys[p], int(distances[p])) for p in positions]
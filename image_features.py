@@ -0,0 +1,213 @@
+import logging
+
+import cv2
+import imagehash
+import numpy as np
+from PIL import Image
+
+from instrumentation import metrics
+
+log = logging.getLogger(__name__)
+
+# Shared ORB detector (default parameters, same as cv2.ORB_create() in the scripts)
+orb = cv2.ORB_create()
+
+# ORB matches closer than this Hamming distance count as good matches
+GOOD_MATCH_DISTANCE = 42
+
+# Channel orders a decoded array can be in, and the conversions between them
+_TO_GRAY = {"BGR": cv2.COLOR_BGR2GRAY, "RGB": cv2.COLOR_RGB2GRAY}
+
+
+class DecodedImage:
+    """
+    One decoded image with lazily cached views in the colour orders the code
+    needs. The decoded array is kept as is; the opposite colour order is a
+    reversed-channel view of it (no copy), grayscale is converted once, and the
+    PIL image used for hashing and display is built once.
+    """
+
+    def __init__(self, array, order="BGR", pil=None):
+        self.array = array
+        self.order = "GRAY" if array.ndim == 2 else order
+        self._gray = None
+        self._color = None
+        self._pil = pil
+
+    @classmethod
+    def open(cls, path):
+        """Decodes a file once with OpenCV (BGR)."""
+        with metrics.timer("decode"):
+            array = cv2.imread(path)
+        if array is None:
+            raise ValueError(f"Could not decode {path}")
+        return cls(array, "BGR")
+
+    @classmethod
+    def from_pil(cls, image):
+        """Wraps a PIL image; the RGB (or L) pixels are read into one array, shared by every view."""
+        if image.mode == "L":
+            return cls(np.asarray(image), "GRAY", image)
+        image = image if image.mode == "RGB" else image.convert("RGB")
+        return cls(np.asarray(image), "RGB", image)
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def _gray_to_color(self):
+        if self._color is None:
+            self._color = cv2.cvtColor(self.array, cv2.COLOR_GRAY2BGR)
+        return self._color
+
+    @property
+    def bgr(self):
+        if self.order == "BGR":
+            return self.array
+        if self.order == "RGB":
+            return self.array[:, :, ::-1]
+        return self._gray_to_color()
+
+    @property
+    def rgb(self):
+        if self.order == "RGB":
+            return self.array
+        if self.order == "BGR":
+            return self.array[:, :, ::-1]
+        return self._gray_to_color()
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            if self.order == "GRAY":
+                self._gray = self.array
+            else:
+                self._gray = cv2.cvtColor(self.array, _TO_GRAY[self.order])
+        return self._gray
+
+    @property
+    def pil(self):
+        if self._pil is None:
+            if self.order == "BGR":
+                self._pil = pil_from_bgr(self.array)
+            else:
+                self._pil = Image.fromarray(np.ascontiguousarray(self.array))
+        return self._pil
+
+
+class ImageFeatures(DecodedImage):
+    """
+    Features of one decoded image (an OpenCV BGR array by default), extracted
+    lazily and at most once: grayscale, ORB keypoints/descriptors and the pHash.
+    Comparison functions accept an ImageFeatures on either side, so an original
+    compared against many transformations is only processed once.
+    """
+
+    def __init__(self, image, order="BGR", pil=None):
+        super().__init__(image, order, pil)
+        self._keypoints = None
+        self._descriptors = None
+        self._orb_done = False
+        self._phash = None
+
+    @property
+    def image(self):
+        return self.bgr
+
+    def _extract_orb(self):
+        if not self._orb_done:
+            with metrics.timer("orb_detect"):
+                self._keypoints, self._descriptors = orb.detectAndCompute(self.gray, None)
+            self._orb_done = True
+
+    @property
+    def keypoints(self):
+        self._extract_orb()
+        return self._keypoints
+
+    @property
+    def descriptors(self):
+        self._extract_orb()
+        return self._descriptors
+
+    @property
+    def phash(self):
+        if self._phash is None:
+            with metrics.timer("hash"):
+                self._phash = imagehash.phash(self.pil)
+        return self._phash
+
+
+# Function to wrap a raw image in ImageFeatures (features pass through unchanged)
+def as_features(img):
+    return img if isinstance(img, ImageFeatures) else ImageFeatures(img)
+
+# Function to build a PIL RGB image straight from BGR pixels (PIL swaps the channels while unpacking)
+def pil_from_bgr(img):
+    img = np.ascontiguousarray(img)
+    return Image.frombuffer("RGB", (img.shape[1], img.shape[0]), img, "raw", "BGR", 0, 1)
+
+# Function to compute the pHash of an OpenCV (BGR) image
+def phash_of(img):
+    with metrics.timer("hash"):
+        if img.ndim == 2:
+            return imagehash.phash(Image.fromarray(img))
+        return imagehash.phash(pil_from_bgr(img))
+
+# pHash similarity between two images as a fraction (1.0 = identical)
+def phash_similarity(img1, img2):
+    hash1 = as_features(img1).phash
+    hash2 = as_features(img2).phash
+    return 1 - (hash1 - hash2) / len(hash1.hash) ** 2
+
+# Refined pHash similarity function with cropping based on the smaller dimensions
+def refined_phash_similarity(img1, img2):
+    """
+    Crops the original image to match the dimensions of the comparison image if needed,
+    then compares the pHash similarity. Returns a percentage.
+    """
+    features1 = as_features(img1)
+    features2 = as_features(img2)
+
+    if features1.shape != features2.shape:
+        # Calculate the center crop of the original image to match comparison image dimensions
+        height1, width1 = features1.shape[:2]
+        height2, width2 = features2.shape[:2]
+        start_x = (width1 - width2) // 2
+        start_y = (height1 - height2) // 2
+        cropped_img1 = features1.image[start_y:start_y + height2, start_x:start_x + width2]
+        hash1 = phash_of(cropped_img1)
+    else:
+        cropped_img1 = features1.image  # No need to crop if dimensions are identical
+        hash1 = features1.phash
+
+    # Debugging information to confirm dimensions
+    log.debug("Comparing images of size: %s and %s", cropped_img1.shape, features2.shape)
+
+    hash2 = features2.phash
+
+    # Calculate similarity based on pHash (0 = identical, higher values = less similar)
+    similarity = 1 - (hash1 - hash2) / len(hash1.hash) ** 2
+    return similarity * 100  # Return as percentage similarity
+
+# ORB similarity function that uses keypoint matching
+def orb_similarity(img1, img2):
+    features1 = as_features(img1)
+    features2 = as_features(img2)
+    kp1, des1 = features1.keypoints, features1.descriptors
+    kp2, des2 = features2.keypoints, features2.descriptors
+
+    if des1 is None or des2 is None:
+        return 0
+
+    with metrics.timer("match"):
+        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+        matches = bf.match(des1, des2)
+    metrics.count("orb_comparisons")
+
+    if len(matches) == 0:
+        return 0
+
+    good_matches = [m for m in matches if m.distance < GOOD_MATCH_DISTANCE]
+    similarity_percentage = len(good_matches) / min(len(kp1), len(kp2)) * 100
+    return min(similarity_percentage, 100)
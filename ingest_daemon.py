@@ -0,0 +1,367 @@
+"""
+Filesystem-watching ingest daemon.
+
+    python ingest_daemon.py INBOX [INBOX=boxes ...] --store local_store [--document flyers] [--port 8080]
+
+Watches one or more folders (DIR or DIR=DOCUMENT) and ingests image files
+that are new or have changed. Each one is hashed (pHash and region hashes)
+and has its ORB descriptors extracted, then goes into the local store and
+the warm matching indexes. With --port, the same indexes are also served
+over HTTP (see matching_service.py), so a new flyer can be matched a few
+seconds after it lands in a folder.
+
+- Debounce: a file is picked up once its size and mtime have not changed
+  for --debounce seconds, so half-copied files are not read.
+- Bounded pool: extraction runs on --workers threads. At most --max-pending
+  files are in flight (queued, being extracted or waiting to be stored).
+  When the pool falls behind, the watcher stops taking files, and they are
+  picked up on a later poll. Memory stays bounded.
+- Batched inserts: finished files are written to the store in batches of
+  --flush-size, or every --flush-interval seconds.
+- O(new files): finished files are journaled (run_journal.py) with their
+  size and mtime, so a restart does not re-ingest anything.
+
+Every --report-interval seconds a throughput and lag report is logged. Lag
+is the time from a file's last modification to it being searchable.
+"""
+import argparse
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import Histogram, metrics
+from local_store import LocalCampaignStore
+from matching_service import MatchingServer, MatchingService, make_handler
+from run_journal import RunJournal
+
+log = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PENDING = 64
+DEFAULT_FLUSH_SIZE = 32
+DEFAULT_FLUSH_INTERVAL = 2.0
+DEFAULT_REPORT_INTERVAL = 30.0
+
+# Upper bounds of the ingest lag buckets, in seconds
+LAG_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+# One file ready to ingest: path, document type, fingerprint (size and mtime, as in run_journal) and mtime
+Candidate = namedtuple("Candidate", ["path", "document", "fingerprint", "mtime"])
+
+# One extracted file waiting to be stored
+_Extracted = namedtuple("_Extracted", ["candidate", "image_hash", "descriptors", "image_bytes", "regions"])
+
+
+class DirectoryWatcher:
+    """
+    Polls folders for image files. A file is ready once its size and mtime
+    have been the same for debounce seconds, and is reported again only after it
+    changes. Polling uses os.scandir (stdlib only, works on network mounts);
+    each poll costs one stat per file, and nothing is read until a file is
+    ready.
+    """
+
+    def __init__(self, directories, debounce=DEFAULT_DEBOUNCE, recursive=True):
+        self.directories = dict(directories)  # folder -> document type
+        self.debounce = debounce
+        self.recursive = recursive
+        self._pending = {}  # path -> (fingerprint, first time seen with that fingerprint)
+        self._done = {}  # path -> fingerprint last ingested (or given up on)
+
+    @property
+    def waiting(self):
+        """Files seen but not yet settled or not yet taken."""
+        return len(self._pending)
+
+    def _scan(self, folder):
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.recursive:
+                            yield from self._scan(entry.path)
+                    elif entry.name.lower().endswith(IMAGE_EXTENSIONS) and not entry.name.startswith("."):
+                        try:
+                            stat = entry.stat()
+                            yield entry.path, f"{stat.st_size}-{stat.st_mtime_ns}", stat.st_mtime
+                        except FileNotFoundError:
+                            continue  # Removed between listing and stat
+        except FileNotFoundError:
+            log.warning("Watched folder is missing: %s", folder)
+
+    def poll(self, now=None):
+        """Returns the Candidates whose files have settled since the last change."""
+        now = time.monotonic() if now is None else now
+        ready = []
+        seen = set()
+        for folder, document in self.directories.items():
+            for path, fingerprint, mtime in self._scan(folder):
+                seen.add(path)
+                if self._done.get(path) == fingerprint:
+                    continue
+                pending = self._pending.get(path)
+                if pending is None or pending[0] != fingerprint:
+                    self._pending[path] = (fingerprint, now)
+                elif now - pending[1] >= self.debounce:
+                    ready.append(Candidate(path, document, fingerprint, mtime))
+        for path in list(self._pending):
+            if path not in seen:
+                del self._pending[path]
+        return ready
+
+    def mark_done(self, candidate):
+        self._done[candidate.path] = candidate.fingerprint
+        self._pending.pop(candidate.path, None)
+
+
+class IngestDaemon:
+    """
+    Runs the watcher, the bounded extraction pool and batched inserts into a
+    MatchingService. run() loops until stop(); step() does one poll, one
+    round of submissions and, when due, a flush, for callers that drive the
+    loop themselves.
+    """
+
+    def __init__(self, service, directories, journal_path, workers=DEFAULT_WORKERS,
+                 max_pending=DEFAULT_MAX_PENDING, debounce=DEFAULT_DEBOUNCE, poll_interval=DEFAULT_POLL_INTERVAL,
+                 flush_size=DEFAULT_FLUSH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 report_interval=DEFAULT_REPORT_INTERVAL):
+        self.service = service
+        self.watcher = DirectoryWatcher(directories, debounce)
+        self.journal = RunJournal(journal_path, {"script": "ingest_daemon"})
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.report_interval = report_interval
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._finished = queue.Queue()  # _Extracted or (Candidate, exception), filled by the pool
+        self._in_flight = set()  # paths submitted and not yet stored
+        self._batch = []
+        self._last_flush = time.monotonic()
+        self._stop = threading.Event()
+
+        self.started = time.monotonic()
+        self.ingested = 0
+        self.failed = 0
+        self.deferred = 0  # ready files left for a later poll by the last poll, because the pool was full
+        self.saturated_polls = 0  # polls that deferred at least one file
+        self.lag = Histogram(LAG_BUCKETS)
+        self._recent = deque()  # (monotonic time, files stored) for the throughput window
+        self._last_report = time.monotonic()
+
+    def _extract(self, candidate):
+        try:
+            with open(candidate.path, "rb") as f:
+                image_bytes = f.read()
+            image_hash, descriptors, regions = self.service.extract(image_bytes)
+            self._finished.put(_Extracted(candidate, image_hash, descriptors, image_bytes, regions))
+        except Exception as e:
+            self._finished.put((candidate, e))
+
+    def _submit(self, ready):
+        deferred = 0
+        for candidate in ready:
+            if candidate.path in self._in_flight:
+                continue
+            if self.journal.row(candidate.path, candidate.fingerprint) is not None:
+                self.watcher.mark_done(candidate)  # Ingested before a restart
+                continue
+            if len(self._in_flight) >= self.max_pending:
+                # Backpressure: stop taking files; they stay pending and come back on the next poll
+                deferred += 1
+                continue
+            self._in_flight.add(candidate.path)
+            self._pool.submit(self._extract, candidate)
+        self.deferred = deferred
+        if deferred:
+            self.saturated_polls += 1
+            metrics.count("ingest_saturated_polls")
+
+    def _collect(self):
+        while True:
+            try:
+                item = self._finished.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, _Extracted):
+                self._batch.append(item)
+                continue
+            candidate, error = item
+            log.warning("Could not ingest %s: %s", candidate.path, error)
+            self.failed += 1
+            metrics.count("ingest_failed")
+            self._in_flight.discard(candidate.path)
+            self.watcher.mark_done(candidate)  # Retried only once the file changes again
+
+    def flush(self):
+        """
+        Stores the extracted files, one store write per document type. Files whose
+        write fails go back into the batch, still in flight, and are retried on the
+        next flush.
+        """
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        by_document = {}
+        for item in batch:
+            by_document.setdefault(item.candidate.document, []).append(item)
+        stored_items = []
+        for document, items in by_document.items():
+            try:
+                self.service.add_many(document, [(item.image_hash, item.descriptors, item.image_bytes, item.regions)
+                                                 for item in items])
+            except Exception as e:
+                log.warning("Could not store %d files in %s, will retry: %s", len(items), document, e)
+                metrics.count("ingest_store_failures")
+                self._batch.extend(items)
+                continue
+            stored_items.extend(items)
+        stored = time.time()
+        for item in stored_items:
+            candidate = item.candidate
+            self.journal.record(candidate.path, candidate.fingerprint, {"hash": item.image_hash})
+            self.watcher.mark_done(candidate)
+            self._in_flight.discard(candidate.path)
+            lag = max(0.0, stored - candidate.mtime)
+            self.lag.observe(lag)
+            metrics.observe("ingest_lag", lag)
+        self.ingested += len(stored_items)
+        metrics.count("ingested", len(stored_items))
+        self._recent.append((time.monotonic(), len(stored_items)))
+        self._last_flush = time.monotonic()
+        log.debug("Stored %d files", len(stored_items))
+
+    def step(self):
+        self._collect()
+        self._submit(self.watcher.poll())
+        self._collect()
+        # A batch also goes out once it holds every in-flight slot, or nothing new could be taken
+        if len(self._batch) >= min(self.flush_size, self.max_pending) or (
+                self._batch and time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+        if self.report_interval and time.monotonic() - self._last_report >= self.report_interval:
+            self._last_report = time.monotonic()
+            log.info(self.format_report())
+
+    def run(self):
+        while not self._stop.is_set():
+            self.step()
+            self._stop.wait(self.poll_interval)
+        self.drain()
+
+    def drain(self, timeout=None):
+        """Waits for every in-flight file and stores it."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Files in the batch are extracted but stay in flight until flushed
+        while len(self._in_flight) > len(self._batch) and (deadline is None or time.monotonic() < deadline):
+            self._collect()
+            if len(self._batch) >= min(self.flush_size, self.max_pending):
+                self.flush()
+            time.sleep(0.01)
+        self._collect()
+        self.flush()
+
+    def stop(self):
+        self._stop.set()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        self.journal.close()
+
+    def report(self, window=60.0):
+        """Throughput and lag: files stored overall and per second over the last window seconds."""
+        now = time.monotonic()
+        while self._recent and now - self._recent[0][0] > window:
+            self._recent.popleft()
+        elapsed = now - self.started
+        return {
+            "ingested": self.ingested,
+            "failed": self.failed,
+            "in_flight": len(self._in_flight),
+            "waiting": self.watcher.waiting,
+            "deferred": self.deferred,
+            "saturated_polls": self.saturated_polls,
+            "files_per_second": self.ingested / elapsed if elapsed else 0.0,
+            "recent_files_per_second": sum(count for _, count in self._recent) / min(window, elapsed or window),
+            "lag_p50": self.lag.quantile(0.5),
+            "lag_p95": self.lag.quantile(0.95),
+            "lag_max": self.lag.max,
+        }
+
+    def format_report(self):
+        r = self.report()
+        lag = (f"lag p50 {r['lag_p50']:.1f}s p95 {r['lag_p95']:.1f}s max {r['lag_max']:.1f}s"
+               if r["lag_max"] is not None else "lag n/a")
+        return (f"ingested {r['ingested']} ({r['recent_files_per_second']:.1f}/s recent, "
+                f"{r['files_per_second']:.1f}/s overall), failed {r['failed']}, in flight {r['in_flight']}, "
+                f"waiting {r['waiting']}, deferred {r['deferred']} (pool full on {r['saturated_polls']} polls), {lag}")
+
+
+# Function to parse DIR or DIR=DOCUMENT arguments into {folder: document type}
+def parse_directories(values, default_document):
+    directories = {}
+    for value in values:
+        folder, _, document = value.partition("=")
+        directories[os.path.abspath(folder)] = document or default_document
+    return directories
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch folders and ingest new images into the matching store.")
+    parser.add_argument("directories", nargs="+", help="folder to watch, as DIR or DIR=DOCUMENT")
+    parser.add_argument("--store", default="local_store", help="local store folder")
+    parser.add_argument("--document", default="flyers", help="document type for folders given without one")
+    parser.add_argument("--journal", help="journal of ingested files (default: STORE/ingest.journal.sqlite3)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING)
+    parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE)
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL)
+    parser.add_argument("--flush-size", type=int, default=DEFAULT_FLUSH_SIZE)
+    parser.add_argument("--flush-interval", type=float, default=DEFAULT_FLUSH_INTERVAL)
+    parser.add_argument("--report-interval", type=float, default=DEFAULT_REPORT_INTERVAL)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="also serve the warm indexes over HTTP on this port")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    service = MatchingService(LocalCampaignStore(args.store))
+    service.warm()
+    daemon = IngestDaemon(service, parse_directories(args.directories, args.document),
+                          args.journal or os.path.join(args.store, "ingest.journal.sqlite3"),
+                          workers=args.workers, max_pending=args.max_pending, debounce=args.debounce,
+                          poll_interval=args.poll_interval, flush_size=args.flush_size,
+                          flush_interval=args.flush_interval, report_interval=args.report_interval)
+    server = None
+    if args.port is not None:
+        metrics.enable()
+        server = MatchingServer((args.host, args.port), make_handler(service))
+        threading.Thread(target=server.serve_forever, name="matching-http", daemon=True).start()
+        log.info("Serving matches on http://%s:%d", args.host, args.port)
+
+    # A service manager stops the daemon with SIGTERM; finish the files in flight first
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    log.info("Watching %s", ", ".join(f"{folder} ({document})" for folder, document in daemon.watcher.directories.items()))
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.drain()
+    finally:
+        log.info(daemon.format_report())
+        daemon.close()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Lightweight timers, counters and latency histograms.
+
+    from instrumentation import metrics
+
+    with metrics.timer("decode"):
+        img = cv2.imread(path)
+    metrics.count("backend_reads")
+
+Stages used across the code: decode, transform, hash, orb_detect, match and
+backend_io. Timings are kept as cumulative histograms (fixed buckets, like
+Prometheus), so a run of any length costs a few integers per stage.
+
+Collection is off unless MOTION_HASH_METRICS=1 is set or metrics.enable() is
+called. While it is off, timer() returns one shared no-op context manager and
+count() returns straight away, so the instrumented hot loops cost a flag check.
+
+metrics.to_json() and metrics.to_prometheus() export a snapshot;
+metrics.write(path) picks the format from the extension (.prom or .txt for
+Prometheus text, anything else JSON). Worker processes send snapshot()
+back to the parent, which merge()s them.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+# Upper bounds of the latency buckets, in seconds (0.5 ms to 10 s, then +Inf)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prefix of every exported Prometheus metric
+METRIC_PREFIX = "motion_hash"
+
+ENV_FLAG = "MOTION_HASH_METRICS"
+
+
+class _NullTimer:
+    """Shared context manager used while collection is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._metrics.observe(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram with count, sum, min and max."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last slot is the +Inf bucket
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None or value < self.min else self.min
+        self.max = value if self.max is None or value > self.max else self.max
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (max for the +Inf bucket)."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(float(b) for b in data["buckets"] if b != "+Inf")
+        histogram.counts = list(data["buckets"].values())
+        histogram.count = data["count"]
+        histogram.sum = data["sum"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+    def merge(self, other):
+        if other.buckets != self.buckets:
+            raise ValueError("Cannot merge histograms with different buckets")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None or value < self.min else self.min
+                self.max = value if self.max is None or value > self.max else self.max
+
+
+class Metrics:
+    """Registry of named stage histograms and counters, safe to use from several threads."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+
+    def timer(self, name):
+        """Context manager that records the time spent inside it under name."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def timed(self, name):
+        """Decorator form of timer(); the flag is checked on every call, not when decorating."""
+        def decorate(fn):
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with _Timer(self, name):
+                    return fn(*args, **kwargs)
+            wrapper.__name__ = fn.__name__
+            wrapper.__doc__ = fn.__doc__
+            wrapper.__wrapped__ = fn
+            return wrapper
+        return decorate
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+    def histogram(self, name):
+        return self._histograms.get(name)
+
+    def snapshot(self):
+        """JSON-serializable copy of every counter and histogram."""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "timers": {name: histogram.to_dict() for name, histogram in self._histograms.items()},
+            }
+
+    def drain(self):
+        """Returns snapshot() and resets, for workers that report their share of a run."""
+        with self._lock:
+            histograms, counters = self._histograms, self._counters
+            self._histograms, self._counters = {}, {}
+        return {
+            "counters": counters,
+            "timers": {name: histogram.to_dict() for name, histogram in histograms.items()},
+        }
+
+    def merge(self, snapshot):
+        """Adds a snapshot (for example from a worker process) into this registry."""
+        if not snapshot:
+            return
+        with self._lock:
+            for name, value in snapshot.get("counters", {}).items():
+                self._counters[name] = self._counters.get(name, 0) + value
+            for name, data in snapshot.get("timers", {}).items():
+                other = Histogram.from_dict(data)
+                if name in self._histograms:
+                    self._histograms[name].merge(other)
+                else:
+                    self._histograms[name] = other
+
+    def to_json(self, indent=2):
+        return json.dumps(self.snapshot(), indent=indent, sort_keys=True)
+
+    def to_prometheus(self, prefix=METRIC_PREFIX):
+        """Prometheus text exposition format: one stage-labelled histogram, one counter per name."""
+        snapshot = self.snapshot()
+        lines = []
+        if snapshot["timers"]:
+            name = f"{prefix}_stage_seconds"
+            lines.append(f"# HELP {name} Time spent per pipeline stage.")
+            lines.append(f"# TYPE {name} histogram")
+            for stage, data in sorted(snapshot["timers"].items()):
+                cumulative = 0
+                for bound, bucket_count in data["buckets"].items():
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {data["sum"]}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {data["count"]}')
+        for counter, value in sorted(snapshot["counters"].items()):
+            name = f"{prefix}_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Writes the metrics to path, as Prometheus text for .prom/.txt and JSON otherwise."""
+        text = self.to_prometheus() if path.endswith((".prom", ".txt")) else self.to_json()
+        with open(path, "w") as f:
+            f.write(text)
+
+    def summary(self):
+        """Human-readable table of stages and counters."""
+        snapshot = self.snapshot()
+        lines = [f"{'stage':<14} {'count':>8} {'total s':>9} {'mean ms':>9} {'p95 ms':>8}"]
+        for stage, data in sorted(snapshot["timers"].items()):
+            lines.append(f"{stage:<14} {data['count']:>8} {data['sum']:>9.3f} "
+                         f"{data['mean'] * 1000:>9.2f} {data['p95'] * 1000:>8.2f}")
+        for counter, value in sorted(snapshot["counters"].items()):
+            lines.append(f"{counter:<14} {value:>8}")
+        return "\n".join(lines)
+
+
+# Process-wide registry used by every module
+metrics = Metrics(enabled=os.environ.get(ENV_FLAG, "") not in ("", "0"))
@@ -0,0 +1,247 @@
+import glob
+import json
+import os
+
+import numpy as np
+
+from descriptor_store import DescriptorStore, write_descriptor_store
+
+# Layout under the store root, one folder per document type (bikes, boxes, flyers):
+#   <doc_type>/hashes.json        {"hashes": [...], "version": n, "regions": {hash: {region: hex}}},
+#                                 like the Firestore document plus the region hashes of each image
+#   <doc_type>/hashes.log         one JSON line per add_many since hashes.json was written:
+#                                 {"version": n, "hashes": [...], "regions": {...}}
+#   <doc_type>/descriptors.orbs   ORB descriptors per stored hash (descriptor_store format)
+#   <doc_type>/descriptors.<n>.orbs   descriptors added by version n, until the next compaction
+#   <doc_type>/images/<hash>.jpg  copy of the stored image, like Firebase Storage
+HASHES_FILE = "hashes.json"
+HASHES_LOG = "hashes.log"
+DESCRIPTORS_FILE = "descriptors.orbs"
+DESCRIPTOR_SEGMENTS = "descriptors.*.orbs"
+IMAGES_FOLDER = "images"
+
+# Helper to replace a file atomically so readers never see a partial write
+def _replace(path, write):
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+# Helper to read the version number out of a descriptors.<n>.orbs segment name
+def _segment_version(path):
+    return int(os.path.basename(path).split(".")[1])
+
+
+class SegmentedDescriptors:
+    """
+    Read-only view over the compacted descriptor store and the segments written
+    since. Offers the names, descriptors() and keypoints() of DescriptorStore; when
+    a name is in several files the newest one wins.
+    """
+
+    def __init__(self, stores):
+        self.stores = stores
+        self._owner = {}
+        for store in stores:
+            for name in store.names:
+                self._owner[name] = store
+        self.names = list(self._owner)
+
+    def __len__(self):
+        return len(self.names)
+
+    def descriptors(self, name):
+        return self._owner[name].descriptors(name)
+
+    def keypoints(self, name):
+        return self._owner[name].keypoints(name)
+
+    def __getitem__(self, name):
+        return self.keypoints(name), self.descriptors(name)
+
+
+class LocalCampaignStore:
+    """
+    File-backed stand-in for the campaign_one collection and its Storage folder,
+    so the matching service can run and be load-tested on one machine. Unlike the
+    Firestore document, ORB descriptors are kept per stored image.
+    """
+
+    def __init__(self, root, compact_fraction=0.25, min_compact=1000, max_segments=64):
+        self.root = root
+        self.compact_fraction = compact_fraction
+        self.min_compact = min_compact
+        self.max_segments = max_segments
+        # Per document type: hashes, version and tail size as of our last write (single writer)
+        self._tails = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, doc_type, *parts):
+        return os.path.join(self.root, doc_type, *parts)
+
+    def document_types(self):
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.isfile(self._path(name, HASHES_FILE)))
+
+    def document(self, doc_type):
+        """Returns {"hashes": [...], "version": n}, or None if the document type does not exist."""
+        path = self._path(doc_type, HASHES_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            document = json.load(f)
+        known = set(document["hashes"])
+        for entry in self._log_entries(doc_type, document["version"]):
+            fresh = [value for value in entry["hashes"] if value not in known]
+            document["hashes"].extend(fresh)
+            known.update(fresh)
+            if entry.get("regions"):
+                document.setdefault("regions", {}).update(entry["regions"])
+            document["version"] = entry["version"]
+        return document
+
+    def _log_entries(self, doc_type, base_version):
+        """Yields the hashes.log entries newer than base_version, stopping at a torn last line."""
+        path = self._path(doc_type, HASHES_LOG)
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    return  # A write cut short by a crash; that add_many never completed
+                if entry["version"] > base_version:
+                    yield entry
+
+    def hashes(self, doc_type):
+        document = self.document(doc_type)
+        return list(document["hashes"]) if document else []
+
+    def descriptors(self, doc_type):
+        """
+        Returns the descriptors of doc_type as a SegmentedDescriptors view, or None
+        before anything with features is stored.
+        """
+        document = self.document(doc_type)
+        if document is None:
+            return None
+        stores = []
+        path = self._path(doc_type, DESCRIPTORS_FILE)
+        if os.path.exists(path):
+            stores.append(DescriptorStore(path))
+        # Segments at or below the compacted version are already in descriptors.orbs, and
+        # ones above the document version belong to an add_many that never completed
+        for segment in self._segments(doc_type):
+            if document.get("compacted", 0) < _segment_version(segment) <= document["version"]:
+                stores.append(DescriptorStore(segment))
+        return SegmentedDescriptors(stores) if stores else None
+
+    def _segments(self, doc_type):
+        return sorted(glob.glob(self._path(doc_type, DESCRIPTOR_SEGMENTS)), key=_segment_version)
+
+    def image_path(self, doc_type, image_hash):
+        return self._path(doc_type, IMAGES_FOLDER, f"{image_hash}.jpg")
+
+    def regions(self, doc_type):
+        """Returns {hash: {region: hex}} for the images stored with region hashes."""
+        document = self.document(doc_type)
+        return dict(document.get("regions", {})) if document else {}
+
+    def add(self, doc_type, image_hash, descriptors=None, image_bytes=None, regions=None):
+        """Stores a hash (and optionally its ORB descriptors, region hashes and image) under doc_type."""
+        return self.add_many(doc_type, [(image_hash, descriptors, image_bytes, regions)])
+
+    def add_many(self, doc_type, entries):
+        """
+        Stores several (hash, descriptors, image_bytes, regions) entries; any field
+        but the hash may be None. Nothing already stored is rewritten: the new
+        descriptors go to their own segment file and the hashes to one line of
+        hashes.log. compact() folds both into the base files once the tail reaches
+        compact_fraction of the document. Returns the new document version.
+        """
+        os.makedirs(self._path(doc_type, IMAGES_FOLDER), exist_ok=True)
+        tail = self._tail(doc_type)
+
+        version = tail["version"] + 1
+        new_hashes, new_regions, new_descriptors = [], {}, {}
+        for image_hash, descriptors, image_bytes, regions in entries:
+            image_hash = str(image_hash)
+            if image_hash not in tail["known"] and image_hash not in new_hashes:
+                new_hashes.append(image_hash)
+            if regions:
+                new_regions[image_hash] = {name: str(value) for name, value in regions.items()}
+            if descriptors is not None:
+                new_descriptors[image_hash] = np.asarray(descriptors, dtype=np.uint8)
+            if image_bytes is not None:
+                with open(self.image_path(doc_type, image_hash), "wb") as f:
+                    f.write(image_bytes)
+
+        # The segment is written first; the log line then commits the whole add_many
+        if new_descriptors:
+            rows = [(name, None, descriptors) for name, descriptors in new_descriptors.items()]
+            _replace(self._path(doc_type, f"descriptors.{version}.orbs"),
+                     lambda path: write_descriptor_store(path, rows))
+            tail["segments"] += 1
+        entry = {"version": version, "hashes": new_hashes}
+        if new_regions:
+            entry["regions"] = new_regions
+        if not os.path.exists(self._path(doc_type, HASHES_FILE)):
+            _replace(self._path(doc_type, HASHES_FILE), lambda path: self._write_json(path, {"hashes": [], "version": 0}))
+        with open(self._path(doc_type, HASHES_LOG), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        tail["known"].update(new_hashes)
+        tail["version"] = version
+        tail["pending"] += len(new_hashes) + len(new_descriptors)
+        if tail["pending"] >= max(self.min_compact, self.compact_fraction * len(tail["known"])) or (
+                tail["segments"] > self.max_segments):
+            self.compact(doc_type)
+        return version
+
+    def _tail(self, doc_type):
+        if doc_type not in self._tails:
+            self._trim_torn_log(doc_type)
+            document = self.document(doc_type) or {"hashes": [], "version": 0}
+            compacted = document.get("compacted", 0)
+            self._tails[doc_type] = {
+                "known": set(document["hashes"]),
+                "version": document["version"],
+                "pending": sum(len(entry["hashes"]) for entry in self._log_entries(doc_type, compacted)),
+                "segments": sum(1 for segment in self._segments(doc_type) if _segment_version(segment) > compacted),
+            }
+        return self._tails[doc_type]
+
+    def _trim_torn_log(self, doc_type):
+        """Cuts a partial last line left by a crash, so the next append starts on a line of its own."""
+        path = self._path(doc_type, HASHES_LOG)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    @staticmethod
+    def _write_json(path, document):
+        with open(path, "w") as f:
+            json.dump(document, f)
+
+    def compact(self, doc_type):
+        """Rewrites hashes.json and descriptors.orbs with everything stored, then drops the log and segments."""
+        document = self.document(doc_type)
+        if document is None:
+            return
+        descriptors = self.descriptors(doc_type)
+        if descriptors is not None:
+            rows = [(name, descriptors.keypoints(name), descriptors.descriptors(name)) for name in descriptors.names]
+            _replace(self._path(doc_type, DESCRIPTORS_FILE), lambda path: write_descriptor_store(path, rows))
+        document["compacted"] = document["version"]
+        _replace(self._path(doc_type, HASHES_FILE), lambda path: self._write_json(path, document))
+        # Safe to lose from here on: document() and descriptors() skip anything at or below "compacted"
+        for segment in self._segments(doc_type):
+            os.remove(segment)
+        if os.path.exists(self._path(doc_type, HASHES_LOG)):
+            os.remove(self._path(doc_type, HASHES_LOG))
+        self._tails.pop(doc_type, None)
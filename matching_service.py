@@ -0,0 +1,491 @@
+"""
+Long-running matching service.
+
+    python matching_service.py --store ./local_store --port 8080
+
+Keeps one HashIndex and one OrbMatcher per document type warm in memory and
+answers over HTTP (JSON bodies, images base64 encoded):
+
+    POST /match  {"document": "flyers", "image": "<base64>" | "hash": "<hex>", "k": 5}
+    POST /add    {"document": "flyers", "image": "<base64>", "hash": "<hex>" (optional)}
+    POST /near   {"document": "flyers", "image": "<base64>" | "hash": "<hex>", "radius": 8}
+    GET  /stats
+    GET  /metrics  per-stage latency histograms and counters, Prometheus text format
+
+Concurrent /match requests are queued and handled in micro-batches: all
+images in a batch are pHashed with one batched DCT, their hashes are compared
+against the stored hashes in one XOR/popcount pass, and their ORB descriptors
+are searched in one LSH query per document type.
+
+Added images also get region hashes (centre crops and grid windows, see
+region_hashes.py), so a cropped query still finds its original; each match
+reports the region that was closest ("full" for the whole image). Because
+region hashes also bring unrelated images closer, use a match's accepted flag
+(distance within ACCEPT_DISTANCE) rather than a fixed similarity percentage.
+
+/near returns every stored image whose whole-image pHash is within radius
+bits. Large indexes answer it from a multi-index hash table (mih_index.py)
+instead of scanning every stored hash.
+"""
+import argparse
+import base64
+import io
+import json
+import logging
+import queue
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from augmentation import DEFAULT_WORK_SIDE, AugmentationEngine
+from batch_hash import batch_phash
+from bitops import hamming_matrix, to_packed_hash
+from fast_decode import open_for_hashing
+from hash_index import HashIndex
+from image_features import DecodedImage
+from instrumentation import metrics
+from local_store import LocalCampaignStore
+from mih_index import MultiIndexHashIndex, flip_masks
+from orb_matcher import OrbMatcher
+from region_hashes import FULL_REGION, RegionHashIndex, region_hashes
+
+log = logging.getLogger(__name__)
+
+HASH_BITS = 64
+DEFAULT_TOP_K = 5
+DEFAULT_MAX_BATCH = 32
+DEFAULT_MAX_WAIT = 0.005  # seconds to wait for more requests before running a batch
+
+# Largest Hamming distance a match is accepted at. With region hashes an unrelated image's
+# closest entry comes within 10-16 bits (never under 10, 5% at or under 14, on 60 synthetic
+# flyers), so ~80% pHash similarity no longer separates matches; at 8 bits (87.5%, the
+# cascade's accept_distance) no unrelated image was accepted and 77% of crops still were
+ACCEPT_DISTANCE = 8
+
+# Radius lookups use the multi-index tables only for indexes at least this large, and only
+# when the probed buckets hold at most this share of the stored hashes; otherwise one
+# vectorized scan is faster (on random 64-bit hashes the tables win from about 200k hashes
+# at radius 12 or less, and lose at 19 bits, the 70% rule, at any size)
+RADIUS_INDEX_MIN_SIZE = 200_000
+RADIUS_INDEX_MAX_FRACTION = 0.05
+
+# One scored candidate: stored hash, Hamming distance, pHash similarity and ORB similarity
+# (percentages), the stored region that was closest, and whether the distance is within
+# ACCEPT_DISTANCE
+Match = namedtuple("Match", ["key", "hamming_distance", "phash_similarity", "orb_similarity", "region",
+                             "accepted"])
+
+# One queued /match request
+_Request = namedtuple("_Request", ["document", "image_bytes", "image_hash", "k", "future"])
+
+
+class UnknownDocumentError(KeyError):
+    """Raised for a document type that has no index and nothing in the store; HTTP 404."""
+
+
+class DocumentIndex:
+    """Warm hash index and ORB matcher for one document type."""
+
+    def __init__(self):
+        self.hash_index = HashIndex()
+        self.radius_index = MultiIndexHashIndex()
+        self.orb_matcher = OrbMatcher()
+        self.region_index = RegionHashIndex()
+        self._descriptor_counts = {}
+
+    @classmethod
+    def from_store(cls, store, doc_type):
+        index = cls()
+        regions = store.regions(doc_type)
+        for key in store.hashes(doc_type):
+            index.hash_index.insert(key, key)
+            index.radius_index.insert(key, key, rebuild=False)
+            if key in regions:
+                index.region_index.add(key, regions=regions[key])
+        index.radius_index.rebuild()
+        descriptors = store.descriptors(doc_type)
+        if descriptors is not None:
+            for name in descriptors.names:
+                index.orb_matcher.add(descriptors.descriptors(name), name)
+                index._descriptor_counts[name] = len(descriptors.descriptors(name))
+            index.orb_matcher.train()
+        return index
+
+    def add(self, key, descriptors=None, regions=None):
+        self.hash_index.insert(key, key)
+        self.radius_index.insert(key, key)
+        if regions:
+            self.region_index.add(key, regions=regions)
+        if descriptors is not None and key not in self._descriptor_counts:
+            self.orb_matcher.add(descriptors, key)
+            self._descriptor_counts[key] = len(descriptors)
+
+    def within(self, query, radius):
+        """Returns [(key, distance)] for every stored hash within radius bits of query, closest first."""
+        mih = self.radius_index
+        probed = mih.chunks * len(flip_masks(mih.substring_bits, radius // mih.chunks))
+        if len(mih) < RADIUS_INDEX_MIN_SIZE or probed / (1 << mih.substring_bits) > RADIUS_INDEX_MAX_FRACTION:
+            metrics.count("radius_queries_scan")
+            return self.hash_index.within(query, radius)
+        result = mih.query_radius(query, radius)
+        metrics.count("radius_queries_indexed")
+        metrics.count("radius_candidates", result.candidates)
+        return result.matches
+
+    def top_k(self, query_hashes, query_descriptors, ks):
+        """
+        Scores a batch of queries. query_hashes is a uint64 array, query_descriptors
+        a list of (N, 32) arrays or None, ks the result count for each query.
+        """
+        stored = self.hash_index.hashes
+        keys = self.hash_index.keys
+        if len(stored) == 0:
+            return [[] for _ in ks]
+        distances = hamming_matrix(query_hashes, stored)
+
+        # Good ORB matches per (query, stored key), from one LSH search over every query's descriptors
+        orb_votes = [Counter() for _ in ks]
+        with_features = [i for i, d in enumerate(query_descriptors) if d is not None and len(d)]
+        if with_features and len(self.orb_matcher):
+            stacked = np.concatenate([query_descriptors[i] for i in with_features])
+            owners = np.repeat(with_features, [len(query_descriptors[i]) for i in with_features])
+            matches = self.orb_matcher.match(stacked)
+            if matches:
+                labels = self.orb_matcher.label_of([stored_row for _, stored_row, _ in matches])
+                for (query_row, _, _), label in zip(matches, labels):
+                    orb_votes[owners[query_row]][label] += 1
+
+        results = []
+        for i, k in enumerate(ks):
+            row = distances[i]
+            count = min(k, len(row))
+            positions = np.argpartition(row, count - 1)[:count]
+            # Closest (distance, region) per candidate: whole-image hashes, then stored regions
+            best = {keys[p]: (int(row[p]), FULL_REGION) for p in positions}
+            for key, region, distance in self.region_index.best_matches(int(query_hashes[i]), k):
+                if key not in best or distance < best[key][0]:
+                    best[key] = (distance, region)
+            ranked = sorted(best.items(), key=lambda item: item[1][0])[:k]
+            descriptors = query_descriptors[i]
+            results.append([
+                Match(key, distance, (1 - distance / HASH_BITS) * 100,
+                      orb_votes[i][key] / len(descriptors) * 100 if descriptors is not None and len(descriptors) else None,
+                      region, distance <= ACCEPT_DISTANCE)
+                for key, (distance, region) in ranked
+            ])
+        return results
+
+
+class MatchingService:
+    """
+    Holds a DocumentIndex per document type and runs queued match requests in
+    micro-batches of up to max_batch, waiting at most max_wait seconds for a
+    batch to fill. submit() returns a Future; match() blocks for the result.
+    """
+
+    def __init__(self, store, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT):
+        self.store = store
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._local = threading.local()  # One ORB detector per thread; extraction runs on several
+        self.requests = 0
+        self.batches = 0
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="matching-batcher", daemon=True)
+        self._worker.start()
+
+    def _index(self, doc_type):
+        if doc_type not in self._indexes:
+            self._indexes[doc_type] = DocumentIndex.from_store(self.store, doc_type)
+        return self._indexes[doc_type]
+
+    def _known_index(self, doc_type):
+        if doc_type not in self._indexes and self.store.document(doc_type) is None:
+            raise UnknownDocumentError(f"Unknown document type: {doc_type}")
+        return self._index(doc_type)
+
+    def warm(self, doc_types=None):
+        """Loads the indexes for doc_types (default: every stored document type) up front."""
+        with self._lock:
+            for doc_type in doc_types or self.store.document_types():
+                self._index(doc_type)
+
+    @staticmethod
+    def _decode(image_bytes):
+        """
+        Decodes an encoded image once, full size and grayscale like hash_core's
+        hashes. The pHash input (.pil), the ORB input (.gray) and the region
+        level all share this one decode.
+        """
+        try:
+            return DecodedImage.from_pil(open_for_hashing(io.BytesIO(image_bytes)))
+        except OSError as e:
+            raise ValueError(f"Could not decode image: {e}") from e
+
+    def _describe(self, decoded):
+        orb = getattr(self._local, "orb", None)
+        if orb is None:
+            orb = self._local.orb = cv2.ORB_create()
+        with metrics.timer("orb_detect"):
+            _, descriptors = orb.detectAndCompute(decoded.gray, None)
+        return descriptors
+
+    def extract(self, image_bytes, image_hash=None):
+        """Returns (hash, ORB descriptors, region hashes) of an encoded image; safe to call from several threads."""
+        decoded = self._decode(image_bytes)
+        if image_hash is None:
+            image_hash = f"{int(batch_phash([decoded.pil])[0]):016x}"
+        # Regions are hashed from a box-filtered integer reduction of the same decode that keeps the
+        # shorter side at least the engine's working size (a fractional INTER_AREA resize of the
+        # full image costs more than the decode saved)
+        factor = max(1, min(decoded.pil.size) // DEFAULT_WORK_SIDE)
+        level = decoded if factor == 1 else DecodedImage.from_pil(decoded.pil.reduce(factor))
+        regions = region_hashes(AugmentationEngine(level))
+        return str(image_hash), self._describe(decoded), regions
+
+    def add(self, doc_type, image_bytes, image_hash=None):
+        """Stores an image (with its region hashes) in the local store and in the warm index; returns its hash."""
+        image_hash, descriptors, regions = self.extract(image_bytes, image_hash)
+        self.add_many(doc_type, [(image_hash, descriptors, image_bytes, regions)])
+        return image_hash
+
+    def add_many(self, doc_type, entries):
+        """Stores already extracted (hash, descriptors, image_bytes, regions) entries with one store write."""
+        with self._lock, metrics.timer("backend_io"):
+            self.store.add_many(doc_type, entries)
+            index = self._index(doc_type)
+            for image_hash, descriptors, _, regions in entries:
+                index.add(str(image_hash), descriptors, regions)
+
+    def near(self, doc_type, image_bytes=None, image_hash=None, radius=ACCEPT_DISTANCE):
+        """Returns [(key, distance)] for every stored image within radius bits of the image or hash."""
+        if image_hash is None:
+            if image_bytes is None:
+                raise ValueError("An image or a hash is required")
+            with metrics.timer("hash"):
+                image_hash = int(batch_phash([self._decode(image_bytes).pil])[0])
+        query = to_packed_hash(image_hash)
+        with self._lock:
+            index = self._known_index(doc_type)
+            with metrics.timer("match"):
+                return index.within(query, radius)
+
+    def submit(self, doc_type, image_bytes=None, image_hash=None, k=DEFAULT_TOP_K):
+        if image_bytes is None and image_hash is None:
+            raise ValueError("An image or a hash is required")
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        future = Future()
+        self._queue.put(_Request(doc_type, image_bytes, image_hash, k, future))
+        return future
+
+    def match(self, doc_type, image_bytes=None, image_hash=None, k=DEFAULT_TOP_K):
+        return self.submit(doc_type, image_bytes, image_hash, k).result()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return [request for request in batch if request is not None]
+
+    def _run(self):
+        while not self._closed:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            # A failing batch is answered with its error; the worker keeps serving later requests
+            try:
+                self._process(batch)
+            except Exception as e:
+                log.exception("Match batch failed")
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _hash_images(self, prepared):
+        """pHashes the decoded images in one batch; if that fails, image by image, failing only the bad ones."""
+        to_hash = [position for position, (request, image, _, packed) in enumerate(prepared) if packed is None]
+        if not to_hash:
+            return prepared
+        try:
+            with metrics.timer("hash"):
+                computed = batch_phash([prepared[p][1] for p in to_hash])
+            for p, value in zip(to_hash, computed):
+                prepared[p] = prepared[p][:3] + (value,)
+            return prepared
+        except Exception:
+            log.warning("Batched pHash failed, hashing %d images one by one", len(to_hash), exc_info=True)
+        for p in to_hash:
+            request, image, descriptors, _ = prepared[p]
+            try:
+                prepared[p] = (request, image, descriptors, batch_phash([image])[0])
+            except Exception as e:
+                request.future.set_exception(e)
+        return [entry for entry in prepared if entry[3] is not None]
+
+    def _process(self, batch):
+        # Decode, describe and parse each request once; requests that fail are answered individually
+        prepared = []
+        for request in batch:
+            try:
+                image, descriptors, packed = None, None, None
+                if request.image_hash is not None:
+                    packed = np.uint64(to_packed_hash(request.image_hash))
+                if request.image_bytes is not None:
+                    decoded = self._decode(request.image_bytes)
+                    image, descriptors = decoded.pil, self._describe(decoded)
+                prepared.append((request, image, descriptors, packed))
+            except Exception as e:
+                request.future.set_exception(e)
+
+        prepared = self._hash_images(prepared)
+        hashes = [packed for _, _, _, packed in prepared]
+
+        by_document = {}
+        for position, (request, _, _, _) in enumerate(prepared):
+            by_document.setdefault(request.document, []).append(position)
+
+        metrics.count("match_requests", len(prepared))
+        metrics.count("match_batches")
+        with self._lock:
+            self.requests += len(prepared)
+            self.batches += 1
+            for doc_type, positions in by_document.items():
+                try:
+                    index = self._known_index(doc_type)
+                    with metrics.timer("match"):
+                        results = index.top_k(
+                            np.array([hashes[p] for p in positions], dtype=np.uint64),
+                            [prepared[p][2] for p in positions],
+                            [prepared[p][0].k for p in positions],
+                        )
+                    for p, matches in zip(positions, results):
+                        prepared[p][0].future.set_result(matches)
+                except Exception as e:
+                    for p in positions:
+                        prepared[p][0].future.set_exception(e)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "mean_batch_size": self.requests / self.batches if self.batches else 0,
+                "documents": {doc_type: len(index.hash_index) for doc_type, index in self._indexes.items()},
+            }
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+
+
+class MatchingServer(ThreadingHTTPServer):
+    # Deep enough listen backlog for bursts of concurrent clients during load tests
+    request_queue_size = 128
+    daemon_threads = True
+
+
+# Function to build the HTTP handler class bound to one service
+def make_handler(service):
+    class MatchingHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._reply(200, service.stats())
+            elif self.path == "/metrics":
+                body = metrics.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._reply(404, {"error": f"Unknown path: {self.path}"})
+
+        def do_POST(self):
+            try:
+                request = self._read_json()
+                document = request.get("document", "flyers")
+                image_bytes = base64.b64decode(request["image"]) if "image" in request else None
+                if self.path == "/match":
+                    matches = service.match(document, image_bytes, request.get("hash"),
+                                            int(request.get("k", DEFAULT_TOP_K)))
+                    self._reply(200, {"matches": [m._asdict() for m in matches]})
+                elif self.path == "/near":
+                    matches = service.near(document, image_bytes, request.get("hash"),
+                                           int(request.get("radius", ACCEPT_DISTANCE)))
+                    self._reply(200, {"matches": [{"key": key, "hamming_distance": distance}
+                                                  for key, distance in matches]})
+                elif self.path == "/add":
+                    if image_bytes is None:
+                        raise ValueError("An image is required")
+                    self._reply(200, {"hash": service.add(document, image_bytes, request.get("hash"))})
+                else:
+                    self._reply(404, {"error": f"Unknown path: {self.path}"})
+            except UnknownDocumentError as e:
+                self._reply(404, {"error": e.args[0]})
+            except Exception as e:
+                self._reply(400, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return MatchingHandler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve top-K pHash and ORB matches from warm in-memory indexes.")
+    parser.add_argument("--store", default="local_store", help="local store folder")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument("--max-wait", type=float, default=DEFAULT_MAX_WAIT)
+    parser.add_argument("--no-metrics", action="store_true", help="do not collect the /metrics timings")
+    args = parser.parse_args(argv)
+    if not args.no_metrics:
+        metrics.enable()
+
+    service = MatchingService(LocalCampaignStore(args.store), args.max_batch, args.max_wait)
+    service.warm()
+    server = MatchingServer((args.host, args.port), make_handler(service))
+    print(f"Matching service on http://{args.host}:{args.port} ({service.stats()['documents']})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
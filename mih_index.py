@@ -0,0 +1,167 @@
+import math
+from collections import namedtuple
+from itertools import combinations
+
+import numpy as np
+
+from bitops import popcount64, to_packed_hash
+
+# Result of a radius query: matches plus how much of the corpus was touched
+RadiusQueryResult = namedtuple("RadiusQueryResult", ["matches", "candidates", "probes"])
+
+# Cache of bit-flip masks per (substring width, radius)
+_FLIP_MASKS = {}
+
+# Function to list every mask of substring_bits bits with at most radius bits set
+def flip_masks(substring_bits, radius):
+    key = (substring_bits, radius)
+    if key not in _FLIP_MASKS:
+        masks = []
+        for flips in range(min(radius, substring_bits) + 1):
+            for positions in combinations(range(substring_bits), flips):
+                mask = 0
+                for position in positions:
+                    mask |= 1 << position
+                masks.append(mask)
+        _FLIP_MASKS[key] = np.array(masks, dtype=np.int64)
+    return _FLIP_MASKS[key]
+
+# Function to convert a "similarity > threshold %" rule into a Hamming radius
+def similarity_to_radius(threshold_percentage, hash_bits=64):
+    return math.ceil(hash_bits * (1 - threshold_percentage / 100)) - 1
+
+# Helper to list positions start[i]..end[i] for every bucket, as one array
+def _bucket_rows(starts, ends):
+    counts = ends - starts
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Each row's offset inside the concatenated output, shifted back to its bucket start
+    shifts = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return shifts + np.arange(total)
+
+
+class MultiIndexHashIndex:
+    """
+    Multi-index hashing over 64-bit hashes. Each hash is split into `chunks`
+    disjoint substrings. Two hashes within Hamming distance r must agree to
+    within r // chunks bits on at least one substring, so a radius query only
+    reads the buckets near the query's substrings and verifies those candidates
+    with one XOR/popcount pass, instead of scanning the corpus.
+
+    Each substring table is a sorted position array plus bucket offsets (one
+    slot per substring value), so probing is array indexing, not dict lookups.
+    Hashes inserted after the last build sit in a delta that is scanned
+    exactly; the tables are rebuilt once the delta grows past rebuild_fraction
+    of the indexed set (at least min_rebuild), as OrbMatcher does. Deleted
+    entries are masked out until the next rebuild.
+    """
+
+    def __init__(self, hash_bits=64, chunks=4, capacity=1024, rebuild_fraction=0.25, min_rebuild=1000):
+        if hash_bits % chunks:
+            raise ValueError("hash_bits must be divisible by chunks")
+        self.hash_bits = hash_bits
+        self.chunks = chunks
+        self.substring_bits = hash_bits // chunks
+        self.rebuild_fraction = rebuild_fraction
+        self.min_rebuild = min_rebuild
+        self._hashes = np.zeros(max(capacity, 1), dtype=np.uint64)
+        self._alive = np.zeros(max(capacity, 1), dtype=bool)
+        self._keys = []
+        self._positions = {}
+        self._size = 0
+        self._indexed = 0  # Rows [0, _indexed) are in the tables; the rest is the delta
+        self._orders = []
+        self._starts = []
+
+    @classmethod
+    def build(cls, hashes, keys=None, hash_bits=64, chunks=4):
+        """Bulk-builds an index from hashes (hex strings, ints or ImageHash objects)."""
+        hashes = list(hashes)
+        index = cls(hash_bits=hash_bits, chunks=chunks, capacity=len(hashes))
+        if keys is None:
+            keys = [str(value) for value in hashes]
+        for key, value in zip(keys, hashes):
+            index.insert(key, value, rebuild=False)
+        index.rebuild()
+        return index
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def _substrings(self, packed):
+        shifts = np.arange(self.chunks, dtype=np.uint64) * np.uint64(self.substring_bits)
+        mask = np.uint64((1 << self.substring_bits) - 1)
+        return ((np.asarray(packed, dtype=np.uint64)[..., np.newaxis] >> shifts) & mask).astype(np.int64)
+
+    def insert(self, key, value, rebuild=True):
+        """Adds a hash under key, replacing any hash already stored for it."""
+        if key in self._positions:
+            self.delete(key)
+        if self._size == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.zeros(len(self._hashes), dtype=np.uint64)])
+            self._alive = np.concatenate([self._alive, np.zeros(len(self._alive), dtype=bool)])
+        self._hashes[self._size] = np.uint64(to_packed_hash(value))
+        self._alive[self._size] = True
+        self._positions[key] = self._size
+        self._keys.append(key)
+        self._size += 1
+        if rebuild and self._size - self._indexed >= max(self.min_rebuild, self.rebuild_fraction * self._indexed):
+            self.rebuild()
+
+    def delete(self, key):
+        self._alive[self._positions.pop(key)] = False
+
+    def rebuild(self):
+        """Compacts out deleted rows and rebuilds every substring table over all stored hashes."""
+        live = np.nonzero(self._alive[:self._size])[0]
+        if len(live) != self._size:
+            self._keys = [self._keys[p] for p in live]
+            self._positions = {key: i for i, key in enumerate(self._keys)}
+            self._hashes[:len(live)] = self._hashes[live]
+            self._alive[:] = False
+            self._alive[:len(live)] = True
+            self._size = len(live)
+        substrings = self._substrings(self._hashes[:self._size])
+        buckets = 1 << self.substring_bits
+        self._orders, self._starts = [], []
+        for chunk in range(self.chunks):
+            column = substrings[:, chunk]
+            self._orders.append(np.argsort(column, kind="stable"))
+            self._starts.append(np.concatenate([[0], np.cumsum(np.bincount(column, minlength=buckets))]))
+        self._indexed = self._size
+
+    def query_radius(self, query, radius):
+        """
+        Returns a RadiusQueryResult with every stored (key, distance) within radius,
+        closest first, the number of candidate rows verified (a hash found through
+        several substrings counts once per substring) and the buckets probed.
+        """
+        packed = np.uint64(to_packed_hash(query))
+        masks = flip_masks(self.substring_bits, radius // self.chunks)
+
+        rows = [np.arange(self._indexed, self._size)]  # The delta is always verified
+        probes = 0
+        if self._indexed:
+            for chunk, substring in enumerate(self._substrings(packed)):
+                probed = substring ^ masks
+                probes += len(probed)
+                starts = self._starts[chunk]
+                rows.append(self._orders[chunk][_bucket_rows(starts[probed], starts[probed + 1])])
+        # A row can come from several substrings; verifying repeats is cheaper than deduplicating
+        # every candidate, so only the rows within radius are deduplicated
+        candidates = np.concatenate(rows)
+        distances = popcount64(np.bitwise_xor(self._hashes[candidates], packed))
+        within = (distances <= radius) & self._alive[candidates]
+        found, first = np.unique(candidates[within], return_index=True)
+        found_distances = distances[within][first]
+        order = np.argsort(found_distances, kind="stable")
+        matches = [(self._keys[found[i]], int(found_distances[i])) for i in order]
+        return RadiusQueryResult(matches, len(candidates), probes)
+
+    def query_similarity(self, query, threshold_percentage):
+        """Radius query for the "similarity > threshold %" rule used by is_duplicate."""
+        return self.query_radius(query, similarity_to_radius(threshold_percentage, self.hash_bits))
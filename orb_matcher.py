@@ -0,0 +1,145 @@
+import cv2
+import numpy as np
+
+from descriptor_store import DescriptorStore, write_descriptor_store
+
+# FLANN LSH parameters used by compare_orb_descriptors in hash_core.py
+LSH_INDEX_PARAMS = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1)
+LSH_SEARCH_PARAMS = dict(checks=50)
+
+# Lowe ratio used to keep a match
+RATIO = 0.7
+
+
+class OrbMatcher:
+    """
+    Long-lived ORB matcher for one document type or campaign. The LSH index over
+    stored descriptors is built once and reused for every query. Descriptors added
+    later go into a small delta that is searched exactly with a brute-force
+    matcher; the LSH index is only rebuilt when the delta grows past
+    rebuild_fraction of the indexed set.
+
+    OpenCV cannot save and reload LSH tables (flann_Index.load crashes for LSH),
+    so save() writes the descriptors to a memory-mapped descriptor store and
+    load() rebuilds the tables from it once per process.
+    """
+
+    def __init__(self, index_params=None, search_params=None, rebuild_fraction=0.25, min_rebuild=1000):
+        self.index_params = dict(index_params or LSH_INDEX_PARAMS)
+        self.search_params = dict(search_params or LSH_SEARCH_PARAMS)
+        self.rebuild_fraction = rebuild_fraction
+        self.min_rebuild = min_rebuild
+        self._indexed = np.zeros((0, 32), dtype=np.uint8)
+        self._index = None
+        self._pending = []
+        self._pending_count = 0
+        self._labels = []
+        self._label_rows = [0]
+        self._bf = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+    def __len__(self):
+        return len(self._indexed) + self._pending_count
+
+    @property
+    def labels(self):
+        return list(self._labels)
+
+    def add(self, descriptors, label=None):
+        """Adds one image's descriptors under label (defaults to its position)."""
+        if descriptors is None or len(descriptors) == 0:
+            descriptors = np.zeros((0, 32), dtype=np.uint8)
+        descriptors = np.ascontiguousarray(descriptors, dtype=np.uint8)
+        self._pending.append(descriptors)
+        self._pending_count += len(descriptors)
+        self._labels.append(len(self._labels) if label is None else label)
+        self._label_rows.append(self._label_rows[-1] + len(descriptors))
+        if self._pending_count >= max(self.min_rebuild, self.rebuild_fraction * len(self._indexed)):
+            self.train()
+
+    def train(self):
+        """Folds pending descriptors into the LSH index; a no-op when nothing new is pending."""
+        if self._pending_count == 0 and (self._index is not None or not len(self._indexed)):
+            self._pending = []  # At most empty descriptor sets, which add no rows
+            return
+        if self._pending:
+            self._indexed = np.concatenate([self._indexed] + self._pending)
+            self._pending = []
+            self._pending_count = 0
+        self._index = cv2.flann_Index(self._indexed, self.index_params) if len(self._indexed) else None
+
+    def _delta(self):
+        if len(self._pending) > 1:
+            self._pending = [np.concatenate(self._pending)]
+        return self._pending[0] if self._pending else None
+
+    def knn(self, query, k=2):
+        """
+        Returns (rows, distances), each (len(query), k), over all stored descriptors.
+        Missing neighbours have row -1 and distance inf.
+        """
+        query = np.ascontiguousarray(query, dtype=np.uint8)
+        rows = np.full((len(query), k), -1, dtype=np.int64)
+        distances = np.full((len(query), k), np.inf)
+        if len(query) == 0:
+            return rows, distances
+
+        if self._index is not None:
+            found_rows, found_distances = self._index.knnSearch(query, min(k, len(self._indexed)),
+                                                                params=self.search_params)
+            found_distances = found_distances.astype(np.float64)
+            found_distances[found_rows < 0] = np.inf
+            width = found_rows.shape[1]
+            rows[:, :width] = found_rows
+            distances[:, :width] = found_distances
+
+        delta = self._delta()
+        if delta is not None and len(delta):
+            offset = len(self._indexed)
+            delta_rows = np.full((len(query), k), -1, dtype=np.int64)
+            delta_distances = np.full((len(query), k), np.inf)
+            for qi, neighbours in enumerate(self._bf.knnMatch(query, delta, k=k)):
+                for j, m in enumerate(neighbours):
+                    delta_rows[qi, j] = m.trainIdx + offset
+                    delta_distances[qi, j] = m.distance
+            rows = np.concatenate([rows, delta_rows], axis=1)
+            distances = np.concatenate([distances, delta_distances], axis=1)
+            order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+            rows = np.take_along_axis(rows, order, axis=1)
+            distances = np.take_along_axis(distances, order, axis=1)
+        return rows, distances
+
+    def match(self, query, ratio=RATIO):
+        """Returns [(query_row, stored_row, distance)] for matches passing the ratio test."""
+        rows, distances = self.knn(query, k=2)
+        keep = (rows[:, 1] >= 0) & (distances[:, 0] < ratio * distances[:, 1])
+        query_rows = np.nonzero(keep)[0]
+        return [(int(q), int(rows[q, 0]), float(distances[q, 0])) for q in query_rows]
+
+    def score(self, query, ratio=RATIO):
+        """Percentage of query descriptors with a good match, as in compare_orb_descriptors."""
+        if query is None or len(query) == 0:
+            return 0
+        return len(self.match(query, ratio)) / len(query) * 100
+
+    def label_of(self, stored_rows):
+        """Maps stored descriptor rows back to the labels they were added under."""
+        positions = np.searchsorted(self._label_rows, stored_rows, side="right") - 1
+        return [self._labels[p] for p in positions]
+
+    def save(self, path):
+        """Writes all descriptors, grouped by label, to a descriptor store file."""
+        self.train()
+        entries = [(label, None, self._indexed[start:end])
+                   for label, start, end in zip(self._labels, self._label_rows, self._label_rows[1:])]
+        write_descriptor_store(path, entries)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Reloads a matcher saved with save(); the LSH tables are rebuilt once here."""
+        store = DescriptorStore(path)
+        matcher = cls(**kwargs)
+        matcher._indexed = np.ascontiguousarray(store.all_descriptors)
+        matcher._labels = list(store.names)
+        matcher._label_rows = [int(row) for row in store.offsets]
+        matcher.train()
+        return matcher
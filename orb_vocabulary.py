@@ -0,0 +1,341 @@
+"""
+Binary visual vocabulary over ORB descriptors (bag of binary words).
+
+A BinaryVocabulary is a set of k 256-bit "words" learned from ORB
+descriptors with k-majority clustering. This is k-means under Hamming
+distance: every centroid is the bitwise majority vote of its descriptors.
+Each descriptor of an image maps to its nearest word. The image becomes a
+sparse, L2-normalised tf-idf histogram over the words, a Signature of a few
+hundred (word, weight) pairs. Similar images share words, so signatures
+keep locality, unlike a cryptographic digest of the raw descriptors.
+
+BowIndex is an inverted index from word to the images that contain it. A
+query scores the whole corpus in one pass over the postings of its own
+words (cosine similarity), instead of one BFMatcher run per stored image.
+
+    python orb_vocabulary.py train [FOLDER ...] [--out orb_vocabulary.npz]
+    python orb_vocabulary.py evaluate [--count 40]
+
+train learns a vocabulary from image folders (the seeded synthetic flyers
+when none are given). evaluate compares top-1 retrieval and query time of
+the index with pairwise BFMatcher on transformed synthetic flyers.
+"""
+import logging
+import os
+import tempfile
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from bitops import descriptors_to_bits
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORDS = 512
+DEFAULT_ITERATIONS = 10
+
+# Descriptors sampled for training; more adds time but barely changes the words
+DEFAULT_TRAINING_SAMPLE = 50_000
+
+# Synthetic flyers used when no training images are given
+DEFAULT_TRAINING_FLYERS = 40
+
+# Where default_vocabulary() caches the vocabulary trained on synthetic flyers
+DEFAULT_VOCABULARY_PATH = os.path.join(tempfile.gettempdir(), "motion_hash_orb_vocabulary.npz")
+
+# Sparse tf-idf histogram: sorted word ids and their L2-normalised weights
+Signature = namedtuple("Signature", ["words", "weights"])
+
+EMPTY_SIGNATURE = Signature(np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+
+# Helper to compute, for each descriptor, its nearest word (OpenCV's SIMD Hamming search)
+def _nearest_words(descriptors, words):
+    matches = cv2.BFMatcher(cv2.NORM_HAMMING).match(np.ascontiguousarray(descriptors, dtype=np.uint8), words)
+    return np.fromiter((m.trainIdx for m in matches), dtype=np.int32, count=len(matches))
+
+# Helper to set every centroid to the bitwise majority of its assigned descriptors
+def _majority_words(bits, labels, k):
+    counts = np.bincount(labels, minlength=k)
+    # One bincount over (label, bit position) pairs counts the set bits of every cluster at once
+    width = bits.shape[1]
+    rows, columns = np.nonzero(bits)
+    ones = np.bincount(labels[rows] * width + columns, minlength=k * width).reshape(k, width)
+    majority = ones * 2 > counts[:, np.newaxis]
+    return np.packbits(majority, axis=1), counts
+
+# Function to compute the similarity of two signatures (cosine, 0 to 1)
+def signature_similarity(signature1, signature2):
+    _, positions1, positions2 = np.intersect1d(signature1.words, signature2.words,
+                                               assume_unique=True, return_indices=True)
+    return float(np.dot(signature1.weights[positions1], signature2.weights[positions2]))
+
+
+class BinaryVocabulary:
+    """
+    k binary words (a (k, 32) uint8 array) and an idf weight per word. Build
+    one with train() or load() and keep it for the life of the index: the
+    signatures of two vocabularies are not comparable.
+    """
+
+    def __init__(self, words, idf=None):
+        self.words = np.ascontiguousarray(words, dtype=np.uint8)
+        self.idf = np.ones(len(self.words), dtype=np.float32) if idf is None else np.asarray(idf, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.words)
+
+    @classmethod
+    def train(cls, descriptor_sets, k=DEFAULT_WORDS, iterations=DEFAULT_ITERATIONS,
+              sample=DEFAULT_TRAINING_SAMPLE, seed=0):
+        """
+        Learns k words from descriptor_sets (one (N, 32) array per training
+        image) and an idf weight per word from how many of those images use it.
+        """
+        descriptor_sets = [d for d in descriptor_sets if d is not None and len(d)]
+        if not descriptor_sets:
+            raise ValueError("No descriptors to train a vocabulary on")
+        rng = np.random.default_rng(seed)
+        descriptors = np.concatenate(descriptor_sets)
+        if len(descriptors) > sample:
+            descriptors = descriptors[rng.choice(len(descriptors), sample, replace=False)]
+        k = min(k, len(descriptors))
+        bits = descriptors_to_bits(descriptors)
+
+        words = descriptors[rng.choice(len(descriptors), k, replace=False)]
+        for iteration in range(iterations):
+            labels = _nearest_words(descriptors, words)
+            updated, counts = _majority_words(bits, labels, k)
+            # Empty clusters restart from random descriptors instead of staying all-zero
+            empty = np.nonzero(counts == 0)[0]
+            updated[empty] = descriptors[rng.choice(len(descriptors), len(empty), replace=False)]
+            moved = int(np.count_nonzero(np.any(updated != words, axis=1)))
+            words = updated
+            log.debug("Vocabulary iteration %d: %d of %d words moved", iteration + 1, moved, k)
+            if moved == 0:
+                break
+
+        vocabulary = cls(words)
+        document_frequency = np.zeros(k, dtype=np.int64)
+        for descriptor_set in descriptor_sets:
+            document_frequency[np.unique(vocabulary.quantize(descriptor_set))] += 1
+        vocabulary.idf = np.log((len(descriptor_sets) + 1) / (document_frequency + 1)).astype(np.float32)
+        return vocabulary
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["words"], data["idf"])
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, words=self.words, idf=self.idf)
+
+    def quantize(self, descriptors):
+        """Returns the nearest word id of every descriptor."""
+        if descriptors is None or len(descriptors) == 0:
+            return np.zeros(0, dtype=np.int32)
+        return _nearest_words(descriptors, self.words)
+
+    def signature(self, descriptors):
+        """Returns the image's Signature: tf-idf word weights, L2-normalised."""
+        words, counts = np.unique(self.quantize(descriptors), return_counts=True)
+        weights = counts * self.idf[words]
+        norm = np.linalg.norm(weights)
+        if norm == 0:
+            return EMPTY_SIGNATURE
+        return Signature(words.astype(np.int32), (weights / norm).astype(np.float32))
+
+    def similarity(self, descriptors1, descriptors2):
+        """Signature similarity of two descriptor sets as a 0-100 percentage."""
+        return signature_similarity(self.signature(descriptors1), self.signature(descriptors2)) * 100
+
+
+class BowIndex:
+    """
+    Inverted index of image signatures. Postings are kept in a CSR layout
+    (word -> stored rows and weights), rebuilt lazily after adds, so a query
+    only reads the postings of the words it contains.
+    """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+        self._keys = []
+        self._positions = {}
+        self._signatures = []
+        self._offsets = None
+        self._rows = None
+        self._weights = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    @property
+    def keys(self):
+        return list(self._keys)
+
+    def add(self, key, descriptors=None, signature=None):
+        """Adds an image from its descriptors (or a precomputed signature), replacing any entry for key."""
+        if signature is None:
+            signature = self.vocabulary.signature(descriptors)
+        if key in self._positions:
+            self._signatures[self._positions[key]] = signature
+        else:
+            self._positions[key] = len(self._keys)
+            self._keys.append(key)
+            self._signatures.append(signature)
+        self._offsets = None
+
+    def signature(self, key):
+        return self._signatures[self._positions[key]]
+
+    def _build(self):
+        words = np.concatenate([s.words for s in self._signatures] or [np.zeros(0, dtype=np.int32)])
+        weights = np.concatenate([s.weights for s in self._signatures] or [np.zeros(0, dtype=np.float32)])
+        rows = np.repeat(np.arange(len(self._signatures), dtype=np.int32),
+                         [len(s.words) for s in self._signatures])
+        order = np.argsort(words, kind="stable")
+        self._rows, self._weights = rows[order], weights[order]
+        self._offsets = np.searchsorted(words[order], np.arange(len(self.vocabulary) + 1))
+
+    def scores(self, signature):
+        """Returns the cosine similarity (0 to 1) of signature to every stored image, in key order."""
+        if self._offsets is None:
+            self._build()
+        # Gather the postings of every query word at once, then sum per stored row
+        starts = self._offsets[signature.words]
+        lengths = self._offsets[signature.words + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros(len(self._keys), dtype=np.float32)
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        contributions = np.repeat(signature.weights, lengths) * self._weights[positions]
+        return np.bincount(self._rows[positions], contributions, minlength=len(self._keys)).astype(np.float32)
+
+    def query(self, descriptors=None, k=5, signature=None):
+        """Returns [(key, similarity percentage)] of the k most similar stored images, best first."""
+        if not self._keys:
+            return []
+        if signature is None:
+            signature = self.vocabulary.signature(descriptors)
+        scores = self.scores(signature)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self._keys[p], float(scores[p]) * 100) for p in top]
+
+# Function to extract ORB descriptors from every image file in the given folders
+def folder_descriptors(folders):
+    from image_features import ImageFeatures
+    descriptor_sets = []
+    for folder in folders:
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp", ".bmp")):
+                descriptor_sets.append(ImageFeatures.open(os.path.join(folder, name)).descriptors)
+    return descriptor_sets
+
+# Function to load the cached vocabulary, training it on synthetic flyers the first time
+def default_vocabulary(path=DEFAULT_VOCABULARY_PATH):
+    """
+    Returns a vocabulary that needs no image folders, for scripts that compare
+    a couple of images. Indexes over a real corpus should train on that corpus.
+    """
+    if os.path.exists(path):
+        return BinaryVocabulary.load(path)
+    from synthetic_flyers import generate_flyer
+    from image_features import ImageFeatures
+    log.info("Training the default ORB vocabulary on %d synthetic flyers", DEFAULT_TRAINING_FLYERS)
+    vocabulary = BinaryVocabulary.train(
+        [ImageFeatures(generate_flyer(seed)).descriptors for seed in range(DEFAULT_TRAINING_FLYERS)])
+    vocabulary.save(path)
+    return vocabulary
+
+# Function to compare index retrieval with pairwise BFMatcher on transformed synthetic flyers
+def evaluate(count=40, k=DEFAULT_WORDS, seed=0):
+    import random
+    import time
+
+    from augmentation import rotate_array
+    from image_features import ImageFeatures, orb_similarity
+    from synthetic_flyers import generate_flyer
+
+    rng = random.Random(seed)
+    originals = [ImageFeatures(generate_flyer(seed + index)) for index in range(count)]
+    queries = []
+    for features in originals:
+        height, width = features.shape[:2]
+        left, top = rng.randint(0, width // 10), rng.randint(0, height // 10)
+        cropped = features.bgr[top:height - rng.randint(0, height // 10), left:width - rng.randint(0, width // 10)]
+        queries.append(ImageFeatures(rotate_array(np.ascontiguousarray(cropped), rng.uniform(-8, 8))))
+
+    # Trained on the stored images, as an index over a real campaign would be
+    start = time.perf_counter()
+    vocabulary = BinaryVocabulary.train([features.descriptors for features in originals], k=k, seed=seed)
+    training_seconds = time.perf_counter() - start
+    index = BowIndex(vocabulary)
+    for position, features in enumerate(originals):
+        index.add(position, features.descriptors)
+
+    # Features are extracted up front, so both timings cover matching only
+    for features in originals + queries:
+        features.descriptors
+
+    start = time.perf_counter()
+    bow_hits = sum(index.query(q.descriptors, k=1)[0][0] == position for position, q in enumerate(queries))
+    bow_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pairwise_hits = 0
+    for position, query in enumerate(queries):
+        scores = [orb_similarity(query, features) for features in originals]
+        pairwise_hits += int(np.argmax(scores)) == position
+    pairwise_seconds = time.perf_counter() - start
+
+    return {
+        "images": count,
+        "words": len(vocabulary),
+        "training_s": training_seconds,
+        "bow_top1": bow_hits / count,
+        "bow_query_ms": bow_seconds / count * 1000,
+        "pairwise_top1": pairwise_hits / count,
+        "pairwise_query_ms": pairwise_seconds / count * 1000,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train or evaluate the binary ORB vocabulary.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train_parser = commands.add_parser("train", help="learn a vocabulary from image folders")
+    train_parser.add_argument("folders", nargs="*", help="image folders (default: synthetic flyers)")
+    train_parser.add_argument("--out", default=DEFAULT_VOCABULARY_PATH)
+    train_parser.add_argument("--words", type=int, default=DEFAULT_WORDS)
+    train_parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    evaluate_parser = commands.add_parser("evaluate", help="compare the index with pairwise BFMatcher")
+    evaluate_parser.add_argument("--count", type=int, default=40)
+    evaluate_parser.add_argument("--words", type=int, default=DEFAULT_WORDS)
+    evaluate_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if args.command == "train":
+        if args.folders:
+            descriptor_sets = folder_descriptors(args.folders)
+        else:
+            from image_features import ImageFeatures
+            from synthetic_flyers import generate_flyer
+            descriptor_sets = [ImageFeatures(generate_flyer(seed)).descriptors
+                               for seed in range(DEFAULT_TRAINING_FLYERS)]
+        vocabulary = BinaryVocabulary.train(descriptor_sets, k=args.words, iterations=args.iterations)
+        vocabulary.save(args.out)
+        log.info("Saved %d words trained on %d images to %s", len(vocabulary), len(descriptor_sets), args.out)
+    else:
+        result = evaluate(args.count, args.words, args.seed)
+        print(f"{result['images']} images, {result['words']} words (trained in {result['training_s']:.1f}s)")
+        print(f"{'method':<20} {'top-1':>7} {'ms/query':>9}")
+        print(f"{'inverted index':<20} {result['bow_top1']:>7.2f} {result['bow_query_ms']:>9.2f}")
+        print(f"{'pairwise BFMatcher':<20} {result['pairwise_top1']:>7.2f} {result['pairwise_query_ms']:>9.2f}")
@@ -6,7 +6,9 @@ import random
 import numpy as np
 from PIL import ImageOps
 import cv2  # OpenCV for ORB feature detection
-import hashlib
+
+import bitops
+from orb_vocabulary import default_vocabulary, signature_similarity as compare_signatures
 
 # Global variables to store the hash and original image
 original_hash = None
@@ -14,6 +16,7 @@ original_img = None
 orb = cv2.ORB_create()  # Initialize ORB detector
 orb_descriptors_original = None  # To store the ORB descriptors of the original image
 orb_descriptors_second = None  # To store the ORB descriptors of the second image
+orb_vocabulary = None  # Binary visual vocabulary, loaded on the first comparison
 
 np.set_printoptions(threshold=np.inf)
 
@@ -28,26 +31,12 @@ def generate_hash(image, hash_type='phash'):
     elif hash_type == 'whash':
         return imagehash.whash(image)
 
-# Convert ORB descriptors to bit string
-def orb_descriptors_to_bitstring(descriptors):
-    bitstrings = []
-    for descriptor in descriptors:
-        bitstring = ''.join(format(byte, '08b') for byte in descriptor)  # Convert each byte to 8-bit binary string
-        bitstrings.append(bitstring)
-    return bitstrings
-
-# Generate a SHA-256 hash from concatenated ORB descriptors
-def orb_descriptors_to_sha256(descriptors):
-    bitstrings = orb_descriptors_to_bitstring(descriptors)
-    concatenated_bits = ''.join(bitstrings)  # Concatenate all keypoints
-    hash_object = hashlib.sha256(concatenated_bits.encode())
-    return hash_object.hexdigest()
-
-# Compute Hamming distance between two hash strings
-def hamming_distance(hash1, hash2):
-    bin_hash1 = bin(int(hash1, 16))[2:].zfill(256)  # Convert hash to binary
-    bin_hash2 = bin(int(hash2, 16))[2:].zfill(256)
-    return sum(c1 != c2 for c1, c2 in zip(bin_hash1, bin_hash2))
+# Get the ORB vocabulary, loading (or training) it once
+def get_orb_vocabulary():
+    global orb_vocabulary
+    if orb_vocabulary is None:
+        orb_vocabulary = default_vocabulary()
+    return orb_vocabulary
 
 # ORB feature matching and logging keypoints/descriptors
 def orb_feature_matching(image1, image2):
@@ -61,18 +50,17 @@ def orb_feature_matching(image1, image2):
     kp2, des2 = orb.detectAndCompute(image2_cv, None)
 
     if des1 is not None and des2 is not None:
-        # Generate SHA-256 hashes from ORB descriptors for both images
-        hash_original = orb_descriptors_to_sha256(des1)
-        hash_second = orb_descriptors_to_sha256(des2)
-
-        # Compute the Hamming distance between the two hashes
-        hamming_dist = hamming_distance(hash_original, hash_second)
-        hamming_similarity = (1 - hamming_dist / 256) * 100  # Convert to percentage
-        
-        print(f"Hash for Original Image: {hash_original}")
-        print(f"Hash for Second Image: {hash_second}")
-        print(f"Hamming Distance: {hamming_dist}")
-        print(f"Hamming-based Similarity: {hamming_similarity:.2f}%")
+        # Map the descriptors of both images to bag-of-binary-words signatures
+        vocabulary = get_orb_vocabulary()
+        signature_original = vocabulary.signature(des1)
+        signature_second = vocabulary.signature(des2)
+
+        # Cosine similarity of the signatures; similar images share visual words
+        signature_similarity = compare_signatures(signature_original, signature_second) * 100
+
+        print(f"Words in Original Image: {len(signature_original.words)}")
+        print(f"Words in Second Image: {len(signature_second.words)}")
+        print(f"Signature Similarity: {signature_similarity:.2f}%")
 
         # ORB matching
         bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
@@ -84,7 +72,7 @@ def orb_feature_matching(image1, image2):
         # Calculate ORB matching percentage based on number of good matches
         orb_similarity = len(matches) / min(len(kp1), len(kp2)) * 100
 
-        return orb_similarity, hamming_similarity
+        return orb_similarity, signature_similarity
     else:
         return None, None
 
@@ -127,8 +115,7 @@ def apply_transformations(img, hash_type):
     for transformed_img in transformed_images:
         transformed_hash = generate_hash(transformed_img, hash_type)
         hamming_distance = original_hash - transformed_hash
-        total_bits = len(bin(int(str(original_hash), 16))) - 2
-        hash_similarity_percentage = (1 - hamming_distance / total_bits) * 100
+        hash_similarity_percentage = bitops.hamming_similarity(hamming_distance, bitops.hash_bits(original_hash))
 
         # ORB similarity between original image and transformed image
         orb_similarity, _ = orb_feature_matching(original_img, transformed_img)
@@ -202,8 +189,8 @@ def upload_and_compare_second_image():
             # Load second image
             second_img = Image.open(second_image_path)
 
-            # Compute ORB and Hamming similarities
-            orb_similarity, hamming_similarity = orb_feature_matching(original_img, second_img)
+            # Compute ORB and signature similarities
+            orb_similarity, signature_similarity = orb_feature_matching(original_img, second_img)
 
             # Clear any existing second image or text
             for widget in canvas_frame.winfo_children():
@@ -216,10 +203,10 @@ def upload_and_compare_second_image():
             second_img_label.image = img_tk_second  # Keep a reference to avoid garbage collection
             second_img_label.grid(row=2, column=2, padx=10, pady=10)
 
-            # Ensure ORB and Hamming similarities are computed
-            if orb_similarity is not None and hamming_similarity is not None:
-                # Display ORB and Hamming similarities below the second image
-                second_img_text = f"Second Image: ORB Sim: {orb_similarity:.2f}%, Hamming Sim: {hamming_similarity:.2f}%"
+            # Ensure ORB and signature similarities are computed
+            if orb_similarity is not None and signature_similarity is not None:
+                # Display ORB and signature similarities below the second image
+                second_img_text = f"Second Image: ORB Sim: {orb_similarity:.2f}%, Signature Sim: {signature_similarity:.2f}%"
                 second_img_label_text = tk.Label(canvas_frame, text=second_img_text)
                 second_img_label_text.grid(row=3, column=2, padx=10, pady=5)
             else:
@@ -3,8 +3,9 @@ from tkinter import filedialog, messagebox
 from PIL import Image, ImageTk
 import imagehash
 import cv2
-import numpy as np
 import os
+import image_features
+from image_features import ImageFeatures
 
 # Global variables
 hash1 = None
@@ -47,9 +48,10 @@ class ImageProcessorApp:
         file_path = filedialog.askopenfilename(title="Select the Original Image", filetypes=[("Image Files", "*.jpg *.png *.jpeg")])
         if file_path:
             try:
-                # Load the original image with PIL and convert to OpenCV format, keeping original size
+                # Load the original image with PIL once; the OpenCV (BGR) view shares its pixels, keeping original size
                 self.original_image = Image.open(file_path)
-                self.original_image_cv = cv2.cvtColor(np.array(self.original_image), cv2.COLOR_RGB2BGR)
+                self.original_features = ImageFeatures.from_pil(self.original_image)
+                self.original_image_cv = self.original_features.bgr
                 
                 self.process_button.config(state=tk.NORMAL)
                 self.upload_random_button.config(state=tk.NORMAL)  # Enable random image upload
@@ -61,10 +63,11 @@ class ImageProcessorApp:
         file_path = filedialog.askopenfilename(title="Select a Random Image", filetypes=[("Image Files", "*.jpg *.png *.jpeg")])
         if file_path:
             try:
-                # Load the random image with PIL and convert to OpenCV format, keeping original size
+                # Load the random image with PIL once; the OpenCV (BGR) view shares its pixels, keeping original size
                 self.random_image = Image.open(file_path)
+                self.random_features = ImageFeatures.from_pil(self.random_image)
                 global random_image_cv
-                random_image_cv = cv2.cvtColor(np.array(self.random_image), cv2.COLOR_RGB2BGR)
+                random_image_cv = self.random_features.bgr
                 
                 messagebox.showinfo("Success", "Random image uploaded successfully.")
             except Exception as e:
@@ -91,47 +94,12 @@ class ImageProcessorApp:
         return cv2.warpAffine(img, matrix, (width, height))
 
     def refined_phash_similarity(self, img1, img2):
-        """
-        Crops the original image to match the dimensions of the comparison image if needed,
-        then compares the pHash similarity.
-        """
-        if img1.shape != img2.shape:
-            # Calculate the center crop of the original image to match comparison image dimensions
-            height1, width1 = img1.shape[:2]
-            height2, width2 = img2.shape[:2]
-            start_x = (width1 - width2) // 2
-            start_y = (height1 - height2) // 2
-            cropped_img1 = img1[start_y:start_y + height2, start_x:start_x + width2]
-        else:
-            cropped_img1 = img1  # No need to crop if dimensions are identical
-
-        # Debugging information to confirm dimensions
-        print(f"Comparing images of size: {cropped_img1.shape} and {img2.shape}")
-        
-        # Convert OpenCV images to PIL format for hashing
-        pil_img1 = Image.fromarray(cv2.cvtColor(cropped_img1, cv2.COLOR_BGR2RGB))
-        pil_img2 = Image.fromarray(cv2.cvtColor(img2, cv2.COLOR_BGR2RGB))
-        
-        # Compute pHash for both resized images
-        hash1 = imagehash.phash(pil_img1)
-        hash2 = imagehash.phash(pil_img2)
-        
-        # Calculate similarity based on pHash (0 = identical, higher values = less similar)
-        phash_similarity = 1 - (hash1 - hash2) / len(hash1.hash) ** 2
-        return phash_similarity * 100  # Return as percentage similarity
+        # Either side may be precomputed ImageFeatures
+        return image_features.refined_phash_similarity(img1, img2)
 
     def orb_similarity(self, img1, img2):
-        kp1, des1 = orb.detectAndCompute(img1, None)
-        kp2, des2 = orb.detectAndCompute(img2, None)
-        
-        if des1 is None or des2 is None:
-            return 0
-
-        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-        matches = bf.match(des1, des2)
-        good_matches = [m for m in matches if m.distance < 42]
-        similarity_percentage = len(good_matches) / min(len(kp1), len(kp2)) * 100
-        return min(similarity_percentage, 100)
+        # Either side may be precomputed ImageFeatures
+        return image_features.orb_similarity(img1, img2)
 
     def process_image(self):
         # Apply transformations to the original image
@@ -141,23 +109,28 @@ class ImageProcessorApp:
         global similarity_results
         similarity_results = []  # Reset results for new processing
         
+        # Extract features once per image; each is compared several times below
+        original = self.original_features
+        transformed_features = {name: ImageFeatures(img) for name, img in transformations.items()}
+
         # Compare each transformation to the original image
-        for name, transformed_img in transformations.items():
-            phash_sim = self.refined_phash_similarity(self.original_image_cv, transformed_img)
-            orb_sim = self.orb_similarity(self.original_image_cv, transformed_img)
+        for name, transformed_img in transformed_features.items():
+            phash_sim = self.refined_phash_similarity(original, transformed_img)
+            orb_sim = self.orb_similarity(original, transformed_img)
             result = f"{name} vs Original: pHash {round(phash_sim, 2)}%, ORB {round(orb_sim, 2)}%"
             similarity_results.append(result)
 
         # If random image is uploaded, compare it with original and altered images
         if random_image_cv is not None:
-            random_phash_sim = self.refined_phash_similarity(self.original_image_cv, random_image_cv)
-            random_orb_sim = self.orb_similarity(self.original_image_cv, random_image_cv)
+            random_features = self.random_features
+            random_phash_sim = self.refined_phash_similarity(original, random_features)
+            random_orb_sim = self.orb_similarity(original, random_features)
             result = f"Random vs Original: pHash {round(random_phash_sim, 2)}%, ORB {round(random_orb_sim, 2)}%"
             similarity_results.append(result)
             
-            for name, transformed_img in transformations.items():
-                random_phash_sim = self.refined_phash_similarity(random_image_cv, transformed_img)
-                random_orb_sim = self.orb_similarity(random_image_cv, transformed_img)
+            for name, transformed_img in transformed_features.items():
+                random_phash_sim = self.refined_phash_similarity(random_features, transformed_img)
+                random_orb_sim = self.orb_similarity(random_features, transformed_img)
                 result = f"Random vs {name}: pHash {round(random_phash_sim, 2)}%, ORB {round(random_orb_sim, 2)}%"
                 similarity_results.append(result)
 
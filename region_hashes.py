@@ -0,0 +1,117 @@
+"""
+Multi-region block hashes for crop-tolerant lookup.
+
+Besides its whole-image pHash, each stored image gets pHashes of a fixed set
+of regions: centre crops and a 3x3 grid of windows at several scales (the 0.5
+scale corners are the 2x2 quadrant tiles). A cropped query is hashed once, as
+a whole image, and looked up against every region of every stored image in
+one vectorized pass. So a crop is found without knowing the candidate and
+without a pairwise crop-and-hash loop.
+"""
+import numpy as np
+
+from augmentation import AugmentationEngine, crop
+from hash_index import HashIndex
+
+# Window sizes as a fraction of the stored image's width and height
+REGION_SCALES = (0.9, 0.8, 0.7, 0.6, 0.5)
+
+# Name of the whole-image entry
+FULL_REGION = "full"
+
+# Function to name a region: "c0.80" for a centre crop, "0.60@2,0" for a grid window (column, row)
+def region_name(scale, column=None, row=None):
+    if column is None:
+        return f"c{scale:.2f}"
+    return f"{scale:.2f}@{column},{row}"
+
+# Function to list the region crops of a width x height image
+def region_transforms(width, height, scales=REGION_SCALES):
+    transforms = []
+    for scale in scales:
+        crop_width, crop_height = int(width * scale), int(height * scale)
+        offsets_x = (0, (width - crop_width) // 2, width - crop_width)
+        offsets_y = (0, (height - crop_height) // 2, height - crop_height)
+        for row, top in enumerate(offsets_y):
+            for column, left in enumerate(offsets_x):
+                name = region_name(scale) if (row, column) == (1, 1) else region_name(scale, column, row)
+                transforms.append(crop(name, (left, top, left + crop_width, top + crop_height)))
+    return transforms
+
+# Function to compute the region pHashes of one image (PIL image, BGR array or DecodedImage)
+def region_hashes(image, scales=REGION_SCALES):
+    """Returns {region name: ImageHash}, hashed from the augmentation engine's low-resolution level."""
+    engine = image if isinstance(image, AugmentationEngine) else AugmentationEngine(image)
+    transforms = region_transforms(engine.width, engine.height, scales)
+    return {t.name: value for t, value in zip(transforms, engine.phashes(transforms))}
+
+
+class RegionHashIndex:
+    """
+    HashIndex over the whole-image and region pHashes of stored images, keyed
+    by (image key, region name). Lookups report, per stored image, the closest
+    of its regions.
+    """
+
+    def __init__(self, capacity=1024):
+        self._index = HashIndex(capacity)
+        self._regions = {}
+
+    def __len__(self):
+        return len(self._regions)
+
+    def __contains__(self, image_key):
+        return image_key in self._regions
+
+    @property
+    def entries(self):
+        return len(self._index)
+
+    def add(self, image_key, full_hash=None, regions=None, image=None):
+        """
+        Adds an image's whole-image hash and region hashes. regions is a
+        {name: hash} dict (hex strings or ImageHash); with image given instead,
+        the regions are computed from it.
+        """
+        if regions is None and image is not None:
+            regions = region_hashes(image)
+        self.remove(image_key)
+        names = []
+        if full_hash is not None:
+            self._index.insert((image_key, FULL_REGION), full_hash)
+            names.append(FULL_REGION)
+        for name, value in (regions or {}).items():
+            self._index.insert((image_key, name), value)
+            names.append(name)
+        self._regions[image_key] = names
+
+    def remove(self, image_key):
+        for name in self._regions.pop(image_key, []):
+            self._index.delete((image_key, name))
+
+    def best_matches(self, query, k=5, max_distance=None):
+        """Returns up to k [(image key, region, distance)], one per stored image, closest first."""
+        if not len(self._index):
+            return []
+        distances = self._index.distances(query)
+        order = np.argsort(distances, kind="stable")
+        keys = self._index.keys
+        results = []
+        seen = set()
+        for position in order:
+            distance = int(distances[position])
+            if max_distance is not None and distance > max_distance:
+                break
+            image_key, region = keys[position]
+            if image_key in seen:
+                continue
+            seen.add(image_key)
+            results.append((image_key, region, distance))
+            if len(results) == k:
+                break
+        return results
+
+    def best_match(self, query):
+        """Returns (image key, region, distance) of the closest region, or (None, None, None) when empty."""
+        matches = self.best_matches(query, k=1)
+        return matches[0] if matches else (None, None, None)
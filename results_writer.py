@@ -0,0 +1,168 @@
+import csv
+import os
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import PatternFill
+
+# Percentage bands and their cell colours (lower bound inclusive)
+PERCENTAGE_COLORS = [
+    (0, '00FF00'),
+    (10, '66FF00'),
+    (20, 'CCFF00'),
+    (30, 'FFFF00'),
+    (40, 'FFCC00'),
+    (50, 'FF9900'),
+    (60, 'FF6600'),
+    (70, 'FF3300'),
+    (80, 'FF0000'),
+    (90, '990000'),
+]
+
+# One shared fill per colour instead of a new PatternFill per cell
+FILLS = {color: PatternFill(start_color=color, end_color=color, fill_type="solid") for _, color in PERCENTAGE_COLORS}
+
+# Function to pick the colour for a percentage (None outside 0-100)
+def color_for_percentage(percentage):
+    if not 0 <= percentage <= 100:
+        return None
+    color = None
+    for lower_bound, band_color in PERCENTAGE_COLORS:
+        if percentage >= lower_bound:
+            color = band_color
+    return color
+
+# Function to get the shared fill for a percentage (None outside 0-100)
+def fill_for_percentage(percentage):
+    color = color_for_percentage(percentage)
+    return FILLS[color] if color else None
+
+
+class XlsxResultsSink:
+    """
+    Streams rows into an openpyxl write-only workbook. Numeric cells from
+    color_from_column (1-based) onwards get the shared percentage fill as they
+    are written, so no second pass over the sheet is needed.
+    """
+
+    def __init__(self, path, headers, title=None, color_from_column=2):
+        self.path = path
+        self.color_from_column = color_from_column
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet(title)
+        self._sheet.append(headers)
+
+    def write_row(self, values):
+        cells = []
+        for col, value in enumerate(values, start=1):
+            if col >= self.color_from_column and isinstance(value, (int, float)) and not isinstance(value, bool):
+                cell = WriteOnlyCell(self._sheet, value=value)
+                fill = fill_for_percentage(value)
+                if fill is not None:
+                    cell.fill = fill
+                cells.append(cell)
+            else:
+                cells.append(value)
+        self._sheet.append(cells)
+
+    def close(self):
+        self._workbook.save(self.path)
+
+
+class CsvResultsSink:
+    """Appends rows to a CSV file, flushing each one so completed work survives a crash."""
+
+    def __init__(self, path, headers):
+        self.path = path
+        self._file = open(path, "w", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(headers)
+        self._file.flush()
+
+    def write_row(self, values):
+        self._writer.writerow(values)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetResultsSink:
+    """
+    Writes rows to Parquet in row groups of row_group_size (requires pyarrow).
+    Empty strings are stored as nulls so numeric columns keep a numeric type.
+    """
+
+    def __init__(self, path, headers, row_group_size=1000):
+        import pyarrow
+        import pyarrow.parquet
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self.headers = list(headers)
+        self.row_group_size = row_group_size
+        self._rows = []
+        self._writer = None
+
+    def write_row(self, values):
+        self._rows.append(["" if value is None else value for value in values])
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        columns = {}
+        for col, header in enumerate(self.headers):
+            column = [row[col] if col < len(row) else "" for row in self._rows]
+            columns[header] = [None if value == "" else value for value in column]
+        if self._writer is None:
+            table = self._pa.table(columns)
+            self._writer = self._pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = self._pa.table(columns).cast(self._writer.schema)
+        self._writer.write_table(table)
+        self._rows = []
+
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class MultiResultsSink:
+    """Fans each row out to several sinks."""
+
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def write_row(self, values):
+        for sink in self.sinks:
+            sink.write_row(values)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Function to open one sink per requested format next to output_path (xlsx, csv, parquet)
+def open_results_sinks(output_path, headers, formats=("xlsx", "csv"), title=None, color_from_column=2):
+    base, _ = os.path.splitext(output_path)
+    sinks = []
+    for output_format in formats:
+        path = f"{base}.{output_format}"
+        if output_format == "xlsx":
+            sinks.append(XlsxResultsSink(path, headers, title=title, color_from_column=color_from_column))
+        elif output_format == "csv":
+            sinks.append(CsvResultsSink(path, headers))
+        elif output_format == "parquet":
+            sinks.append(ParquetResultsSink(path, headers))
+        else:
+            raise ValueError(f"Unknown results format: {output_format}")
+    return MultiResultsSink(sinks)
@@ -0,0 +1,145 @@
+"""
+Rotation-tolerant perceptual hash ("rhash").
+
+pHash compares the image in Cartesian coordinates, so a flyer rotated by
+more than a few degrees hashes like an unrelated one. rhash works in
+polar-Fourier space instead:
+
+1. The centred square (which holds the inscribed circle that survives any
+   in-place rotation) is downsampled to 64x64 grayscale.
+2. It is resampled onto a polar grid (angle x radius), where a rotation
+   becomes a circular shift along the angle axis.
+3. The FFT magnitude along the angle axis removes that shift.
+4. Like pHash, a DCT is taken along the radius and each angular frequency
+   row is thresholded at its median, giving 64 bits.
+
+The result is an imagehash.ImageHash, so it is stored, indexed and compared
+exactly like the other hash types.
+
+    python rotation_hash.py IMAGE_FOLDER [--angles 10 15 45 90]
+
+benchmarks recall and cost against pHash, pHash with a lookup per angle, and
+ORB against every candidate.
+"""
+import os
+import time
+
+import cv2
+import imagehash
+import numpy as np
+import scipy.fftpack
+from PIL import Image
+
+HASH_SIZE = 8
+IMG_SIZE = 64
+POLAR_ANGLES = 128
+POLAR_RADII = 32
+
+# Function to downsample the centred square of an image to the working size
+def centered_square_pixels(image, img_size=IMG_SIZE):
+    gray = image.convert("L")
+    width, height = gray.size
+    side = min(width, height)
+    left = (width - side) // 2
+    top = (height - side) // 2
+    square = gray.crop((left, top, left + side, top + side)).resize((img_size, img_size), Image.LANCZOS)
+    return np.asarray(square, dtype=np.float32)
+
+# Function to compute the rotation-tolerant hash of a PIL image
+def rotation_hash(image, hash_size=HASH_SIZE):
+    pixels = centered_square_pixels(image)
+    centre = ((IMG_SIZE - 1) / 2, (IMG_SIZE - 1) / 2)
+    polar = cv2.warpPolar(pixels, (POLAR_RADII, POLAR_ANGLES), centre, IMG_SIZE / 2,
+                          cv2.INTER_LINEAR + cv2.WARP_POLAR_LINEAR)
+    # Rows are angular frequencies, columns radii; magnitudes do not change under rotation
+    spectrum = np.abs(np.fft.rfft(polar, axis=0))[:hash_size]
+    dct = scipy.fftpack.dct(spectrum, axis=1)[:, 1:hash_size + 1]
+    diff = dct > np.median(dct, axis=1, keepdims=True)
+    return imagehash.ImageHash(diff)
+
+# Function to compare recall and cost of the rotation strategies on a folder of originals
+def rotation_benchmark(paths, angles=(10, 15, 45, 90), fan_out_step=10):
+    """
+    Every original is rotated by every angle and looked up against all
+    originals. Returns one dict per method with recall@1, the mean time per
+    query in milliseconds and the one-off index build time in seconds.
+    """
+    from augmentation import rotate_array
+    from hash_index import HashIndex
+    from image_features import ImageFeatures, orb_similarity
+
+    originals = [Image.open(path).convert("RGB") for path in paths]
+    keys = [os.path.basename(path) for path in paths]
+    queries = [(key, Image.fromarray(rotate_array(np.asarray(image), angle)))
+               for key, image in zip(keys, originals) for angle in angles]
+
+    def phash_lookup(index, image):
+        return index.best_match(imagehash.phash(image))[0]
+
+    def phash_fan_out(index, image):
+        # One lookup per candidate angle, keeping the closest match overall
+        pixels = np.asarray(image)
+        best_key, best_distance = None, None
+        for angle in range(0, 360, fan_out_step):
+            key, distance = index.best_match(imagehash.phash(Image.fromarray(rotate_array(pixels, -angle))))
+            if best_distance is None or distance < best_distance:
+                best_key, best_distance = key, distance
+        return best_key
+
+    def rhash_lookup(index, image):
+        return index.best_match(rotation_hash(image))[0]
+
+    def orb_scan(candidates, image):
+        query = ImageFeatures(cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR))
+        scores = [orb_similarity(query, candidate) for candidate in candidates]
+        return keys[int(np.argmax(scores))]
+
+    def build_hash_index(hash_function):
+        return HashIndex.from_hashes([hash_function(image) for image in originals], keys)
+
+    def build_orb():
+        candidates = [ImageFeatures(cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)) for image in originals]
+        for candidate in candidates:
+            candidate.descriptors  # Extract up front so queries only pay for matching
+        return candidates
+
+    methods = [
+        ("phash", lambda: build_hash_index(imagehash.phash), phash_lookup),
+        (f"phash x{360 // fan_out_step} angles", lambda: build_hash_index(imagehash.phash), phash_fan_out),
+        ("rhash", lambda: build_hash_index(rotation_hash), rhash_lookup),
+        ("orb scan", build_orb, orb_scan),
+    ]
+    report = []
+    for name, build, lookup in methods:
+        start = time.perf_counter()
+        index = build()
+        build_seconds = time.perf_counter() - start
+        hits = 0
+        start = time.perf_counter()
+        for key, image in queries:
+            hits += lookup(index, image) == key
+        query_seconds = time.perf_counter() - start
+        report.append({
+            "method": name,
+            "queries": len(queries),
+            "recall_at_1": hits / len(queries) if queries else 0,
+            "ms_per_query": query_seconds / len(queries) * 1000 if queries else 0,
+            "build_seconds": build_seconds,
+        })
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark rotation recall of rhash against pHash and ORB.")
+    parser.add_argument("image_folder")
+    parser.add_argument("--angles", type=float, nargs="+", default=[10, 15, 45, 90])
+    args = parser.parse_args()
+
+    paths = [os.path.join(args.image_folder, f) for f in sorted(os.listdir(args.image_folder))
+             if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    print(f"{'method':<18} {'queries':>7} {'recall@1':>8} {'ms/query':>9} {'build s':>8}")
+    for row in rotation_benchmark(paths, args.angles):
+        print(f"{row['method']:<18} {row['queries']:>7} {row['recall_at_1']:>8.3f} "
+              f"{row['ms_per_query']:>9.2f} {row['build_seconds']:>8.2f}")
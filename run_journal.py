@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# Bump when the rows a script produces change, so journals from older code are not reused
+JOURNAL_VERSION = 1
+
+# Function to fingerprint an input file cheaply; a changed size or mtime means it is processed again
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+# Function to fingerprint a list of files (for example the control images a run compares against)
+def files_fingerprint(paths):
+    return {os.path.basename(path): file_fingerprint(path) for path in paths}
+
+# Function to derive the default journal path from a results path (results.xlsx -> results.journal.sqlite3)
+def default_journal_path(output_path):
+    base, _ = os.path.splitext(output_path)
+    return f"{base}.journal.sqlite3"
+
+
+class RunJournal:
+    """
+    SQLite journal of the images a batch run has finished, with their result
+    rows. Each row is committed as soon as it is produced, so an interrupted
+    or crashed run loses at most the image in flight. A restart with the same
+    config reuses the stored rows and only processes new or changed files.
+
+    config is any JSON-serializable description of what the rows depend on
+    (script, control images, parameters). Runs with different configs are
+    kept apart in the same file, so switching a parameter back resumes too.
+    """
+
+    def __init__(self, path, config):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.config = dict(config, journal_version=JOURNAL_VERSION)
+        self.config_key = hashlib.sha256(json.dumps(self.config, sort_keys=True).encode("utf-8")).hexdigest()
+        # Usable from a thread other than the creating one, one thread at a time
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS runs (
+                config_key TEXT PRIMARY KEY,
+                config TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rows (
+                config_key TEXT NOT NULL,
+                image TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                row TEXT NOT NULL,
+                completed REAL NOT NULL,
+                PRIMARY KEY (config_key, image)
+            )
+        """)
+        self._conn.execute(
+            "INSERT OR IGNORE INTO runs VALUES (?, ?, ?)",
+            (self.config_key, json.dumps(self.config, sort_keys=True), time.time()),
+        )
+        self._conn.commit()
+        self._rows = {
+            image: (fingerprint, row)
+            for image, fingerprint, row in self._conn.execute(
+                "SELECT image, fingerprint, row FROM rows WHERE config_key=?", (self.config_key,))
+        }
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def row(self, image, fingerprint):
+        """Returns the stored row for image if it was finished with the same fingerprint, else None."""
+        stored = self._rows.get(image)
+        if stored is None or stored[0] != fingerprint:
+            return None
+        return json.loads(stored[1])
+
+    def record(self, image, fingerprint, row):
+        """Stores a finished image's row and commits straight away."""
+        encoded = json.dumps(row)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?, ?)",
+            (self.config_key, image, fingerprint, encoded, time.time()),
+        )
+        self._conn.commit()
+        self._rows[image] = (fingerprint, encoded)
+
+    def clear(self):
+        """Forgets every finished image of this config, so the next run starts from scratch."""
+        self._conn.execute("DELETE FROM rows WHERE config_key=?", (self.config_key,))
+        self._conn.commit()
+        self._rows = {}
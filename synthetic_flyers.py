@@ -0,0 +1,153 @@
+"""
+Seeded synthetic flyer corpus for benchmarks.
+
+Each flyer is a flyer-like composition: a gradient background, a header
+band with a headline, a "photo" panel, coloured blocks and badges, price
+and body text. It has enough corners and edges that ORB finds features
+the way it does on real flyers. The same seed always gives the same pixels,
+so timings and scores can be compared across machines and commits without
+sharing the private image folders.
+
+    python synthetic_flyers.py OUTPUT_FOLDER [--count 20] [--seed 0] [--sizes 600x848 1240x1754]
+
+writes OUTPUT_FOLDER/originals and OUTPUT_FOLDER/random (controls drawn
+from a different seed), the two folders process_images expects.
+"""
+import os
+
+import cv2
+import numpy as np
+
+# (width, height) of A-series portrait flyers at roughly 72, 150 and 300 dpi
+FLYER_SIZES = ((600, 848), (1240, 1754), (2480, 3508))
+
+# Seed offset for the control images, so they never repeat an original
+RANDOM_SEED_OFFSET = 1_000_003
+
+_WORDS = ("SALE", "NEW", "OPEN", "FRESH", "DEALS", "WEEKEND", "MARKET", "SPECIAL",
+          "BIKES", "BOXES", "SUMMER", "LOCAL", "FREE", "TODAY", "ONLY", "LIVE")
+_FONTS = (cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_DUPLEX, cv2.FONT_HERSHEY_TRIPLEX,
+          cv2.FONT_HERSHEY_COMPLEX)
+
+# Helper to pick a random BGR colour as a tuple of ints (what OpenCV drawing expects)
+def _colour(rng, low=0, high=256):
+    return tuple(int(c) for c in rng.integers(low, high, 3))
+
+# Helper to draw text scaled to a target width, clipped to the canvas
+def _text(canvas, text, origin, width, rng, colour):
+    font = _FONTS[int(rng.integers(len(_FONTS)))]
+    thickness = max(1, width // 150)
+    (text_width, _), _ = cv2.getTextSize(text, font, 1.0, thickness)
+    scale = width / max(text_width, 1)
+    cv2.putText(canvas, text, origin, font, scale, colour, thickness, cv2.LINE_AA)
+
+# Helper to fill a panel with smooth blobs, standing in for a product photo
+def _photo(canvas, box, rng):
+    left, top, right, bottom = box
+    height, width = bottom - top, right - left
+    small = rng.integers(0, 256, (4, 4, 3), dtype=np.uint8)
+    panel = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(int(rng.integers(3, 8))):
+        centre = (int(rng.integers(width)), int(rng.integers(height)))
+        radius = int(rng.integers(min(width, height) // 10 + 1, min(width, height) // 3 + 2))
+        cv2.circle(panel, centre, radius, _colour(rng), -1, cv2.LINE_AA)
+    canvas[top:bottom, left:right] = panel
+
+# Function to draw one flyer as a BGR array
+def generate_flyer(seed, size=FLYER_SIZES[0]):
+    """
+    Returns a (height, width, 3) uint8 BGR flyer. The layout is drawn in
+    coordinates relative to the size, so one seed gives the same composition
+    at every resolution.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    unit = min(width, height)
+
+    # Vertical gradient background
+    top_colour, bottom_colour = np.array(_colour(rng)), np.array(_colour(rng))
+    ramp = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, np.newaxis, np.newaxis]
+    canvas = np.empty((height, width, 3), dtype=np.uint8)
+    canvas[:] = (top_colour * (1 - ramp) + bottom_colour * ramp).astype(np.uint8)
+
+    # Header band with the headline
+    band = int(height * rng.uniform(0.12, 0.2))
+    cv2.rectangle(canvas, (0, 0), (width, band), _colour(rng), -1)
+    headline = " ".join(rng.choice(_WORDS, int(rng.integers(1, 3))))
+    _text(canvas, headline, (int(width * 0.05), int(band * 0.75)), int(width * 0.9), rng, _colour(rng, 200))
+
+    # Photo panel
+    panel_top = band + int(height * 0.03)
+    panel_bottom = panel_top + int(height * rng.uniform(0.3, 0.45))
+    panel_left = int(width * rng.uniform(0.04, 0.1))
+    panel_right = width - int(width * rng.uniform(0.04, 0.1))
+    _photo(canvas, (panel_left, panel_top, panel_right, panel_bottom), rng)
+
+    # Coloured blocks and round badges
+    for _ in range(int(rng.integers(3, 8))):
+        x, y = int(rng.integers(width)), int(rng.integers(panel_bottom, height))
+        w, h = int(rng.integers(unit // 12, unit // 3)), int(rng.integers(unit // 20, unit // 6))
+        cv2.rectangle(canvas, (x, y), (x + w, y + h), _colour(rng), -1)
+    for _ in range(int(rng.integers(1, 4))):
+        centre = (int(rng.integers(width)), int(rng.integers(height)))
+        radius = int(rng.integers(unit // 16, unit // 7))
+        cv2.circle(canvas, centre, radius, _colour(rng), -1, cv2.LINE_AA)
+        _text(canvas, f"{int(rng.integers(10, 90))}%", (centre[0] - radius // 2, centre[1] + radius // 4),
+              radius, rng, _colour(rng, 200))
+
+    # Price and body lines
+    price_y = panel_bottom + int(height * 0.1)
+    _text(canvas, f"${int(rng.integers(1, 500))}.{int(rng.integers(0, 100)):02d}",
+          (int(width * 0.08), price_y), int(width * rng.uniform(0.3, 0.5)), rng, _colour(rng, 0, 80))
+    line_height = max(12, height // 28)
+    for line in range(int(rng.integers(3, 7))):
+        y = price_y + (line + 1) * line_height
+        if y >= height - line_height // 2:
+            break
+        words = " ".join(rng.choice(_WORDS, int(rng.integers(3, 7)))).lower()
+        _text(canvas, words, (int(width * 0.08), y), int(width * rng.uniform(0.5, 0.85)), rng, _colour(rng, 0, 80))
+    return canvas
+
+# Function to write a seeded corpus of flyers as JPEGs; returns the file paths
+def write_corpus(folder, count, sizes=FLYER_SIZES[:1], seed=0, quality=90):
+    """
+    Writes count flyers per size as flyer_<index>_<width>x<height>.jpg. The
+    index picks the composition, so the same index at two sizes is the same
+    flyer. Existing files are kept, making repeated runs cheap.
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for index in range(count):
+        for width, height in sizes:
+            path = os.path.join(folder, f"flyer_{index:03d}_{width}x{height}.jpg")
+            if not os.path.exists(path):
+                flyer = generate_flyer(seed + index, (width, height))
+                cv2.imwrite(path, flyer, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            paths.append(path)
+    return paths
+
+# Function to write the originals and control folders that process_images expects
+def write_evaluation_corpus(folder, count, sizes=FLYER_SIZES[:1], seed=0, random_count=5):
+    originals = os.path.join(folder, "originals")
+    controls = os.path.join(folder, "random")
+    write_corpus(originals, count, sizes, seed)
+    write_corpus(controls, random_count, sizes[:1], seed + RANDOM_SEED_OFFSET)
+    return originals, controls
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def parse_size(text):
+        width, height = text.lower().split("x")
+        return int(width), int(height)
+
+    parser = argparse.ArgumentParser(description="Write a seeded synthetic flyer corpus.")
+    parser.add_argument("output_folder")
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sizes", type=parse_size, nargs="+", default=list(FLYER_SIZES[:1]))
+    args = parser.parse_args()
+
+    originals, controls = write_evaluation_corpus(args.output_folder, args.count, args.sizes, args.seed)
+    print(f"Wrote {originals} and {controls}")
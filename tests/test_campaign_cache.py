@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from campaign_cache import CampaignCache
+from fake_firestore import FakeDocumentReference, FakeFirestoreClient
+
+
+class SilentWatch:
+    def unsubscribe(self):
+        pass
+
+
+def test_snapshot_get_raises_for_missing_field():
+    db = FakeFirestoreClient()
+    db.collection("campaign_one").document("flyers").set({"hashes": []})
+    snapshot = db.collection("campaign_one").document("flyers").get()
+    with pytest.raises(KeyError):
+        snapshot.get("version")
+    assert db.collection("campaign_one").document("bikes").get().get("version") is None
+
+
+def test_version_mode_handles_documents_without_version_field():
+    db = FakeFirestoreClient()
+    document = db.collection("campaign_one").document("flyers")
+    document.set({"hashes": ["aaaaaaaaaaaaaaaa"]})
+    cache = CampaignCache(db, mode="version", max_age=0)
+
+    assert cache.get("flyers").hashes == ["aaaaaaaaaaaaaaaa"]
+    reads = db.reads
+    # Unchanged: only the version probe is read, keyed on update_time
+    assert cache.get("flyers").hashes == ["aaaaaaaaaaaaaaaa"]
+    assert db.reads == reads + 1
+
+    document.set({"hashes": ["aaaaaaaaaaaaaaaa", "0000000000000000"]})
+    db._update_times[document._key] += 1  # The fake clock can repeat within one test
+    assert cache.get("flyers").hashes == ["aaaaaaaaaaaaaaaa", "0000000000000000"]
+
+
+def test_listener_timeout_clears_the_watch(monkeypatch):
+    # Listeners that never receive their first snapshot
+    monkeypatch.setattr(FakeDocumentReference, "on_snapshot", lambda self, callback: SilentWatch())
+    cache = CampaignCache(FakeFirestoreClient(), snapshot_timeout=0.01)
+    with pytest.raises(TimeoutError):
+        cache.get("flyers")
+    assert "flyers" not in cache._watches
+    # The next get subscribes again rather than reporting a hit on an empty cache
+    with pytest.raises(TimeoutError):
+        cache.get("flyers")
+    assert cache.misses == 2 and cache.hits == 0
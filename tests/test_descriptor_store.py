@@ -0,0 +1,41 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from descriptor_store import HEADER, DescriptorStore, write_descriptor_store
+
+
+def entries():
+    rng = np.random.default_rng(0)
+    return [(name, None, rng.integers(0, 256, (count, 32), dtype=np.uint8))
+            for name, count in (("plain", 3), ("two\nlines", 2), ("", 0), ("last", 1))]
+
+
+def test_names_with_newlines_round_trip(tmp_path):
+    path = str(tmp_path / "store.orbs")
+    write_descriptor_store(path, entries())
+    store = DescriptorStore(path)
+    assert store.names == ["plain", "two\nlines", "", "last"]
+    for name, _, descriptors in entries():
+        assert np.array_equal(store.descriptors(name), descriptors)
+
+
+def test_version_1_stores_still_load(tmp_path):
+    path = str(tmp_path / "store.orbs")
+    write_descriptor_store(path, [entry for entry in entries() if "\n" not in entry[0]])
+    # Rewrite it as version 1, which stored the names joined by newlines
+    with open(path, "r+b") as f:
+        fields = list(HEADER.unpack(f.read(HEADER.size)))
+        fields[1] = 1
+        f.seek(0)
+        f.write(HEADER.pack(*fields))
+        f.seek(fields[-1])
+        f.truncate()
+        f.write("\n".join(["plain", "", "last"]).encode("utf-8"))
+
+    store = DescriptorStore(path)
+    assert store.names == ["plain", "", "last"]
+    assert len(store.descriptors("last")) == 1
@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feature_cache import FeatureCache
+
+
+def stored_bytes(cache):
+    return cache._conn.execute("SELECT COALESCE(SUM(size), 0) FROM features").fetchone()[0]
+
+
+def test_running_total_tracks_puts_replacements_and_evictions(tmp_path):
+    cache = FeatureCache(str(tmp_path / "cache.sqlite3"), max_bytes=35)
+    for i in range(3):
+        cache.put(f"h{i}", "phash", "x" * 10)
+    cache.put("h1", "phash", "x" * 4)  # Replacing an entry counts only its new size
+    assert cache.total_bytes() == stored_bytes(cache) == 24
+
+    cache.put("h3", "phash", "x" * 20)
+    assert cache.total_bytes() == stored_bytes(cache) <= 35
+    cache.close()
+
+    # A reopened cache starts from the stored total
+    reopened = FeatureCache(str(tmp_path / "cache.sqlite3"))
+    assert reopened.total_bytes() == stored_bytes(reopened) > 0
+    reopened.close()
+
+
+def test_buffered_hits_still_protect_entries_from_eviction(tmp_path):
+    cache = FeatureCache(str(tmp_path / "cache.sqlite3"), max_bytes=30, touch_batch=100)
+    for i in range(3):
+        cache.put(f"h{i}", "phash", "x" * 10)
+    assert cache.get("h0", "phash") == "x" * 10
+    assert cache._touched  # The hit has not been written yet
+
+    cache.put("h3", "phash", "x" * 10)
+    assert cache.get("h0", "phash") is not None
+    assert cache.get("h1", "phash") is None
+    cache.close()
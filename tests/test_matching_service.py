@@ -0,0 +1,106 @@
+import io
+import json
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import cv2
+import imagehash
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matching_service
+from local_store import LocalCampaignStore
+from matching_service import MatchingService
+from synthetic_flyers import generate_flyer
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = MatchingService(LocalCampaignStore(str(tmp_path)))
+    yield service
+    service.close()
+
+
+def flyer_bytes(seed):
+    return cv2.imencode(".jpg", generate_flyer(seed))[1].tobytes()
+
+
+def test_bad_hash_fails_alone_and_worker_keeps_serving(service):
+    image_hash = service.add("flyers", flyer_bytes(1))
+
+    with pytest.raises(ValueError):
+        service.submit("flyers", image_hash="zz-not-hex").result(timeout=10)
+    assert service._worker.is_alive()
+
+    matches = service.submit("flyers", image_hash=image_hash).result(timeout=10)
+    assert matches[0].key == image_hash
+
+
+def test_bad_request_in_a_batch_does_not_fail_the_others(service):
+    image = flyer_bytes(2)
+    image_hash = service.add("flyers", image)
+
+    bad = service.submit("flyers", image_hash="zz-not-hex")
+    undecodable = service.submit("flyers", image_bytes=b"not an image")
+    good = service.submit("flyers", image_bytes=image)
+
+    with pytest.raises(ValueError):
+        bad.result(timeout=10)
+    with pytest.raises(ValueError):
+        undecodable.result(timeout=10)
+    assert good.result(timeout=10)[0].key == image_hash
+    assert service._worker.is_alive()
+
+
+def test_added_image_hashes_like_hash_core_and_matches_itself(service):
+    image = flyer_bytes(3)
+    image_hash = service.add("flyers", image)
+    service.add("flyers", flyer_bytes(4))
+    assert image_hash == str(imagehash.phash(Image.open(io.BytesIO(image))))
+
+    matches = service.match("flyers", image_bytes=image)
+    assert matches[0].key == image_hash and matches[0].accepted
+    assert not [match for match in matches[1:] if match.accepted]
+
+
+def test_near_returns_the_same_hashes_from_the_scan_and_the_radius_index(service, monkeypatch):
+    image = flyer_bytes(5)
+    image_hash = service.add("flyers", image)
+    service.add("flyers", flyer_bytes(6))
+    scanned = service.near("flyers", image_bytes=image, radius=20)
+    assert scanned[0] == (image_hash, 0)
+
+    monkeypatch.setattr(matching_service, "RADIUS_INDEX_MIN_SIZE", 0)
+    monkeypatch.setattr(matching_service, "RADIUS_INDEX_MAX_FRACTION", 1.0)
+    assert service.near("flyers", image_hash=image_hash, radius=20) == scanned
+
+
+def test_http_errors_map_unknown_documents_to_404_and_bad_k_to_400(service):
+    image_hash = service.add("flyers", flyer_bytes(7))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), matching_service.make_handler(service))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def post(payload):
+        request = urllib.request.Request(f"http://127.0.0.1:{server.server_port}/match",
+                                         data=json.dumps(payload).encode("utf-8"), method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    try:
+        assert post({"document": "flyers", "hash": image_hash}) == 200
+        assert post({"document": "bikes", "hash": image_hash}) == 404
+        assert post({"document": "flyers", "hash": image_hash, "k": 0}) == 400
+        # A missing field is a bad request, not an unknown document
+        assert post({"document": "flyers"}) == 400
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,60 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bitops import popcount64
+from mih_index import MultiIndexHashIndex, similarity_to_radius
+
+
+def brute_force(stored, query, radius):
+    keys = list(stored)
+    hashes = np.array([stored[key] for key in keys], dtype=np.uint64)
+    distances = popcount64(np.bitwise_xor(hashes, np.uint64(query)))
+    return sorted((keys[i], int(distances[i])) for i in np.nonzero(distances <= radius)[0])
+
+
+def test_radius_queries_match_a_full_scan_through_inserts_and_deletes():
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 2 ** 63, 5000, dtype=np.uint64)
+    # Near duplicates, so every query has matches at small radii
+    values[:500] = values[500:1000] ^ (np.uint64(1) << rng.integers(0, 63, 500).astype(np.uint64))
+    stored = {f"k{i}": int(value) for i, value in enumerate(values)}
+    index = MultiIndexHashIndex.build(list(stored.values()), list(stored))
+
+    # A delta that has not been folded into the tables yet, a replaced key and deletions
+    index.min_rebuild = 10 ** 6
+    for i in range(5000, 5200):
+        stored[f"k{i}"] = int(rng.integers(0, 2 ** 63))
+        index.insert(f"k{i}", stored[f"k{i}"])
+    stored["k3"] = stored["k600"] ^ 1
+    index.insert("k3", stored["k3"])
+    for key in ("k600", "k5100", "k42"):
+        del stored[key]
+        index.delete(key)
+
+    for phase in ("delta", "rebuilt"):
+        for key in ("k3", "k501", "k5150", "k4000"):
+            for radius in (0, 4, 8, 12):
+                result = index.query_radius(stored[key], radius)
+                assert sorted(result.matches) == brute_force(stored, stored[key], radius), (phase, key, radius)
+                distances = [distance for _, distance in result.matches]
+                assert distances == sorted(distances)
+        index.rebuild()
+    assert len(index) == len(stored)
+
+
+def test_small_radius_examines_a_fraction_of_the_corpus():
+    rng = np.random.default_rng(1)
+    values = [int(value) for value in rng.integers(0, 2 ** 63, 20000, dtype=np.uint64)]
+    index = MultiIndexHashIndex.build(values)
+    result = index.query_radius(values[0], 8)
+    assert (str(values[0]), 0) in result.matches
+    assert result.candidates < len(values) / 10
+    assert result.probes == 4 * 137
+
+
+def test_similarity_to_radius():
+    assert similarity_to_radius(70) == 19
@@ -0,0 +1,165 @@
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# One detected object: name, confidence and normalized (x, y) bounding polygon
+LocalizedObject = namedtuple("LocalizedObject", ["name", "score", "vertices"])
+
+# Images per annotate request (the synchronous Vision API accepts up to 16)
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_CACHE_SIZE = 4096
+
+# Helper to read image bytes from a path, or pass bytes through
+def _read_content(item):
+    if isinstance(item, (bytes, bytearray)):
+        return bytes(item)
+    with open(item, "rb") as image_file:
+        return image_file.read()
+
+# Function to key results by image content
+def content_digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class GoogleVisionBackend:
+    """Google Cloud Vision object localization, sharing one client for all requests."""
+
+    def __init__(self, client=None):
+        self._client = client
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from google.cloud import vision
+                self._client = vision.ImageAnnotatorClient()
+            return self._client
+
+    def localize_batch(self, contents):
+        from google.cloud import vision
+        feature = vision.Feature(type_=vision.Feature.Type.OBJECT_LOCALIZATION)
+        requests = [vision.AnnotateImageRequest(image=vision.Image(content=content), features=[feature])
+                    for content in contents]
+        response = self.client.batch_annotate_images(requests=requests)
+        results = []
+        for image_response in response.responses:
+            if image_response.error.message:
+                raise RuntimeError(f"Vision API error: {image_response.error.message}")
+            results.append([
+                LocalizedObject(object_.name, object_.score,
+                                [(vertex.x, vertex.y) for vertex in object_.bounding_poly.normalized_vertices])
+                for object_ in image_response.localized_object_annotations
+            ])
+        return results
+
+
+class StubVisionBackend:
+    """
+    Offline backend for tests and local runs. Returns canned objects per content
+    digest (or the default list) and records how many requests and images it saw.
+    """
+
+    def __init__(self, responses=None, default=()):
+        self.responses = dict(responses or {})
+        self.default = list(default)
+        self.requests = 0
+        self.images = 0
+        self._lock = threading.Lock()
+
+    def localize_batch(self, contents):
+        with self._lock:
+            self.requests += 1
+            self.images += len(contents)
+        return [list(self.responses.get(content_digest(content), self.default)) for content in contents]
+
+
+class VisionService:
+    """
+    Object localization with one shared backend, batched annotate requests, at
+    most max_in_flight concurrent requests and an LRU cache keyed by image
+    content, so re-submitting the same flyer makes no API call.
+    """
+
+    def __init__(self, backend=None, batch_size=DEFAULT_BATCH_SIZE,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, cache_size=DEFAULT_CACHE_SIZE):
+        self.backend = backend if backend is not None else GoogleVisionBackend()
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="vision")
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, digest):
+        with self._lock:
+            if digest in self._cache:
+                self._cache.move_to_end(digest)
+                self.hits += 1
+                return self._cache[digest]
+        return None
+
+    def _remember(self, digest, objects):
+        with self._lock:
+            self._cache[digest] = objects
+            self._cache.move_to_end(digest)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _annotate(self, digests, contents):
+        results = self.backend.localize_batch(contents)
+        for digest, objects in zip(digests, results):
+            self._remember(digest, objects)
+        return results
+
+    def localize_many(self, items):
+        """Returns a list of LocalizedObject lists, one per path or bytes item, in order."""
+        digests = []
+        known = {}
+        pending = OrderedDict()
+        for item in items:
+            content = _read_content(item)
+            digest = content_digest(content)
+            digests.append(digest)
+            if digest in known or digest in pending:
+                continue
+            cached = self._cached(digest)
+            if cached is not None:
+                known[digest] = cached
+            else:
+                pending[digest] = content
+
+        with self._lock:
+            self.misses += len(pending)
+        missing = list(pending.items())
+        batches = []
+        for start in range(0, len(missing), self.batch_size):
+            batch_digests = [digest for digest, _ in missing[start:start + self.batch_size]]
+            batch_contents = [content for _, content in missing[start:start + self.batch_size]]
+            batches.append((batch_digests, self._executor.submit(self._annotate, batch_digests, batch_contents)))
+
+        for batch_digests, future in batches:
+            known.update(zip(batch_digests, future.result()))
+        return [known[digest] for digest in digests]
+
+    def localize(self, item):
+        return self.localize_many([item])[0]
+
+    def submit(self, item):
+        """Localizes in the background; returns a Future so GUI code does not block."""
+        content = _read_content(item)
+        digest = content_digest(content)
+        cached = self._cached(digest)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+        with self._lock:
+            self.misses += 1
+        return self._executor.submit(lambda: self._annotate([digest], [content])[0])
+
+    def close(self):
+        self._executor.shutdown(wait=True)